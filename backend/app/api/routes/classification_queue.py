@@ -0,0 +1,214 @@
+import asyncio
+import itertools
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from db.classification_jobs import ClassificationJobStore, classification_job_store
+from fastapi import APIRouter
+from .gmail.scheduler import TokenBucket
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Workers classifying in the background; 0 leaves classification to the analyze endpoints
+CLASSIFICATION_WORKERS = int(os.environ.get("CLASSIFICATION_WORKERS", "2"))
+
+# Emails one worker fetches and classifies together
+CLASSIFICATION_BATCH_SIZE = int(os.environ.get("CLASSIFICATION_BATCH_SIZE", "20"))
+
+# Emails classified per second across all workers, so background work never starves requests
+CLASSIFICATION_RATE = float(os.environ.get("CLASSIFICATION_RATE", "5"))
+
+CLASSIFICATION_MAX_ATTEMPTS = 3
+
+
+def _priority(unread: bool, internal_date: int) -> Tuple[int, int]:
+    # Unread mail first, then newest first
+    return (0 if unread else 1, -internal_date)
+
+
+class ClassificationQueue:
+    """
+    Classifies synced emails in the background, unread and recent mail first.
+
+    Jobs are kept in the ClassificationJobStore, so pending work survives restarts; the in-memory
+    priority queue only orders the pending jobs of the running app.
+    """
+
+    def __init__(self, store: ClassificationJobStore = classification_job_store, workers: int = CLASSIFICATION_WORKERS,
+                 batch_size: int = CLASSIFICATION_BATCH_SIZE, rate: float = CLASSIFICATION_RATE):
+        self.store = store
+        self.workers = workers
+        self.batch_size = max(1, batch_size)
+        self.rate = rate
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._queued: Set[Tuple[str, str]] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._bucket: Optional[TokenBucket] = None
+        # Tie-breaker so queue entries never compare user and message IDs
+        self._sequence = itertools.count()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def _put(self, user_id: str, message_id: str, unread: bool, internal_date: int):
+        if (user_id, message_id) in self._queued:
+            return
+        self._queued.add((user_id, message_id))
+        self._queue.put_nowait((_priority(unread, internal_date), next(self._sequence), user_id, message_id))
+
+    async def start(self):
+        """Loads the pending jobs and starts the workers. Called from the app lifespan."""
+        if self.running or self.workers <= 0:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._bucket = TokenBucket(self.rate, max(self.rate, self.batch_size))
+        self.store.reset_running()
+        for user_id, message_id, unread, internal_date in self.store.list_pending():
+            self._put(user_id, message_id, unread, internal_date)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers. Jobs they were running are picked up again on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._queued.clear()
+
+    def enqueue(self, emails: Iterable[Dict[str, Any]], user_id: str = "me") -> int:
+        """
+        Adds a job for each synced email that has none yet. Nothing is added when there are no
+        workers, since classification is then left to the analyze endpoints.
+
+        Args:
+            emails: Parsed emails, as returned by the sync endpoints
+            user_id: The user the emails belong to
+
+        Returns:
+            The number of jobs added
+        """
+        if self.workers <= 0:
+            return 0
+        jobs = {
+            email_data["id"]: ("UNREAD" in email_data.get("labels", []), int(email_data.get("internalDate") or 0))
+            for email_data in emails
+            if not email_data.get("error")
+        }
+        added = self.store.add_many(((message_id, *job) for message_id, job in jobs.items()), user_id)
+        if self.running:
+            for message_id in added:
+                self._put(user_id, message_id, *jobs[message_id])
+        return len(added)
+
+    def discard(self, message_ids: Iterable[str], user_id: str = "me"):
+        """Drops the jobs of deleted emails. Queue entries left behind fail quietly when fetched."""
+        self.store.delete_many(message_ids, user_id)
+
+    async def _next_batch(self) -> List[Tuple[str, str]]:
+        _, _, user_id, message_id = await self._queue.get()
+        batch = [(user_id, message_id)]
+        while len(batch) < self.batch_size and not self._queue.empty():
+            _, _, user_id, message_id = self._queue.get_nowait()
+            batch.append((user_id, message_id))
+        for job in batch:
+            self._queued.discard(job)
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = []
+            try:
+                batch = await self._next_batch()
+                await self._bucket.acquire(len(batch))
+                by_user: Dict[str, List[str]] = {}
+                for user_id, message_id in batch:
+                    by_user.setdefault(user_id, []).append(message_id)
+                for user_id, message_ids in by_user.items():
+                    await self._classify(message_ids, user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The worker carries on; the batch is tried again behind every other job
+                logger.exception("Classifying a batch of %d emails failed", len(batch))
+                self._requeue(batch, str(e))
+
+    def _requeue(self, batch: List[Tuple[str, str]], error: str):
+        """Records the jobs of a batch that failed outside _classify as failed, queuing those with attempts left."""
+        by_user: Dict[str, List[str]] = {}
+        for user_id, message_id in batch:
+            by_user.setdefault(user_id, []).append(message_id)
+        for user_id, message_ids in by_user.items():
+            try:
+                retry = self.store.mark_failed(
+                    ((message_id, error) for message_id in message_ids),
+                    CLASSIFICATION_MAX_ATTEMPTS, user_id)
+            except Exception:
+                # The store is unusable too: the jobs are made pending again on the next start
+                logger.exception("Recording failed classification jobs failed")
+                continue
+            for message_id in retry:
+                self._put(user_id, message_id, False, 0)
+
+    async def _classify(self, message_ids: List[str], user_id: str):
+        # Imported here: the sync endpoints that enqueue jobs live in the modules these import
+        from api.routes.email_analysis import get_email_categorization_agent, save_classifications
+        from api.routes.gmail.get_mails import get_emails_by_ids
+
+        self.store.mark_running(message_ids, user_id)
+        failures = []
+        try:
+            emails = []
+            for email_data in await get_emails_by_ids(message_ids):
+                if email_data.get("error"):
+                    failures.append((email_data["id"], "Email could not be retrieved"))
+                    continue
+                emails.append({
+                    "id": email_data["id"],
+                    "subject": email_data["subject"],
+                    "body": email_data.get("body") or email_data["snippet"],
+                    "threadId": email_data.get("threadId", ""),
+                    "from": email_data.get("from", ""),
+                    "internalDate": email_data.get("internalDate", 0),
+                })
+            agent = await asyncio.to_thread(get_email_categorization_agent)
+            results = await agent.categorize_emails(emails)
+            await save_classifications(emails, results, user_id)
+        except asyncio.CancelledError:
+            self.store.mark_pending(message_ids, user_id)
+            raise
+        except Exception as e:
+            failures = [(message_id, str(e)) for message_id in message_ids]
+            results = {}
+
+        self.store.mark_done(
+            ((message_id, result["category"], result["source"]) for message_id, result in results.items()), user_id)
+        retry = self.store.mark_failed(failures, CLASSIFICATION_MAX_ATTEMPTS, user_id)
+        # Retries wait behind every other job
+        for message_id in retry:
+            self._put(user_id, message_id, False, 0)
+
+    def get_status(self, user_id: str = "me") -> Dict[str, Any]:
+        return {
+            **self.store.count_by_status(user_id),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "workers": len(self._tasks),
+            "rate": self.rate,
+        }
+
+
+classification_queue = ClassificationQueue()
+
+
+@router.get("/queue-status")
+async def queue_status():
+    """
+    Get the progress of background classification.
+
+    Returns:
+        Dict with the number of pending, running, done and failed classification jobs, the jobs
+        queued in memory, the number of workers and the classification rate (emails per second)
+    """
+    return classification_queue.get_status()
@@ -1,18 +1,262 @@
-from http.client import HTTPException
-from api.routes.gmail.get_mail import get_email
-from fastapi import APIRouter
-from llm.email_agent import EmailCategorizationAgent
+from api.routes.gmail.get_mail import get_email_by_id
+from api.routes.gmail.get_mails import get_emails_by_ids
+from db.application_store import application_store
+from db.email_repository import email_repository
+from llm.llm_scheduler import llm_scheduler
+from llm.local_classifier import retrain
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+import asyncio
+import threading
 
 router = APIRouter()
-email_categorization_agent = EmailCategorizationAgent()
+
+_email_categorization_agent = None
+_agent_lock = threading.Lock()
+
+# Emails accepted by one analyze-batch request
+MAX_ANALYZE_BATCH_SIZE = 500
+
+
+class EmailPayload(BaseModel):
+    id: str
+    subject: str = ""
+    body: str = ""
+    thread_id: str = ""
+    sender: str = ""
+
+
+class AnalyzeBatchRequest(BaseModel):
+    email_ids: List[str] = []
+    emails: List[EmailPayload] = []
+
+
+def get_email_categorization_agent():
+    """
+    Returns the app-wide email categorization agent, building it on first use.
+
+    Building the agent imports LangGraph and LangChain, creates the Gemini client and compiles
+    the workflow graph, so it is kept out of import time; async callers run this in a thread
+    so the first one does not block the event loop. Set WARM_UP_AGENT to build it
+    from the app lifespan instead of on the first request.
+    """
+    global _email_categorization_agent
+    if _email_categorization_agent is None:
+        with _agent_lock:
+            if _email_categorization_agent is None:
+                from llm.email_agent import EmailCategorizationAgent
+                _email_categorization_agent = EmailCategorizationAgent()
+    return _email_categorization_agent
+
+
+async def save_classifications(emails: List[Dict], results: Dict[str, Dict], user_id: str = "me"):
+    """
+    Records new classifications: as events of the job applications they belong to, and in
+    Supabase, buffered for the next batched write, when it is configured.
+    """
+    application_store.record_classifications(emails, results, user_id)
+    if email_repository is not None:
+        await email_repository.save_classifications(emails, results, user_id)
 
 
 @router.post("/analyze-email/{email_id}")
 async def analyze_email(email_id: str):
-    email_data = await get_email(email_id)
+    email_data = (await get_email_by_id(email_id))["data"]
     if email_data is None:
         raise HTTPException(status_code=404, detail="Email not found")
     subject = email_data["subject"]
-    content = email_data["body"] if "body" in email_data else email_data["snippet"]
-    result = await email_categorization_agent.categorize_email(subject, content)
-    return result
+    content = email_data.get("body") or email_data["snippet"]
+    agent = await asyncio.to_thread(get_email_categorization_agent)
+    details = await agent.categorize_email_with_details(
+        subject, content, email_id, email_data.get("threadId", ""), email_data.get("from", ""))
+    await save_classifications([email_data], {email_id: details})
+    return details["category"]
+
+
+@router.post("/analyze-batch")
+async def analyze_batch(request: AnalyzeBatchRequest):
+    """
+    Categorize many emails in one request. Emails given by ID are read from the local
+    message store or fetched through the Gmail batch endpoint; emails given as payloads
+    are categorized as they are. Near-duplicates within a thread or from the same sender are
+    categorized once.
+
+    Args:
+        request: The IDs of emails to fetch and/or the emails themselves
+
+    Returns:
+        Dict with "results", mapping each email ID to its category and the source that decided it,
+        and "errors", mapping the IDs of emails that could not be fetched to the reason
+    """
+    if len(request.email_ids) + len(request.emails) > MAX_ANALYZE_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_ANALYZE_BATCH_SIZE} emails can be analyzed per request"
+        )
+
+    emails = [{"id": email.id, "subject": email.subject, "body": email.body,
+               "threadId": email.thread_id, "from": email.sender} for email in request.emails]
+    errors: Dict[str, str] = {}
+    email_ids = list(dict.fromkeys(request.email_ids))
+    if email_ids:
+        for email_data in await get_emails_by_ids(email_ids):
+            if email_data.get("error"):
+                errors[email_data["id"]] = "Email could not be retrieved"
+                continue
+            emails.append({
+                "id": email_data["id"],
+                "subject": email_data["subject"],
+                "body": email_data.get("body") or email_data["snippet"],
+                "threadId": email_data.get("threadId", ""),
+                "from": email_data.get("from", ""),
+                "internalDate": email_data.get("internalDate", 0),
+            })
+
+    try:
+        agent = await asyncio.to_thread(get_email_categorization_agent)
+        results = await agent.categorize_emails(emails)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while analyzing the emails: {str(e)}"
+        )
+    await save_classifications(emails, results)
+
+    return {
+        "results": results,
+        "errors": errors
+    }
+
+
+@router.get("/classified")
+async def list_classified(category: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100):
+    """
+    List classified emails stored in Supabase, newest first, one page at a time.
+
+    Args:
+        category: Only list emails of this category
+        cursor: The "next_cursor" of the previous page, to get the following one
+        limit: The most emails per page (at most 500)
+
+    Returns:
+        Dict with the "emails" of the page, each with its category and the reasoning behind it,
+        and the "next_cursor" of the following page (None on the last page)
+    """
+    if email_repository is None:
+        raise HTTPException(status_code=503, detail="Supabase is not configured")
+    try:
+        return await email_repository.list_emails(category=category, limit=max(1, min(limit, 500)), cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while listing the classified emails: {str(e)}"
+        )
+
+
+@router.get("/applications")
+async def list_applications(status: Optional[str] = None):
+    """
+    Get the job applications tracked from classified emails, for a dashboard. Read from the
+    incrementally kept aggregates, so the cost grows with the applications, not the emails.
+
+    Args:
+        status: Only list applications whose latest status is this one
+
+    Returns:
+        Dict with the number of applications per latest status, the total, and the applications,
+        most recently updated first, each with its company, sender domain, latest status and
+        email, first and latest email time and number of emails
+    """
+    return application_store.get_dashboard(status=status)
+
+
+@router.post("/applications/rebuild")
+async def rebuild_applications():
+    """
+    Rebuild the job application aggregates from scratch out of the recorded events, to verify the
+    incrementally kept ones. Also available as `python -m db.application_store`.
+
+    Returns:
+        Dict with the number of applications rebuilt and the applications and status counters
+        that differed from the incremental aggregates, per user
+    """
+    return await asyncio.to_thread(application_store.rebuild)
+
+
+@router.get("/repository-stats")
+async def repository_stats():
+    """
+    Get how classifications were written to Supabase since startup.
+
+    Returns:
+        Dict with the rows buffered and written, the flushes and round trips they took, failed
+        flushes, the rows still waiting, and the batch size and flush interval in use
+    """
+    if email_repository is None:
+        raise HTTPException(status_code=503, detail="Supabase is not configured")
+    return email_repository.get_stats()
+
+
+@router.get("/cache-stats")
+async def cache_stats():
+    """
+    Get the hit and miss counters of the classification cache.
+
+    Returns:
+        Dict with memory and durable-store hits, misses, the hit rate, the number of cached
+        classifications and the model and prompt version they belong to
+    """
+    agent = await asyncio.to_thread(get_email_categorization_agent)
+    return agent.cache.get_stats()
+
+
+@router.get("/preprocessing-stats")
+async def preprocessing_stats():
+    """
+    Get how much preprocessing shrank the emails sent to the LLM since startup.
+
+    Returns:
+        Dict with the number of emails preprocessed, their estimated prompt tokens before and after,
+        and the overall reduction ratio
+    """
+    agent = await asyncio.to_thread(get_email_categorization_agent)
+    return agent.get_preprocessing_stats()
+
+
+@router.get("/llm-stats")
+async def llm_stats():
+    """
+    Get how the LLM calls went since startup.
+
+    Returns:
+        Dict with the number of calls, retries, hedged requests and hedges that answered first,
+        calls that missed their deadline or kept failing (and were categorized as unknown),
+        and the concurrency limit, timeouts and hedging delay in use
+    """
+    return llm_scheduler.get_stats()
+
+
+@router.post("/local-classifier/retrain")
+async def retrain_local_classifier():
+    """
+    Retrain the local classifier from every email the LLM has categorized so far, and start using it.
+
+    Returns:
+        Dict with the number of emails trained on, the categories the model tells apart and the
+        confidence above which its answers skip the LLM
+    """
+    try:
+        model = await asyncio.to_thread(retrain)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    agent = await asyncio.to_thread(get_email_categorization_agent)
+    agent.reload_local_classifier(model)
+    return {
+        "status": "success",
+        "num_examples": model.num_examples,
+        "categories": model.categories,
+        "threshold": agent.local_classifier_threshold
+    }
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import uuid
+from typing import List, Dict, Any, Tuple, AsyncIterator, Callable
+from urllib.parse import urlencode
+import aiohttp
+from .scheduler import RetryableStatusError, gmail_scheduler, is_retryable_status
+
+GMAIL_BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+
+# Gmail rejects batches with more than 100 sub-requests
+MAX_BATCH_SIZE = 100
+
+# Gmail accepts at most 1000 message IDs per batchModify / batchDelete call
+MAX_BATCH_MUTATION_SIZE = 1000
+
+_CONTENT_ID_PREFIX = "msg-"
+_RESPONSE_CONTENT_ID_PREFIX = "response-" + _CONTENT_ID_PREFIX
+
+
+def _build_batch_body(message_ids: List[str], boundary: str, params: Dict[str, Any]) -> bytes:
+    """Builds the multipart/mixed body holding one messages.get sub-request per ID."""
+    query = urlencode(params, doseq=True)
+    lines = []
+    for message_id in message_ids:
+        lines += [
+            f"--{boundary}",
+            "Content-Type: application/http",
+            f"Content-ID: <{_CONTENT_ID_PREFIX}{message_id}>",
+            "",
+            f"GET /gmail/v1/users/me/messages/{message_id}?{query}",
+            "",
+        ]
+    lines.append(f"--{boundary}--")
+    return "\r\n".join(lines).encode()
+
+
+def _parse_sub_response(raw: bytes) -> Tuple[int, Any]:
+    """Parses the embedded HTTP response of a single batch part into (status, body)."""
+    head, _, body = raw.partition(b"\r\n\r\n")
+    status_line = head.split(b"\r\n", 1)[0].decode()
+    status = int(status_line.split(" ")[1])
+    try:
+        payload = json.loads(body) if body.strip() else None
+    except ValueError:
+        payload = None
+    return status, payload
+
+
+async def iter_batch_responses(response: aiohttp.ClientResponse) -> AsyncIterator[Tuple[str, int, Any]]:
+    """
+    Streams the parts of a Gmail batch response as they arrive.
+
+    Yields:
+        (message_id, status, body) for every sub-response in the batch
+    """
+    reader = aiohttp.MultipartReader.from_response(response)
+    while True:
+        part = await reader.next()
+        if part is None:
+            break
+        content_id = part.headers.get("Content-ID", "").strip("<>")
+        raw = await part.read()
+        status, payload = _parse_sub_response(raw)
+        if content_id.startswith(_RESPONSE_CONTENT_ID_PREFIX):
+            message_id = content_id[len(_RESPONSE_CONTENT_ID_PREFIX):]
+        else:
+            message_id = (payload or {}).get("id", "")
+        yield message_id, status, payload
+
+
+async def fetch_messages_batch(session: aiohttp.ClientSession, token: str, message_ids: List[str],
+                               params: Dict[str, Any]) -> AsyncIterator[Tuple[str, int, Any]]:
+    """
+    Sends up to MAX_BATCH_SIZE messages.get sub-requests in a single call to the batch endpoint.
+
+    Args:
+        session: The aiohttp session to send the batch through
+        token: OAuth access token used for every sub-request
+        message_ids: IDs of the messages to fetch
+        params: Query parameters applied to each sub-request (e.g. format)
+
+    Yields:
+        (message_id, status, body) for every sub-response, in the order Gmail streams them
+    """
+    if len(message_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f"A Gmail batch holds at most {MAX_BATCH_SIZE} requests")
+
+    boundary = f"batch_{uuid.uuid4().hex}"
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": f"multipart/mixed; boundary={boundary}",
+    }
+    body = _build_batch_body(message_ids, boundary, params)
+
+    async with session.post(GMAIL_BATCH_URL, data=body, headers=headers) as response:
+        if is_retryable_status(response.status):
+            raise RetryableStatusError(response.status, await response.text())
+        if response.status != 200:
+            # The whole batch was rejected, report every sub-request as failed
+            for message_id in message_ids:
+                yield message_id, response.status, None
+            return
+        async for item in iter_batch_responses(response):
+            yield item
+
+
+def chunk_message_ids(message_ids: List[str], batch_size: int = MAX_BATCH_SIZE) -> List[List[str]]:
+    size = min(batch_size, MAX_BATCH_SIZE)
+    return [message_ids[i:i + size] for i in range(0, len(message_ids), size)]
+
+
+async def run_batch_mutation(method: str, message_ids: List[str], request_for_chunk: Callable[[List[str]], Any],
+                             user_id: str = "me") -> Dict[str, Dict[str, str]]:
+    """
+    Sends one Gmail batchModify / batchDelete call per chunk of at most MAX_BATCH_MUTATION_SIZE IDs, concurrently.
+
+    A batch call succeeds or fails as a whole, so every ID of a chunk gets the chunk's outcome.
+
+    Returns:
+        Dict mapping each message ID to {"status": "success"} or {"status": "error", "detail": ...}
+    """
+    chunks = [message_ids[i:i + MAX_BATCH_MUTATION_SIZE] for i in range(0, len(message_ids), MAX_BATCH_MUTATION_SIZE)]
+    outcomes = await asyncio.gather(
+        *(gmail_scheduler.execute(method, request_for_chunk(chunk), user_id=user_id) for chunk in chunks),
+        return_exceptions=True
+    )
+    results = {}
+    for chunk, outcome in zip(chunks, outcomes):
+        if isinstance(outcome, BaseException):
+            if not isinstance(outcome, Exception):
+                raise outcome
+            result = {"status": "error", "detail": str(outcome)}
+        else:
+            result = {"status": "success"}
+        results.update((message_id, result) for message_id in chunk)
+    return results
@@ -1,53 +1,171 @@
 from fastapi import APIRouter, HTTPException
 from googleapiclient.errors import HttpError
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
+import base64
+import codecs
+import html
+import re
+from db.message_store import message_store
+from .mutation_queue import label_mutation_queue
+from .scheduler import gmail_scheduler
 from .utils import get_read_gmail_service
 
 router = APIRouter()
 
+# The list view only needs these headers (and the threading ones, so replies need no fetch);
+# bodies are fetched when a message is opened or classified
+METADATA_HEADERS = ["From", "To", "Subject", "Date", "Message-ID", "References"]
+METADATA_FIELDS = "id,threadId,labelIds,snippet,historyId,internalDate,payload/headers"
 
-def get_email(message: Dict[str, Any]) -> Dict[str, Any]:
+# Replying to or forwarding an email not stored with its threading headers needs only these
+COMPOSE_HEADERS = ["From", "To", "Subject", "Date", "Message-ID", "References"]
+COMPOSE_FIELDS = "id,threadId,payload/headers"
+
+# Request parameters for messages.get per fetch format
+FETCH_PARAMS = {
+    "metadata": {
+        "format": "metadata",
+        "metadataHeaders": METADATA_HEADERS,
+        "fields": METADATA_FIELDS,
+    },
+    "full": {
+        "format": "full",
+    },
+    "compose": {
+        "format": "metadata",
+        "metadataHeaders": COMPOSE_HEADERS,
+        "fields": COMPOSE_FIELDS,
+    },
+}
+
+
+# Decoded body text is capped so one large newsletter cannot inflate memory
+MAX_BODY_CHARS = 100_000
+
+# HTML carries far more markup than text, so more of it is decoded before conversion
+_HTML_BYTES_PER_CHAR = 4
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+# Single spaces are left alone, so only runs and other whitespace are substituted
+_SPACES_RE = re.compile(r"[ \t\r\f\v]{2,}|[\t\r\f\v]")
+# Comments and elements whose content is not visible text
+_SKIPPED_RE = re.compile(
+    r"<!--.*?(?:-->|$)|<(script|style|head|title)\b.*?(?:</\1\s*>|$)", re.IGNORECASE | re.DOTALL
+)
+_BLOCK_TAG_RE = re.compile(r"</?(?:p|br|div|tr|li|table|h[1-6]|blockquote)\b[^>]*>", re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def _part_charset(part: Dict[str, Any]) -> str:
+    for header in part.get("headers", []):
+        if header["name"].lower() == "content-type":
+            match = _CHARSET_RE.search(header["value"])
+            if match:
+                try:
+                    return codecs.lookup(match.group(1)).name
+                except LookupError:
+                    break
+    return "utf-8"
+
+
+def _decode_part(part: Dict[str, Any], max_bytes: int) -> str:
+    """Decodes at most `max_bytes` of a part's base64url body using the part's charset."""
+    data = part["body"]["data"]
+    # Every 4 base64 characters hold 3 bytes, so only the needed prefix is decoded
+    data = data[:(max_bytes + 2) // 3 * 4]
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    return raw.decode(_part_charset(part), errors="replace")
+
+
+def _html_to_text(html_text: str) -> str:
     """
-    Get detailed information about a specific email using its message ID.
+    Converts HTML to its visible text, breaking lines at block elements. A few regex passes
+    rather than an HTML parser: the input is capped at _HTML_BYTES_PER_CHAR * MAX_BODY_CHARS
+    and markup-heavy newsletters are the common case, where parsing every tag costs far more.
+    """
+    text = _SKIPPED_RE.sub(" ", html_text)
+    text = _BLOCK_TAG_RE.sub("\n", text)
+    text = html.unescape(_TAG_RE.sub("", text))
+    text = _SPACES_RE.sub(" ", text)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def _find_text_parts(payload: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Walks the MIME tree once, depth first in document order, and returns the first
+    text/plain and the first text/html part that carry an inline body.
+    Attachments are skipped without being decoded.
+    """
+    html_part = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if part.get("parts"):
+            stack.extend(reversed(part["parts"]))
+            continue
+        body = part.get("body", {})
+        if part.get("filename") or "attachmentId" in body or not body.get("data"):
+            continue
+        mime_type = part.get("mimeType", "").lower()
+        if mime_type == "text/plain":
+            return part, html_part
+        if mime_type == "text/html" and html_part is None:
+            html_part = part
+    return None, html_part
+
+
+def _extract_body(payload: Dict[str, Any], max_chars: int = MAX_BODY_CHARS) -> str:
+    """Returns the best text body of a message: its plain-text part, or its HTML part converted to text."""
+    plain_part, html_part = _find_text_parts(payload)
+    if plain_part is not None:
+        return _decode_part(plain_part, max_chars * 4)[:max_chars]
+    if html_part is not None:
+        return _html_to_text(_decode_part(html_part, max_chars * _HTML_BYTES_PER_CHAR))[:max_chars]
+    return ""
+
+
+def get_email(message: Dict[str, Any], format: str = "full") -> Dict[str, Any]:
+    """
+    Get detailed information about a specific email from its Gmail message resource.
 
     Args:
-        message_id: The ID of the email message to retrieve
+        message: The Gmail message resource to parse
+        format: The format the message was fetched in. "metadata" messages carry no body,
+            so the parsed email has no "body" key until the full message is fetched.
 
     Returns:
         Dict containing email details including subject, sender, body, etc.
     """
     try:
-        # Extract headers
-        headers = message["payload"]["headers"]
+        # Extract headers, keeping the first value of each
+        headers = {}
+        for header in message["payload"]["headers"]:
+            headers.setdefault(header["name"].lower(), header["value"])
         email_data = {
             "id": message["id"],
             "threadId": message.get("threadId", ""),
-            "from": next((h["value"] for h in headers if h["name"].lower() == "from"), ""),
-            "to": next((h["value"] for h in headers if h["name"].lower() == "to"), ""),
-            "subject": next((h["value"] for h in headers if h["name"].lower() == "subject"), ""),
-            "date": next((h["value"] for h in headers if h["name"].lower() == "date"), ""),
+            "from": headers.get("from", ""),
+            "to": headers.get("to", ""),
+            "subject": headers.get("subject", ""),
+            "date": headers.get("date", ""),
+            "messageId": headers.get("message-id", ""),
+            "references": headers.get("references", ""),
             "snippet": message.get("snippet", ""),
             "labels": message.get("labelIds", []),
+            "historyId": message.get("historyId", ""),
+            "internalDate": message.get("internalDate", ""),
         }
 
+        # Metadata-only messages carry no body
+        if format == "metadata":
+            return {
+                "status": "success",
+                "data": email_data
+            }
+
         # Extract body content
-        if "parts" in message["payload"]:
-            # Multipart message
-            for part in message["payload"]["parts"]:
-                if part["mimeType"] == "text/plain":
-                    if "data" in part["body"]:
-                        import base64
-                        data = part["body"]["data"]
-                        email_data["body"] = base64.urlsafe_b64decode(
-                            data).decode()
-                        break
-        elif "body" in message["payload"] and "data" in message["payload"]["body"]:
-            # Single part message
-            import base64
-            data = message["payload"]["body"]["data"]
-            email_data["body"] = base64.urlsafe_b64decode(data).decode()
-        else:
-            email_data["body"] = ""
+        email_data["body"] = _extract_body(message["payload"])
 
         return {
             "status": "success",
@@ -64,3 +182,57 @@ def get_email(message: Dict[str, Any]) -> Dict[str, Any]:
             status_code=500,
             detail=f"An unexpected error occurred: {str(e)}"
         )
+
+
+async def get_email_by_id(message_id: str) -> Dict[str, Any]:
+    """
+    Get an email with its body by its message ID, from the local message store when it is there
+    and from Gmail otherwise. Emails stored from the metadata-only list view get their body
+    fetched once and stored.
+
+    Args:
+        message_id: The ID of the email message to retrieve
+
+    Returns:
+        Dict containing the status and the parsed email details
+    """
+    email_data = message_store.get(message_id)
+    if email_data is not None and "body" in email_data:
+        return {
+            "status": "success",
+            "data": email_data
+        }
+
+    try:
+        service = get_read_gmail_service()
+        message = await gmail_scheduler.execute("get", service.users().messages().get(
+            userId="me",
+            id=message_id,
+            **FETCH_PARAMS["full"]
+        ))
+    except HttpError as error:
+        if error.resp.status == 404:
+            raise HTTPException(status_code=404, detail="Email not found")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while retrieving the email: {str(error)}"
+        )
+
+    email = get_email(message)
+    label_mutation_queue.overlay([email["data"]])
+    message_store.put_many([email["data"]])
+    return email
+
+
+@router.get("/{message_id}")
+async def read_email(message_id: str):
+    """
+    Get an email with its body, for when the user opens it.
+
+    Args:
+        message_id: The ID of the email message to retrieve
+
+    Returns:
+        Dict containing the status and the email details including its body
+    """
+    return await get_email_by_id(message_id)
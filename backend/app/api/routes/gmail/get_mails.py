@@ -1,52 +1,95 @@
-from api.routes.gmail.get_mail import get_email
+from api.routes.classification_queue import classification_queue
+from api.routes.gmail.get_mail import get_email, FETCH_PARAMS
+from db.application_store import application_store
+from db.message_store import message_store
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from googleapiclient.errors import HttpError
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Literal
 import asyncio
-import aiohttp
+import json
+import logging
+from .batch import chunk_message_ids, fetch_messages_batch, MAX_BATCH_SIZE
+from .http_client import get_http_session
+from .mutation_queue import label_mutation_queue
+from .scheduler import gmail_scheduler, RetryableStatusError, is_retryable_status
 from .utils import get_read_gmail_service
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# Fetches emails metadata through Gmail API first
-
-
-async def _get_messages_list_metadata(service, label_ids, max_results=500, page_token=None):
-    try:
-        service = get_read_gmail_service()
-
-        messages_metadata = []
+# TODO: 2000 for free version. Potentially charge for all emails retrieval
+FREE_TIER_MAX_MESSAGES = 2000
 
-        # Get messages from inbox
-        results = service.users().messages().list(
-            userId="me",
-            labelIds=label_ids,
-            maxResults=max_results
-        ).execute()
+# Lists emails metadata through Gmail API page by page, fetching the next page while the caller works on the current one
 
-        messages_metadata += results.get("messages", [])
 
-        next_page_token = results.get("nextPageToken", "")
-
-        while next_page_token:
-            results = service.users().messages().list(
-                userId="me",
-                labelIds=label_ids,
-                maxResults=max_results,
-                pageToken=next_page_token
-            ).execute()
+async def _iter_messages_list_pages(service, label_ids, max_results=500, max_messages=FREE_TIER_MAX_MESSAGES,
+                                    stop_at_estimate=False):
+    """
+    Args:
+        service: The Gmail service to list messages with
+        label_ids: Only list messages carrying all of these labels
+        max_results: Page size requested from Gmail (at most 500)
+        max_messages: Stop once this many messages are listed (None for no cap)
+        stop_at_estimate: Stop once Gmail's resultSizeEstimate is reached instead of following
+            nextPageToken to the end. The estimate is approximate, so this may stop early.
+
+    Yields:
+        Lists of message metadata ({"id", "threadId"}), one per page
+    """
+    def list_page(page_token, remaining):
+        request_kwargs = {
+            "userId": "me",
+            "labelIds": label_ids,
+            "maxResults": max_results if remaining is None else min(max_results, remaining),
+        }
+        if page_token:
+            request_kwargs["pageToken"] = page_token
+        return asyncio.create_task(gmail_scheduler.execute(
+            "list", service.users().messages().list(**request_kwargs)))
 
-            result_size_estimate = results.get("resultSizeEstimate", 0)
-            messages_metadata += results.get("messages", [])
+    listed = 0
+    next_page = list_page(None, max_messages)
+    try:
+        while next_page is not None:
+            results = await next_page
+            next_page = None
+
+            messages = results.get("messages", [])
+            if max_messages is not None:
+                messages = messages[:max_messages - listed]
+            listed += len(messages)
+
+            next_page_token = results.get("nextPageToken")
+            has_more = bool(next_page_token) and bool(messages)
+            if max_messages is not None and listed >= max_messages:
+                has_more = False
+            if stop_at_estimate and listed >= results.get("resultSizeEstimate", 0):
+                has_more = False
+
+            # Prefetch page N+1 before handing page N to the caller
+            if has_more:
+                remaining = None if max_messages is None else max_messages - listed
+                next_page = list_page(next_page_token, remaining)
+
+            if messages:
+                yield messages
+    finally:
+        if next_page is not None:
+            next_page.cancel()
 
-            # TODO: 2000 for free version. Potentially charge for all emails retrieval
-            if len(messages_metadata) >= 2000:
-                break
+# Fetches emails metadata through Gmail API first
 
-            if result_size_estimate < 500:
-                break
 
-            next_page_token = results.get("nextPageToken", "")
+async def _get_messages_list_metadata(service, label_ids, max_results=500, max_messages=FREE_TIER_MAX_MESSAGES,
+                                      stop_at_estimate=False):
+    try:
+        messages_metadata = []
+        async for page in _iter_messages_list_pages(service, label_ids, max_results=max_results,
+                                                    max_messages=max_messages,
+                                                    stop_at_estimate=stop_at_estimate):
+            messages_metadata += page
 
         return messages_metadata
 
@@ -56,33 +99,38 @@ async def _get_messages_list_metadata(service, label_ids, max_results=500, page_
             detail=f"An error occurred while fetching messages metadata: {str(error)}"
         )
 
-# Fetches email data based on the given metadata
+# Fetches email data based on the given metadata, as "metadata" for the list view or "full" with the body
 
 
-async def _get_message_data_from_metadata(session, service, message_metadata):
+async def _get_message_data_from_metadata(session, service, message_metadata, format="metadata"):
     url = f"https://gmail.googleapis.com/gmail/v1/users/me/messages/{message_metadata['id']}"
-    params = {
-        "format": "full",
-    }
+    params = [(key, item) for key, value in FETCH_PARAMS[format].items()
+              for item in (value if isinstance(value, list) else [value])]
     headers = {
         "Authorization": f"Bearer {service._http.credentials.token}"
     }
 
-    try:
+    async def fetch():
         async with session.get(url, params=params, headers=headers) as response:
+            if is_retryable_status(response.status):
+                raise RetryableStatusError(response.status, await response.text())
             if response.status == 200:
-                msg = await response.json()
-            else:
-                # Fallback to the synchronous method if the HTTP request fails
-                msg = service.users().messages().get(
-                    userId="me",
-                    id=message_metadata["id"],
-                    format="full",
-                ).execute()
-
-        email_data = get_email(msg)["data"]
-    except Exception as e:
-        print(f"Error processing message {message_metadata['id']}: {str(e)}")
+                return await response.json()
+            return None
+
+    try:
+        msg = await gmail_scheduler.run("get", fetch)
+        if msg is None:
+            # Fallback to the client library (which refreshes expired credentials) if the HTTP request fails
+            msg = await gmail_scheduler.execute("get", service.users().messages().get(
+                userId="me",
+                id=message_metadata["id"],
+                **FETCH_PARAMS[format]
+            ))
+
+        email_data = get_email(msg, format)["data"]
+    except Exception:
+        logger.exception("Error processing message %s", message_metadata["id"])
         # Return minimal data in case of error
         email_data = {
             "id": message_metadata["id"],
@@ -91,39 +139,275 @@ async def _get_message_data_from_metadata(session, service, message_metadata):
             "subject": "Error retrieving email",
             "date": "",
             "snippet": "An error occurred while retrieving this email.",
-            "labels": []
+            "labels": [],
+            "error": True
         }
 
     return email_data
 
 
-async def _get_all_message_data_from_metadata(session, service, message_metadata_list):
+async def _get_all_message_data_from_metadata(session, service, message_metadata_list, format="metadata"):
     tasks = []
     for message in message_metadata_list:
         task = asyncio.create_task(_get_message_data_from_metadata(
-            session=session, service=service, message_metadata=message))
+            session=session, service=service, message_metadata=message, format=format))
         tasks.append(task)
 
     res = await asyncio.gather(*tasks)
 
     return res
 
+# Fetches email data through the Gmail batch endpoint, up to 100 messages per HTTP call
+
+
+async def _get_batch_message_data_from_metadata(session, service, message_metadata_batch, format="metadata"):
+    metadata_by_id = {message["id"]: message for message in message_metadata_batch}
+    emails_by_id = {}
+
+    async def fetch():
+        async for message_id, status, msg in fetch_messages_batch(
+                session=session,
+                token=service._http.credentials.token,
+                message_ids=[message_id for message_id in metadata_by_id if message_id not in emails_by_id],
+                params=FETCH_PARAMS[format]):
+            if status == 200 and msg is not None and message_id in metadata_by_id:
+                emails_by_id[message_id] = get_email(msg, format)["data"]
+
+    try:
+        # Each attempt is charged for the messages it fetches, not those an earlier one got
+        await gmail_scheduler.run("get", fetch, count=lambda: len(metadata_by_id) - len(emails_by_id))
+    except Exception as e:
+        # The messages the batch did not return are fetched one by one below
+        logger.warning("Error processing message batch: %s", e)
+
+    # Retry failed sub-requests (and any the batch never answered) one by one
+    retry = [metadata_by_id[message_id] for message_id in metadata_by_id
+             if message_id not in emails_by_id]
+    retried = await _get_all_message_data_from_metadata(
+        session=session, service=service, message_metadata_list=retry, format=format)
+    for email_data in retried:
+        emails_by_id[email_data["id"]] = email_data
+
+    return [emails_by_id[message_id] for message_id in metadata_by_id]
+
+
+async def _get_all_message_data_in_batches(session, service, message_metadata_list, batch_size=MAX_BATCH_SIZE,
+                                           format="metadata"):
+    metadata_by_id = {message["id"]: message for message in message_metadata_list}
+    tasks = []
+    for message_ids in chunk_message_ids(list(metadata_by_id), batch_size):
+        task = asyncio.create_task(_get_batch_message_data_from_metadata(
+            session=session, service=service,
+            message_metadata_batch=[metadata_by_id[message_id] for message_id in message_ids],
+            format=format))
+        tasks.append(task)
+
+    res = await asyncio.gather(*tasks)
+
+    return [email_data for batch in res for email_data in batch]
+
+# Reads emails from the local message store and fetches only the missing ones from Gmail.
+# A stored list-view email without a body does not satisfy a "full" read.
+
+
+async def _get_message_data_cached(session, service, message_metadata_list, batched=True, format="metadata"):
+    stored = message_store.get_many(message["id"] for message in message_metadata_list)
+    if format == "full":
+        stored = {message_id: email_data for message_id, email_data in stored.items() if "body" in email_data}
+    missing = [message for message in message_metadata_list if message["id"] not in stored]
+
+    if missing:
+        if batched:
+            fetched = await _get_all_message_data_in_batches(
+                session=session, service=service, message_metadata_list=missing, format=format)
+        else:
+            fetched = await _get_all_message_data_from_metadata(
+                session=session, service=service, message_metadata_list=missing, format=format)
+        fetched = {email_data["id"]: email_data for email_data in fetched}
+        # Label changes not yet written to Gmail stay applied over what Gmail returned
+        label_mutation_queue.overlay(fetched.values())
+        message_store.put_many(email_data for email_data in fetched.values() if not email_data.get("error"))
+        stored.update(fetched)
+
+    return [stored[message["id"]] for message in message_metadata_list]
+
+
+async def get_emails_by_ids(message_ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Get emails with their bodies by message ID, from the local message store when they are there
+    and through the Gmail batch endpoint otherwise.
+
+    Args:
+        message_ids: The IDs of the email messages to retrieve
+
+    Returns:
+        The parsed emails, in the order of `message_ids`. Emails that could not be retrieved
+        carry "error": True.
+    """
+    return await _get_message_data_cached(
+        session=get_http_session(), service=get_read_gmail_service(),
+        message_metadata_list=[{"id": message_id} for message_id in message_ids], format="full")
+
+
+# Fetches every change to the mailbox since the given historyId, collapsed into net changes
+
+
+async def _get_history_changes(service, start_history_id):
+    added = {}
+    deleted = set()
+    labels_added = {}
+    labels_removed = {}
+
+    request_kwargs = {
+        "userId": "me",
+        "startHistoryId": start_history_id,
+        "historyTypes": ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"],
+    }
+    history_id = start_history_id
+    while True:
+        results = await gmail_scheduler.execute("history", service.users().history().list(**request_kwargs))
+        history_id = results.get("historyId", history_id)
+
+        for record in results.get("history", []):
+            for change in record.get("messagesAdded", []):
+                message = change["message"]
+                if "INBOX" in message.get("labelIds", []):
+                    added[message["id"]] = message
+                    deleted.discard(message["id"])
+            for change in record.get("messagesDeleted", []):
+                message_id = change["message"]["id"]
+                added.pop(message_id, None)
+                deleted.add(message_id)
+            for change in record.get("labelsAdded", []):
+                message_id = change["message"]["id"]
+                for label_id in change.get("labelIds", []):
+                    labels_added.setdefault(message_id, set()).add(label_id)
+                    labels_removed.get(message_id, set()).discard(label_id)
+            for change in record.get("labelsRemoved", []):
+                message_id = change["message"]["id"]
+                for label_id in change.get("labelIds", []):
+                    labels_removed.setdefault(message_id, set()).add(label_id)
+                    labels_added.get(message_id, set()).discard(label_id)
+
+        next_page_token = results.get("nextPageToken")
+        if not next_page_token:
+            break
+        request_kwargs["pageToken"] = next_page_token
+
+    # Added messages are fetched with their current labels and deleted ones are gone,
+    # so label changes only need reporting for the remaining messages
+    label_changes = [
+        {
+            "id": message_id,
+            "labels_added": sorted(labels_added.get(message_id, set())),
+            "labels_removed": sorted(labels_removed.get(message_id, set())),
+        }
+        for message_id in set(labels_added) | set(labels_removed)
+        if message_id not in added and message_id not in deleted
+        and (labels_added.get(message_id) or labels_removed.get(message_id))
+    ]
+
+    return {
+        "history_id": history_id,
+        "added": list(added.values()),
+        "deleted": sorted(deleted),
+        "label_changes": label_changes,
+    }
+
+
+async def _get_history_changes_if_available(service, start_history_id):
+    try:
+        return await _get_history_changes(service, start_history_id)
+    except HttpError as error:
+        # Gmail only keeps history for a limited time, an expired historyId returns 404
+        if error.resp.status == 404:
+            return None
+        raise
+
+# Brings the local message store up to date with the changes and returns the emails added to the inbox
+
+
+async def _apply_history_changes(session, service, changes):
+    message_store.delete_many(changes["deleted"])
+    classification_queue.discard(changes["deleted"])
+    application_store.discard(changes["deleted"])
+    label_mutation_queue.discard(changes["deleted"])
+
+    restored = []
+    for change in changes["label_changes"]:
+        email_data = message_store.update_labels(
+            change["id"], add=change["labels_added"], remove=change["labels_removed"],
+            history_id=changes["history_id"])
+        label_mutation_queue.rebase(change["id"], add=change["labels_added"], remove=change["labels_removed"])
+        # Messages moved back into the inbox may never have been stored
+        if email_data is None and "INBOX" in change["labels_added"]:
+            restored.append({"id": change["id"]})
+
+    emails = await _get_message_data_cached(
+        session=session, service=service, message_metadata_list=changes["added"] + restored)
+    classification_queue.enqueue(emails)
+
+    message_store.set_history_id(changes["history_id"])
+    return emails
+
+
+async def _full_sync(service, batched=True, format="metadata"):
+    # Read the historyId before listing so no change made during the sync is missed by the next update
+    profile = await gmail_scheduler.execute("profile", service.users().getProfile(userId="me"))
+
+    session = get_http_session()
+    # Start fetching each page's messages as soon as it is listed, while the next page is listed
+    tasks = []
+    async for page in _iter_messages_list_pages(service, ["INBOX"]):
+        tasks.append(asyncio.create_task(_get_message_data_cached(
+            session=session, service=service, message_metadata_list=page, batched=batched, format=format)))
+
+    pages = await asyncio.gather(*tasks)
+    emails = [email_data for page in pages for email_data in page]
+    classification_queue.enqueue(emails)
+
+    message_store.set_history_id(profile["historyId"])
+    return emails, profile["historyId"]
+
+
+async def _sync_mailbox(service, batched=True, format="metadata"):
+    history_id = message_store.get_history_id()
+    if history_id is not None:
+        changes = await _get_history_changes_if_available(service, history_id)
+        if changes is not None:
+            session = get_http_session()
+            await _apply_history_changes(session, service, changes)
+            emails = message_store.list_by_label("INBOX", limit=FREE_TIER_MAX_MESSAGES)
+            if format == "full":
+                emails = await _get_message_data_cached(
+                    session=session, service=service,
+                    message_metadata_list=[{"id": email_data["id"]} for email_data in emails], format=format)
+            return emails, changes["history_id"]
+        # The stored emails can no longer be brought up to date, start over
+        message_store.clear()
+
+    return await _full_sync(service, batched=batched, format=format)
+
 
 @router.get("/sync-mailbox", response_model=List[Dict[str, Any]])
-async def sync_mailbox():
+async def sync_mailbox(batched: bool = True, format: Literal["metadata", "full"] = "metadata"):
     """
     TODO: Implement filter when fetching emails (e.g., exclude marketing emails, etc.)
     Retrieves emails from the user's Gmail inbox (For first time sync).
+    Emails are kept in the local message store. Once the mailbox has been synced, later calls only
+    apply the changes recorded in the Gmail history and serve the inbox from the store.
     Returns a list of email messages with basic information.
+
+    Args:
+        batched: Fetch messages through the Gmail batch endpoint (100 per request)
+            instead of sending one request per message
+        format: "metadata" fetches only what the list view shows (from, subject, date, snippet, labels).
+            Bodies are then fetched when an email is opened or classified. "full" fetches bodies up front.
     """
     try:
         service = get_read_gmail_service()
-        messages_metadata = await _get_messages_list_metadata(service, ["INBOX"])
-
-        async with aiohttp.ClientSession() as session:
-            emails = await _get_all_message_data_from_metadata(
-                session=session, service=service, message_metadata_list=messages_metadata)
-            return emails
+        emails, _ = await _sync_mailbox(service, batched=batched, format=format)
+        return emails
 
     except HttpError as error:
         raise HTTPException(
@@ -132,52 +416,156 @@ async def sync_mailbox():
         )
 
 
-@router.get("/update-mailbox", response_model=List[Dict[str, Any]])
+# Keeps a few batches in flight ahead of the one being streamed without buffering the whole mailbox
+STREAM_BATCHES_AHEAD = 4
+
+
+async def _stream_stored_mailbox(history_id, first_batch_size):
+    emails = message_store.list_by_label("INBOX", limit=FREE_TIER_MAX_MESSAGES)
+    total = len(emails)
+    yield {"event": "total", "count": total}
+
+    start = 0
+    while start < total:
+        end = start + (first_batch_size if start == 0 and first_batch_size else MAX_BATCH_SIZE)
+        for email_data in emails[start:end]:
+            yield {"event": "email", "data": email_data}
+        start = min(end, total)
+        yield {"event": "progress", "done": start, "total": total}
+
+    yield {"event": "done", "history_id": history_id}
+
+
+async def _stream_mailbox(service, first_batch_size):
+    history_id = message_store.get_history_id()
+    if history_id is not None:
+        changes = await _get_history_changes_if_available(service, history_id)
+        if changes is not None:
+            session = get_http_session()
+            await _apply_history_changes(session, service, changes)
+            async for event in _stream_stored_mailbox(changes["history_id"], first_batch_size):
+                yield event
+            return
+        message_store.clear()
+
+    profile = await gmail_scheduler.execute("profile", service.users().getProfile(userId="me"))
+    messages_metadata = await _get_messages_list_metadata(service, ["INBOX"])
+    total = len(messages_metadata)
+    yield {"event": "total", "count": total}
+
+    # Messages are listed newest first; a small first batch gets the top of the inbox out quickly
+    rest = messages_metadata[first_batch_size:]
+    batches = [messages_metadata[:first_batch_size]] if first_batch_size else []
+    batches += [rest[i:i + MAX_BATCH_SIZE] for i in range(0, len(rest), MAX_BATCH_SIZE)]
+
+    session = get_http_session()
+
+    def start(batch):
+        return asyncio.create_task(_get_message_data_cached(
+            session=session, service=service, message_metadata_list=batch))
+
+    pending = [start(batch) for batch in batches[:STREAM_BATCHES_AHEAD]]
+    next_batch = len(pending)
+    done = 0
+    try:
+        while pending:
+            emails = await pending.pop(0)
+            if next_batch < len(batches):
+                pending.append(start(batches[next_batch]))
+                next_batch += 1
+            classification_queue.enqueue(emails)
+            for email_data in emails:
+                yield {"event": "email", "data": email_data}
+            done += len(emails)
+            yield {"event": "progress", "done": done, "total": total}
+    finally:
+        # The client went away or a batch failed, stop fetching the rest
+        for task in pending:
+            task.cancel()
+
+    message_store.set_history_id(profile["historyId"])
+    yield {"event": "done", "history_id": profile["historyId"]}
+
+
+def _format_ndjson(event):
+    return json.dumps(event) + "\n"
+
+
+def _format_sse(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+@router.get("/sync-mailbox/stream")
+async def stream_sync_mailbox(format: Literal["ndjson", "sse"] = "ndjson", first_batch_size: int = 20):
+    """
+    Streaming variant of sync-mailbox that sends each email as soon as it is fetched and parsed.
+    Emails are sent newest first. The stream starts with a "total" event, sends an "email" event per
+    message and a "progress" event per batch, and ends with a "done" event.
+
+    Args:
+        format: "ndjson" for newline-delimited JSON or "sse" for Server-Sent Events
+        first_batch_size: Size of the first batch, kept small so the top of the inbox renders quickly
+    """
+    service = get_read_gmail_service()
+    formatter = _format_sse if format == "sse" else _format_ndjson
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+
+    async def body():
+        try:
+            async for event in _stream_mailbox(service, max(0, min(first_batch_size, MAX_BATCH_SIZE))):
+                yield formatter(event)
+        # Headers are already sent, so every failure is reported in-band rather than ending the stream silently
+        except HttpError as error:
+            yield formatter({"event": "error",
+                             "detail": f"An error occurred while fetching emails with their metadata: {str(error)}"})
+        except HTTPException as error:
+            yield formatter({"event": "error", "detail": error.detail})
+        except Exception as error:
+            logger.exception("Streaming the mailbox failed")
+            yield formatter({"event": "error",
+                             "detail": f"An error occurred while fetching emails with their metadata: {str(error)}"})
+
+    return StreamingResponse(body(), media_type=media_type)
+
+
+@router.get("/update-mailbox", response_model=Dict[str, Any])
 async def update_mailbox():
     """
-    TODO: Think through the logic for this.
-    Retrieves new emails from the user's Gmail inbox whenever user logs in.
-    Logic: Fetch emails that are not read and were sent after the last time the user was online.
+    Retrieves what changed in the user's Gmail inbox since the last sync whenever user logs in.
+    Logic: List the mailbox history from the historyId recorded by the last sync and fetch only the
+    added messages. Falls back to a full resync when no historyId is recorded or Gmail has expired it.
     Alternative: use the Gmail Push Notifications endpoint to get real-time updates.
-    Returns a list of email messages with basic information.
+    Returns the added emails, the IDs of deleted emails and the label changes of the others.
     """
     try:
         service = get_read_gmail_service()
 
-        # Get messages from inbox
-        results = service.users().messages().list(
-            userId="me",
-            labelIds=["INBOX", "UNREAD"],
-            maxResults=100
-        ).execute()
-
-        messages = results.get("messages", [])
-
-        if not messages:
-            return []
-
-        email_list = []
-        for message in messages:
-            msg = service.users().messages().get(
-                userId="me",
-                id=message["id"],
-                format="metadata",
-                metadataHeaders=["From", "Subject", "Date"]
-            ).execute()
-
-            headers = msg["payload"]["headers"]
-            email_data = {
-                "id": msg["id"],
-                "threadId": msg.get("threadId", ""),
-                "from": next((h["value"] for h in headers if h["name"] == "From"), ""),
-                "subject": next((h["value"] for h in headers if h["name"] == "Subject"), ""),
-                "date": next((h["value"] for h in headers if h["name"] == "Date"), ""),
-                "snippet": msg.get("snippet", ""),
-                "labels": msg.get("labelIds", [])
+        start_history_id = message_store.get_history_id()
+        changes = None
+        if start_history_id is not None:
+            changes = await _get_history_changes_if_available(service, start_history_id)
+
+        if changes is None:
+            message_store.clear()
+            emails, history_id = await _full_sync(service)
+            return {
+                "full_sync": True,
+                "history_id": history_id,
+                "added": emails,
+                "deleted": [],
+                "label_changes": [],
             }
-            email_list.append(email_data)
 
-        return email_list
+        session = get_http_session()
+        emails = await _apply_history_changes(session, service, changes)
+
+        return {
+            "full_sync": False,
+            "history_id": changes["history_id"],
+            "added": emails,
+            "deleted": changes["deleted"],
+            "label_changes": changes["label_changes"],
+        }
 
     except HttpError as error:
         raise HTTPException(
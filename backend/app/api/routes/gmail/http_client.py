@@ -0,0 +1,71 @@
+import os
+from typing import Optional
+import aiohttp
+import requests
+from aiohttp.resolver import AsyncResolver
+from requests.adapters import HTTPAdapter
+
+# Connection pool limits shared by every Gmail and Google call
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "100"))
+HTTP_POOL_PER_HOST = int(os.environ.get("HTTP_POOL_PER_HOST", "50"))
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=10, sock_read=30)
+
+_session: Optional[aiohttp.ClientSession] = None
+_requests_session: Optional[requests.Session] = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        limit_per_host=HTTP_POOL_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        resolver=AsyncResolver(),
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+
+
+async def start_http_client():
+    """Opens the shared HTTP session. Called from the app lifespan."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+
+
+async def close_http_client():
+    """Closes the shared HTTP sessions and their pooled connections. Called from the app lifespan."""
+    global _session, _requests_session
+    if _session is not None:
+        await _session.close()
+        _session = None
+    if _requests_session is not None:
+        _requests_session.close()
+        _requests_session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Returns the app-wide aiohttp session.
+
+    The session is normally opened by the app lifespan; it is created on first use
+    when running outside the app (scripts, benchmarks).
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+def get_requests_session() -> requests.Session:
+    """Returns the pooled requests session used by google-auth to refresh tokens."""
+    global _requests_session
+    if _requests_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_PER_HOST)
+        session.mount("https://", adapter)
+        _requests_session = session
+    return _requests_session
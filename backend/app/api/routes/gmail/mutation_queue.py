@@ -0,0 +1,378 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from db.label_changes import LabelChange, LabelChangeStore, label_change_store
+from db.message_store import message_store
+from fastapi import APIRouter
+from .batch import MAX_BATCH_MUTATION_SIZE, run_batch_mutation
+from .utils import get_all_gmail_service
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Seconds label changes wait to be coalesced before they are written to Gmail
+MUTATION_FLUSH_INTERVAL = float(os.environ.get("MUTATION_FLUSH_INTERVAL", "2"))
+
+# Messages with pending changes that trigger a flush without waiting for the interval
+MUTATION_FLUSH_SIZE = int(os.environ.get("MUTATION_FLUSH_SIZE", "100"))
+
+# Failed writes of a change before it is given up and undone locally
+MUTATION_MAX_ATTEMPTS = 8
+MUTATION_MAX_RETRY_DELAY = 300
+
+
+def _apply(labels: Iterable[str], add: Iterable[str], remove: Iterable[str]) -> List[str]:
+    remove = set(remove)
+    labels = [label for label in labels if label not in remove]
+    labels += [label for label in add if label not in labels]
+    return labels
+
+
+class _Pending:
+    """The net label change of one message not yet written to Gmail."""
+
+    def __init__(self, base: Optional[Set[str]], add: Set[str] = (), remove: Set[str] = (), attempts: int = 0,
+                 error: Optional[str] = None, next_attempt_at: float = 0.0):
+        self.base = base
+        self.add = set(add)
+        self.remove = set(remove)
+        self.attempts = attempts
+        self.error = error
+        self.next_attempt_at = next_attempt_at
+        # Bumped on every change, so a flush can tell whether the message changed while it was written
+        self.version = 0
+
+    def normalize(self) -> bool:
+        """Drops what Gmail already has from the change. Returns whether anything is left to write."""
+        if self.base is not None:
+            self.add -= self.base
+            self.remove &= self.base
+        return bool(self.add or self.remove)
+
+
+class LabelMutationQueue:
+    """
+    Write-behind queue for label changes (archive, read/unread, labels).
+
+    Changes are applied to the local message store at once, so the response and every later read
+    see them, and are kept per message as one net diff against the labels Gmail has: toggling a
+    label back and forth cancels out without a Gmail call. Pending diffs are written every
+    `flush_interval` seconds, or as soon as `flush_size` messages have one, with one batchModify
+    call per distinct diff. Pending diffs are kept in the LabelChangeStore, so they survive
+    restarts; failed writes are retried with backoff and undone locally after `max_attempts`.
+    """
+
+    def __init__(self, store: LabelChangeStore = label_change_store, flush_interval: float = MUTATION_FLUSH_INTERVAL,
+                 flush_size: int = MUTATION_FLUSH_SIZE, max_attempts: int = MUTATION_MAX_ATTEMPTS):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, flush_size)
+        self.max_attempts = max_attempts
+        self._pending: Optional[Dict[Tuple[str, str], _Pending]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        # Keys whose change a flush is writing to Gmail right now
+        self._in_flight: Set[Tuple[str, str]] = set()
+        self._failed: deque = deque(maxlen=100)
+        self._stats = {"recorded": 0, "cancelled": 0, "flushes": 0, "gmail_calls": 0, "written": 0,
+                       "retries": 0, "given_up": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def _get_pending(self) -> Dict[Tuple[str, str], _Pending]:
+        # Loaded on first use so importing the module never touches the disk
+        if self._pending is None:
+            self._pending = {
+                (change.user_id, change.message_id): _Pending(
+                    None if change.base_labels is None else set(change.base_labels), change.add_labels,
+                    change.remove_labels, change.attempts, change.error, change.next_attempt_at)
+                for change in self.store.list_all()
+            }
+        return self._pending
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    def _drop_if_written(self, key: Tuple[str, str], entry: _Pending) -> bool:
+        """
+        Drops the pending change of a key if nothing is left to write. A change being written keeps
+        its entry as it is: what Gmail will have is only known once the write settles.
+        """
+        if key in self._in_flight or entry.normalize():
+            return False
+        del self._pending[key]
+        return True
+
+    def _persist(self, keys: Iterable[Tuple[str, str]]):
+        """Writes the pending change of each key to the store, or drops it if there is none left."""
+        pending = self._get_pending()
+        changed, settled = [], []
+        for key in keys:
+            entry = pending.get(key)
+            if entry is None:
+                settled.append(key)
+                continue
+            changed.append(LabelChange(
+                key[0], key[1], None if entry.base is None else sorted(entry.base), sorted(entry.add),
+                sorted(entry.remove), entry.attempts, entry.error, entry.next_attempt_at))
+        if changed:
+            self.store.put_many(changed)
+        if settled:
+            self.store.delete_many(settled)
+
+    async def start(self):
+        """Starts flushing pending changes, those left by the last run first. Called from the app lifespan."""
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        if self._get_pending():
+            # Changes left by the last run are retried right away, whatever their backoff
+            for entry in self._pending.values():
+                entry.next_attempt_at = 0.0
+            self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush loop after one last attempt to write what is pending."""
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), self.flush_interval + 10)
+        except asyncio.TimeoutError:
+            # Whatever is left stays in the store for the next start
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Changes stay pending and are retried on the next flush
+                logger.exception("Flushing label changes failed")
+
+    async def record(self, message_ids: Iterable[str], add: Iterable[str] = (), remove: Iterable[str] = (),
+                     user_id: str = "me") -> Dict[str, Dict[str, Any]]:
+        """
+        Records a label change of many messages and applies it to the local message store.
+
+        Args:
+            message_ids: The messages to change
+            add: Label IDs to add to every message
+            remove: Label IDs to remove from every message
+            user_id: The user the messages belong to
+
+        Returns:
+            Dict mapping each message ID to its optimistic "labels" (None if the message is not
+            stored locally) and whether a change is "pending" for Gmail
+        """
+        add, remove = set(add), set(remove) - set(add)
+        message_ids = list(dict.fromkeys(message_ids))
+        pending = self._get_pending()
+        stored = message_store.get_many(
+            (message_id for message_id in message_ids if (user_id, message_id) not in pending), user_id)
+
+        labels = {}
+        for message_id in message_ids:
+            key = (user_id, message_id)
+            entry = pending.get(key)
+            if entry is None:
+                email_data = stored.get(message_id)
+                entry = pending[key] = _Pending(None if email_data is None else set(email_data.get("labels", [])))
+            entry.add = (entry.add - remove) | add
+            entry.remove = (entry.remove - add) | remove
+            entry.version += 1
+            self._stats["recorded"] += 1
+            if self._drop_if_written(key, entry):
+                self._stats["cancelled"] += 1
+
+            email_data = message_store.update_labels(message_id, add=add, remove=remove, user_id=user_id)
+            labels[message_id] = None if email_data is None else email_data["labels"]
+        self._persist((user_id, message_id) for message_id in message_ids)
+
+        if not self.running:
+            # Without the flush loop (e.g. outside the app lifespan) the change is written right away
+            await self.flush()
+            stored = message_store.get_many(message_ids, user_id)
+            labels = {message_id: stored[message_id]["labels"] if message_id in stored else None
+                      for message_id in message_ids}
+        elif len(pending) >= self.flush_size:
+            self._wake.set()
+        return {message_id: {"labels": labels[message_id], "pending": (user_id, message_id) in pending}
+                for message_id in message_ids}
+
+    def overlay(self, emails: Iterable[Dict[str, Any]], user_id: str = "me") -> Iterable[Dict[str, Any]]:
+        """
+        Applies pending changes to emails fetched from Gmail, so a fetch made before a change is
+        written never undoes it locally.
+        """
+        pending = self._get_pending()
+        for email_data in emails:
+            entry = pending.get((user_id, email_data.get("id")))
+            if entry is not None and "labels" in email_data:
+                email_data["labels"] = _apply(email_data["labels"], entry.add, entry.remove)
+        return emails
+
+    def _rebase(self, message_ids: Iterable[str], add: Iterable[str], remove: Iterable[str], overwrite: bool,
+                user_id: str):
+        pending = self._get_pending()
+        keys = []
+        for message_id in message_ids:
+            key = (user_id, message_id)
+            entry = pending.get(key)
+            if entry is None:
+                continue
+            keys.append(key)
+            if entry.base is not None:
+                entry.base = set(_apply(entry.base, add, remove))
+            if overwrite:
+                entry.add -= set(add) | set(remove)
+                entry.remove -= set(add) | set(remove)
+            if not self._drop_if_written(key, entry):
+                message_store.update_labels(message_id, add=entry.add, remove=entry.remove, user_id=user_id)
+        self._persist(keys)
+
+    def rebase(self, message_id: str, add: Iterable[str], remove: Iterable[str], user_id: str = "me"):
+        """
+        Takes a label change Gmail reported (made by another client) into account: the pending
+        change is diffed against the new labels and applied again on top of them locally.
+        """
+        self._rebase([message_id], add, remove, False, user_id)
+
+    def supersede(self, message_ids: Iterable[str], add: Iterable[str], remove: Iterable[str], user_id: str = "me"):
+        """Drops the pending changes of labels that were just written to Gmail directly, which are newer."""
+        self._rebase(message_ids, add, remove, True, user_id)
+
+    def discard(self, message_ids: Iterable[str], user_id: str = "me"):
+        """Drops the pending changes of deleted messages."""
+        pending = self._get_pending()
+        keys = [(user_id, message_id) for message_id in message_ids]
+        for key in keys:
+            pending.pop(key, None)
+        self._persist(keys)
+
+    async def flush(self):
+        """Writes every pending change that is due, with one batchModify call per distinct diff and user."""
+        async with self._get_flush_lock():
+            now = time.time()
+            pending = self._get_pending()
+            groups: Dict[Tuple[str, FrozenSet[str], FrozenSet[str]], List[str]] = {}
+            versions = {}
+            for key, entry in pending.items():
+                if entry.next_attempt_at <= now:
+                    groups.setdefault((key[0], frozenset(entry.add), frozenset(entry.remove)), []).append(key[1])
+                    versions[key] = entry.version
+            if not groups:
+                return
+
+            self._stats["flushes"] += 1
+            self._in_flight = set(versions)
+            try:
+                outcomes = await asyncio.gather(*(self._write(user_id, message_ids, add, remove)
+                                                  for (user_id, add, remove), message_ids in groups.items()))
+            finally:
+                self._in_flight = set()
+            for (user_id, add, remove), results in zip(groups, outcomes):
+                for message_id, result in results.items():
+                    key = (user_id, message_id)
+                    entry = pending.get(key)
+                    # Discarded while it was written
+                    if entry is None:
+                        continue
+                    if result["status"] == "success":
+                        self._settle(key, entry, add, remove, versions[key])
+                    else:
+                        self._fail(key, entry, result["detail"], versions[key])
+            self._persist(versions)
+
+    async def _write(self, user_id: str, message_ids: List[str], add: FrozenSet[str],
+                     remove: FrozenSet[str]) -> Dict[str, Dict[str, str]]:
+        self._stats["gmail_calls"] += -(-len(message_ids) // MAX_BATCH_MUTATION_SIZE)
+        try:
+            service = get_all_gmail_service(user_id)
+        except Exception as e:
+            return {message_id: {"status": "error", "detail": str(e)} for message_id in message_ids}
+        body = {"addLabelIds": sorted(add), "removeLabelIds": sorted(remove)}
+        return await run_batch_mutation(
+            "batchModify", message_ids,
+            lambda chunk: service.users().messages().batchModify(userId="me", body={**body, "ids": chunk}),
+            user_id
+        )
+
+    def _settle(self, key: Tuple[str, str], entry: _Pending, add: FrozenSet[str], remove: FrozenSet[str],
+                version: int):
+        self._stats["written"] += 1
+        if entry.version == version:
+            del self._pending[key]
+            return
+        # Changed again while it was written (even undone): what is left is diffed against what
+        # Gmail has now, so a change undone meanwhile is written back
+        if entry.base is not None:
+            entry.base = set(_apply(entry.base, add, remove))
+        entry.attempts, entry.error, entry.next_attempt_at = 0, None, 0.0
+        self._drop_if_written(key, entry)
+
+    def _fail(self, key: Tuple[str, str], entry: _Pending, error: str, version: int):
+        # Undone while its write failed: Gmail still has the labels the change started from
+        if entry.version != version and self._drop_if_written(key, entry):
+            return
+        entry.attempts += 1
+        entry.error = error
+        if entry.attempts < self.max_attempts:
+            self._stats["retries"] += 1
+            # Full jitter keeps the retries of many messages from landing together
+            entry.next_attempt_at = time.time() + random.uniform(
+                0, min(MUTATION_MAX_RETRY_DELAY, self.flush_interval * 2 ** entry.attempts))
+            return
+
+        # Given up: undo the change locally so the store shows what Gmail has
+        self._stats["given_up"] += 1
+        del self._pending[key]
+        message_store.update_labels(key[1], add=entry.remove, remove=entry.add, user_id=key[0])
+        self._failed.append({"user_id": key[0], "message_id": key[1], "add_labels": sorted(entry.add),
+                             "remove_labels": sorted(entry.remove), "error": error, "failed_at": time.time()})
+
+    def get_status(self, user_id: str = "me") -> Dict[str, Any]:
+        entries = [entry for key, entry in self._get_pending().items() if key[0] == user_id]
+        return {
+            "pending": len(entries),
+            "retrying": sum(entry.attempts > 0 for entry in entries),
+            "errors": sorted({entry.error for entry in entries if entry.error}),
+            "failed": [failure for failure in self._failed if failure["user_id"] == user_id],
+            **self._stats,
+            "running": self.running,
+            "flush_interval": self.flush_interval,
+            "flush_size": self.flush_size,
+        }
+
+
+label_mutation_queue = LabelMutationQueue()
+
+
+@router.get("/pending-changes")
+async def pending_changes():
+    """
+    Get the state of the label changes not yet written to Gmail.
+
+    Returns:
+        Dict with the number of messages with a pending change and how many of them are being
+        retried (with their errors), the changes given up on, counters of changes recorded,
+        cancelled out and written, flushes and Gmail calls, and the flush settings
+    """
+    return label_mutation_queue.get_status()
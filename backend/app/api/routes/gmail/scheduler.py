@@ -0,0 +1,189 @@
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Union
+import aiohttp
+import httplib2
+from googleapiclient.errors import HttpError
+from .http_client import get_http_session
+from .utils import refresh_credentials
+
+# Quota units charged per call, see https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "list": 5,
+    "get": 5,
+    "modify": 5,
+    "send": 100,
+    "delete": 10,
+    "batchModify": 50,
+    "batchDelete": 50,
+    "history": 2,
+    "profile": 1,
+}
+
+# Gmail allows 250 quota units per user per second
+PER_USER_QUOTA_RATE = 250
+MAX_IN_FLIGHT_PER_USER = 25
+MAX_RETRIES = 5
+
+_RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class RetryableStatusError(HttpError):
+    """
+    Raised by raw HTTP calls when Gmail answers with a status worth retrying (429/5xx).
+
+    An HttpError, so once the scheduler runs out of retries the `except HttpError` handlers of
+    the endpoints report it like an error of the client library, with Gmail's status and detail.
+    """
+
+    def __init__(self, status: int, detail: str = ""):
+        super().__init__(httplib2.Response({"status": str(status)}), detail.encode(), uri=None)
+        self.status = status
+
+
+def is_retryable_status(status: int) -> bool:
+    return status == 429 or status >= 500
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, RetryableStatusError):
+        return True
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if is_retryable_status(status):
+            return True
+        # Gmail reports per-user rate limiting as a 403 with a rateLimitExceeded reason
+        if status == 403:
+            return any(detail.get("reason") in _RATE_LIMIT_REASONS
+                       for detail in (error.error_details or []) if isinstance(detail, dict))
+        return False
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` units (quota units, emails, ...) per second.
+
+    A call costing more than the bucket holds waits for a full bucket and is charged in full,
+    leaving the bucket in debt, so later calls wait out the deficit and the rate holds.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, units: float):
+        needed = min(units, self.capacity)
+        # Waiters queue on the lock so quota is handed out in arrival order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= needed:
+                    self.tokens -= units
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+
+async def _send_request(request, user_id: str = "me"):
+    """
+    Sends a googleapiclient request over the shared aiohttp session instead of httplib2,
+    so client-library calls reuse pooled keep-alive connections and never block the event loop.
+    """
+    credentials = request.http.credentials
+    for attempt in range(2):
+        token = credentials.token
+        headers = dict(request.headers)
+        headers["Authorization"] = f"Bearer {token}"
+        async with get_http_session().request(request.method, request.uri, data=request.body,
+                                              headers=headers) as response:
+            content = await response.read()
+            status = response.status
+
+        # The token was rejected (e.g. revoked and reissued), refresh it once and resend
+        if status == 401 and attempt == 0:
+            await asyncio.to_thread(refresh_credentials, credentials, token, user_id)
+            continue
+        if is_retryable_status(status):
+            raise RetryableStatusError(status, content.decode(errors="replace"))
+
+        resp = httplib2.Response({"status": str(status), **response.headers})
+        if status >= 300:
+            raise HttpError(resp, content, uri=request.uri)
+        return request.postproc(resp, content)
+
+
+class GmailScheduler:
+    """
+    Shared scheduler for Gmail API calls.
+
+    Every call is charged its quota-unit cost against a per-user token bucket,
+    the number of requests in flight per user is capped, and 429/5xx responses
+    are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, quota_rate: float = PER_USER_QUOTA_RATE, max_in_flight: int = MAX_IN_FLIGHT_PER_USER,
+                 max_retries: int = MAX_RETRIES, base_delay: float = 0.5, max_delay: float = 32.0):
+        self.quota_rate = quota_rate
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _bucket(self, user_id: str) -> TokenBucket:
+        if user_id not in self._buckets:
+            self._buckets[user_id] = TokenBucket(self.quota_rate, self.quota_rate)
+        return self._buckets[user_id]
+
+    def _semaphore(self, user_id: str) -> asyncio.Semaphore:
+        if user_id not in self._semaphores:
+            self._semaphores[user_id] = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphores[user_id]
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retries from many requests from landing together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, method: str, call: Callable[[], Awaitable[Any]], user_id: str = "me",
+                  count: Union[int, Callable[[], int]] = 1) -> Any:
+        """
+        Runs a Gmail call under the user's quota and concurrency limits.
+
+        Args:
+            method: Gmail method name used to look up its quota cost (list, get, modify, send, ...)
+            call: Coroutine function performing the request, called once per attempt
+            user_id: The Gmail user the quota is charged to
+            count: Number of requests the call stands for (e.g. sub-requests of a batch), or a
+                function returning it, evaluated before each attempt so a retry of a partly
+                answered batch is charged only for the requests it sends again
+
+        Returns:
+            Whatever `call` returns
+        """
+        unit_cost = QUOTA_UNITS.get(method, QUOTA_UNITS["get"])
+        attempt = 0
+        while True:
+            await self._bucket(user_id).acquire(unit_cost * (count() if callable(count) else count))
+            async with self._semaphore(user_id):
+                try:
+                    return await call()
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def execute(self, method: str, request, user_id: str = "me", count: int = 1) -> Any:
+        """Sends a googleapiclient request over the shared HTTP session through `run`."""
+        return await self.run(method, lambda: _send_request(request, user_id),
+                              user_id=user_id, count=count)
+
+
+gmail_scheduler = GmailScheduler()
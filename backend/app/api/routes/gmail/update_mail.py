@@ -5,14 +5,93 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from fastapi import APIRouter, HTTPException, Body
-from typing import Dict, Any, Optional
+from pydantic import BaseModel
+from typing import Dict, Any, List, Optional
 from email.mime.text import MIMEText
+from email.utils import parseaddr
 import base64
-from .utils import get_all_gmail_service
+from db.application_store import application_store
+from db.message_store import message_store
+from .batch import run_batch_mutation
+from .get_mail import FETCH_PARAMS, get_email, get_email_by_id
+from .mutation_queue import label_mutation_queue
+from .scheduler import gmail_scheduler
+from .utils import get_all_gmail_service, get_read_gmail_service
 
 router = APIRouter()
 
 
+class BatchModifyRequest(BaseModel):
+    message_ids: List[str]
+    add_label_ids: List[str] = []
+    remove_label_ids: List[str] = []
+
+
+class BatchDeleteRequest(BaseModel):
+    message_ids: List[str]
+
+
+def _summary(results: Dict[str, Dict[str, str]]) -> Dict[str, Any]:
+    succeeded = sum(result["status"] == "success" for result in results.values())
+    return {
+        "status": "success" if succeeded == len(results) else "partial" if succeeded else "error",
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+    }
+
+
+# Headers of the original email that replies and forwards are composed from
+_COMPOSE_KEYS = ("threadId", "from", "to", "subject", "date", "messageId", "references")
+
+
+async def _get_original_message(message_id: str, with_body: bool = False) -> Dict[str, Any]:
+    """
+    Get what a reply or forward is composed from: the original email's headers and, if asked,
+    its body. The local message store is used first; otherwise only the headers are fetched
+    (format=metadata), unless the body is needed too.
+    """
+    email_data = message_store.get(message_id)
+    if with_body and (email_data is None or "body" not in email_data):
+        email_data = (await get_email_by_id(message_id))["data"]
+    # Emails stored before threading headers were kept lack them
+    if email_data is None or "messageId" not in email_data:
+        try:
+            message = await gmail_scheduler.execute("get", get_read_gmail_service().users().messages().get(
+                userId="me",
+                id=message_id,
+                **FETCH_PARAMS["compose"]
+            ))
+        except HttpError as error:
+            if error.resp.status == 404:
+                raise HTTPException(status_code=404, detail="Email not found")
+            raise
+        headers = get_email(message, format="metadata")["data"]
+        if email_data is None:
+            return headers
+        email_data = {**email_data, **{key: headers[key] for key in _COMPOSE_KEYS}}
+        message_store.put_many([email_data])
+    return email_data
+
+
+async def _send_message(to: str, subject: str, text: str, thread_id: Optional[str] = None,
+                        headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Builds the outgoing MIME message once and sends it, in `thread_id` if given."""
+    message = MIMEText(text, "plain", "utf-8")
+    message["To"] = to
+    message["Subject"] = subject
+    for name, value in (headers or {}).items():
+        message[name] = value
+
+    body = {"raw": base64.urlsafe_b64encode(message.as_bytes()).decode()}
+    if thread_id:
+        body["threadId"] = thread_id
+    return await gmail_scheduler.execute("send", get_all_gmail_service().users().messages().send(
+        userId="me",
+        body=body
+    ))
+
+
 @router.post("/reply")
 async def reply_to_email(
     message_id: str,
@@ -32,51 +111,25 @@ async def reply_to_email(
         Dict with status and message information
     """
     try:
-        service = get_all_gmail_service()
+        original_message = await _get_original_message(message_id)
 
-        # Get the original message to extract headers
-        original_message = service.users().messages().get(
-            userId="me",
-            id=message_id
-        ).execute()
-
-        headers = original_message["payload"]["headers"]
-        subject = next((h["value"]
-                       for h in headers if h["name"] == "Subject"), "")
-        from_email = next((h["value"]
-                          for h in headers if h["name"] == "From"), "")
-
-        # Extract email address from the "From" field
-        if "<" in from_email and ">" in from_email:
-            to_email = from_email.split("<")[1].split(">")[0]
-        else:
-            to_email = from_email
-
-        # Create reply with proper headers
-        if not subject.startswith("Re:"):
+        subject = original_message["subject"]
+        if not subject.lower().startswith("re:"):
             subject = f"Re: {subject}"
 
-        # Create the message
-        message = MIMEText(reply_data["body"])
-        message["To"] = to_email
-        message["Subject"] = subject
-        message["In-Reply-To"] = message_id
-        message["References"] = message_id
-
-        # Encode the message
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        # Thread on the RFC 5322 Message-ID, which is what mail clients match replies against
+        headers = {}
+        if original_message["messageId"]:
+            headers["In-Reply-To"] = original_message["messageId"]
+            headers["References"] = f"{original_message['references']} {original_message['messageId']}".strip()
 
-        # Create the final message body
-        body = {
-            "raw": encoded_message,
-            "threadId": reply_data.get("thread_id", original_message.get("threadId"))
-        }
-
-        # Send the reply
-        sent_message = service.users().messages().send(
-            userId="me",
-            body=body
-        ).execute()
+        sent_message = await _send_message(
+            to=parseaddr(original_message["from"])[1] or original_message["from"],
+            subject=subject,
+            text=reply_data["body"],
+            thread_id=reply_data.get("thread_id", original_message.get("threadId")),
+            headers=headers
+        )
 
         return {
             "status": "success",
@@ -104,10 +157,13 @@ async def delete_email(message_id: str):
         service = get_all_gmail_service()
 
         # Permanently delete the message
-        service.users().messages().delete(
+        await gmail_scheduler.execute("delete", service.users().messages().delete(
             userId="me",
             id=message_id
-        ).execute()
+        ))
+        message_store.delete_many([message_id])
+        label_mutation_queue.discard([message_id])
+        application_store.discard([message_id])
 
         return {
             "status": "success",
@@ -129,27 +185,18 @@ async def archive_email(message_id: str):
         message_id: The ID of the message to archive
 
     Returns:
-        Dict with status and message information
+        Dict with status and message information, the email's labels with the change applied
+        and whether the change is still pending for Gmail
     """
-    try:
-        service = get_all_gmail_service()
-
-        # Remove INBOX label to archive the message
-        service.users().messages().modify(
-            userId="me",
-            id=message_id,
-            body={"removeLabelIds": ["INBOX"]}
-        ).execute()
-
-        return {
-            "status": "success",
-            "message": "Email archived successfully",
-            "archived_message_id": message_id
-        }
+    # Remove INBOX label to archive the message, written to Gmail in the background
+    result = (await label_mutation_queue.record([message_id], remove=["INBOX"]))[message_id]
 
-    except HttpError as error:
-        raise HTTPException(
-            status_code=500, detail=f"An error occurred: {error}")
+    return {
+        "status": "success",
+        "message": "Email archived successfully",
+        "archived_message_id": message_id,
+        **result
+    }
 
 
 @router.post("/mark-as-read/{message_id}")
@@ -161,27 +208,18 @@ async def mark_as_read(message_id: str):
         message_id: The ID of the message to mark as read
 
     Returns:
-        Dict with status and message information
+        Dict with status and message information, the email's labels with the change applied
+        and whether the change is still pending for Gmail
     """
-    try:
-        service = get_all_gmail_service()
-
-        # Remove UNREAD label
-        service.users().messages().modify(
-            userId="me",
-            id=message_id,
-            body={"removeLabelIds": ["UNREAD"]}
-        ).execute()
+    # Remove UNREAD label, written to Gmail in the background
+    result = (await label_mutation_queue.record([message_id], remove=["UNREAD"]))[message_id]
 
-        return {
-            "status": "success",
-            "message": "Email marked as read",
-            "marked_as_read_message_id": message_id
-        }
-
-    except HttpError as error:
-        raise HTTPException(
-            status_code=500, detail=f"An error occurred: {error}")
+    return {
+        "status": "success",
+        "message": "Email marked as read",
+        "marked_as_read_message_id": message_id,
+        **result
+    }
 
 
 @router.post("/mark-as-unread/{message_id}")
@@ -193,27 +231,18 @@ async def mark_as_unread(message_id: str):
         message_id: The ID of the message to mark as unread
 
     Returns:
-        Dict with status and message information
+        Dict with status and message information, the email's labels with the change applied
+        and whether the change is still pending for Gmail
     """
-    try:
-        service = get_all_gmail_service()
+    # Add UNREAD label, written to Gmail in the background
+    result = (await label_mutation_queue.record([message_id], add=["UNREAD"]))[message_id]
 
-        # Add UNREAD label
-        service.users().messages().modify(
-            userId="me",
-            id=message_id,
-            body={"addLabelIds": ["UNREAD"]}
-        ).execute()
-
-        return {
-            "status": "success",
-            "message": "Email marked as unread",
-            "marked_as_unread_message_id": message_id
-        }
-
-    except HttpError as error:
-        raise HTTPException(
-            status_code=500, detail=f"An error occurred: {error}")
+    return {
+        "status": "success",
+        "message": "Email marked as unread",
+        "marked_as_unread_message_id": message_id,
+        **result
+    }
 
 
 @router.post("/add-label/{message_id}")
@@ -229,27 +258,78 @@ async def add_label(
         label_data: Contains the label_id to add
 
     Returns:
-        Dict with status and message information
+        Dict with status and message information, the email's labels with the change applied
+        and whether the change is still pending for Gmail
     """
-    try:
-        service = get_all_gmail_service()
+    # Add the specified label, written to Gmail in the background
+    result = (await label_mutation_queue.record([message_id], add=[label_data["label_id"]]))[message_id]
 
-        # Add the specified label
-        service.users().messages().modify(
-            userId="me",
-            id=message_id,
-            body={"addLabelIds": [label_data["label_id"]]}
-        ).execute()
+    return {
+        "status": "success",
+        "message": "Label added successfully",
+        "added_label_message_id": message_id,
+        **result
+    }
 
-        return {
-            "status": "success",
-            "message": "Label added successfully",
-            "added_label_message_id": message_id
-        }
 
-    except HttpError as error:
-        raise HTTPException(
-            status_code=500, detail=f"An error occurred: {error}")
+@router.post("/batch-modify")
+async def batch_modify(request: BatchModifyRequest):
+    """
+    Add and remove labels on many emails at once with users.messages.batchModify,
+    e.g. archive (remove INBOX), mark as read (remove UNREAD) or label a whole selection.
+
+    Args:
+        request: The message IDs and the label IDs to add to and remove from all of them
+
+    Returns:
+        Dict with the overall status, the number of emails that succeeded and failed, and
+        "results" mapping each message ID to its status (and error detail)
+    """
+    if not request.add_label_ids and not request.remove_label_ids:
+        raise HTTPException(status_code=400, detail="No labels to add or remove")
+    message_ids = list(dict.fromkeys(request.message_ids))
+    if not message_ids:
+        return _summary({})
+
+    service = get_all_gmail_service()
+    body = {"addLabelIds": request.add_label_ids, "removeLabelIds": request.remove_label_ids}
+    results = await run_batch_mutation("batchModify", message_ids, lambda chunk: service.users().messages().batchModify(
+        userId="me",
+        body={**body, "ids": chunk}
+    ))
+    succeeded = [message_id for message_id, result in results.items() if result["status"] == "success"]
+    message_store.update_labels_many(succeeded, add=request.add_label_ids, remove=request.remove_label_ids)
+    # Written directly, so these labels are newer than any queued change of them
+    label_mutation_queue.supersede(succeeded, add=request.add_label_ids, remove=request.remove_label_ids)
+    return _summary(results)
+
+
+@router.post("/batch-delete")
+async def batch_delete(request: BatchDeleteRequest):
+    """
+    Permanently delete many emails at once with users.messages.batchDelete.
+
+    Args:
+        request: The IDs of the messages to delete
+
+    Returns:
+        Dict with the overall status, the number of emails that succeeded and failed, and
+        "results" mapping each message ID to its status (and error detail)
+    """
+    message_ids = list(dict.fromkeys(request.message_ids))
+    if not message_ids:
+        return _summary({})
+
+    service = get_all_gmail_service()
+    results = await run_batch_mutation("batchDelete", message_ids, lambda chunk: service.users().messages().batchDelete(
+        userId="me",
+        body={"ids": chunk}
+    ))
+    deleted = [message_id for message_id, result in results.items() if result["status"] == "success"]
+    message_store.delete_many(deleted)
+    label_mutation_queue.discard(deleted)
+    application_store.discard(deleted)
+    return _summary(results)
 
 
 @router.post("/forward")
@@ -271,68 +351,25 @@ async def forward_email(
         Dict with status and message information
     """
     try:
-        service = get_all_gmail_service()
+        original_message = await _get_original_message(message_id, with_body=True)
 
-        # Get the original message
-        original_message = service.users().messages().get(
-            userId="me",
-            id=message_id,
-            format="full"
-        ).execute()
-
-        headers = original_message["payload"]["headers"]
-        subject = next((h["value"]
-                       for h in headers if h["name"] == "Subject"), "")
-        from_email = next((h["value"]
-                          for h in headers if h["name"] == "From"), "")
-
-        # Prepare forward subject
-        if not subject.startswith("Fwd:"):
+        subject = original_message["subject"]
+        if not subject.lower().startswith("fwd:"):
             subject = f"Fwd: {subject}"
 
-        # Get the message content
-        # This is simplified - in a real app you'd need to handle different MIME types
-        message_content = ""
-        if "parts" in original_message["payload"]:
-            for part in original_message["payload"]["parts"]:
-                if part["mimeType"] == "text/plain":
-                    data = part["body"].get("data", "")
-                    if data:
-                        message_content = base64.urlsafe_b64decode(
-                            data).decode()
-                    break
-        elif "body" in original_message["payload"] and "data" in original_message["payload"]["body"]:
-            data = original_message["payload"]["body"]["data"]
-            message_content = base64.urlsafe_b64decode(data).decode()
-
-        # Create forward message
-        forward_text = f"""
-        {forward_data.get('additional_text', '')}
-
-        ---------- Forwarded message ---------
-        From: {from_email}
-        Subject: {subject}
-
-        {message_content}
-        """
-
-        message = MIMEText(forward_text)
-        message["To"] = forward_data["to"]
-        message["Subject"] = subject
-
-        # Encode the message
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-
-        # Create the final message body
-        body = {
-            "raw": encoded_message
-        }
-
-        # Send the forwarded message
-        sent_message = service.users().messages().send(
-            userId="me",
-            body=body
-        ).execute()
+        forward_text = "\n".join([
+            forward_data.get("additional_text", ""),
+            "",
+            "---------- Forwarded message ---------",
+            f"From: {original_message['from']}",
+            f"Date: {original_message.get('date', '')}",
+            f"Subject: {original_message['subject']}",
+            f"To: {original_message.get('to', '')}",
+            "",
+            original_message.get("body", ""),
+        ])
+
+        sent_message = await _send_message(to=forward_data["to"], subject=subject, text=forward_text)
 
         return {
             "status": "success",
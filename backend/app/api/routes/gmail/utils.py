@@ -1,8 +1,14 @@
+import asyncio
+import datetime
+import logging
 import os.path
+import threading
+from typing import Dict, List, Optional, Tuple
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from .http_client import get_requests_session
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
@@ -12,40 +18,173 @@ SCOPES = [
     "https://www.googleapis.com/auth/gmail.send"
 ]
 
+TOKEN_FILE = "token.json"
 
-def get_read_gmail_service():
+# Tokens are refreshed this long before they expire so requests never carry a token that is about to lapse
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Seconds between checks of the background refresher, well within REFRESH_MARGIN
+REFRESH_CHECK_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+_credentials_cache: Dict[Tuple[str, Tuple[str, ...]], Credentials] = {}
+_service_cache: Dict[Tuple[str, Tuple[str, ...]], object] = {}
+
+# One lock per user: every scope set shares the user's token file and refresh token
+_user_locks: Dict[str, threading.Lock] = {}
+_user_locks_guard = threading.Lock()
+
+_refresher_task: Optional[asyncio.Task] = None
+
+
+def _user_lock(user_id: str) -> threading.Lock:
+    with _user_locks_guard:
+        if user_id not in _user_locks:
+            _user_locks[user_id] = threading.Lock()
+        return _user_locks[user_id]
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.valid:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < REFRESH_MARGIN
+
+
+def _save_credentials(creds: Credentials):
+    tmp_file = f"{TOKEN_FILE}.tmp"
+    with open(tmp_file, "w") as token:
+        token.write(creds.to_json())
+    os.replace(tmp_file, TOKEN_FILE)
+
+
+def _get_credentials(scopes: List[str], user_id: str = "me") -> Credentials:
+    """
+    Returns cached credentials for the user and scope set, refreshing them ahead of expiry.
+
+    While the background refresher runs, it refreshes tokens ahead of expiry and a token that
+    is still valid is returned as it is, so async callers never wait on a refresh (a blocking
+    HTTP call) unless the token already lapsed. Concurrent callers that find the token expired
+    wait on the user's lock, and all but the first find it already refreshed, so token.json is
+    only rewritten once.
+    """
+    key = (user_id, tuple(scopes))
+    creds = _credentials_cache.get(key)
+    if creds is not None and (creds.valid if _refresher_task is not None else not _needs_refresh(creds)):
+        return creds
+
+    with _user_lock(user_id):
+        creds = _credentials_cache.get(key)
+        if creds is not None and not _needs_refresh(creds):
+            return creds
+
+        if creds is None and os.path.exists(TOKEN_FILE):
+            creds = Credentials.from_authorized_user_file(TOKEN_FILE, scopes)
+        if not creds or _needs_refresh(creds):
+            if creds and creds.refresh_token:
+                creds.refresh(Request(session=get_requests_session()))
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    "credentials.json", scopes
+                )
+                creds = flow.run_local_server(port=0)
+            _save_credentials(creds)
+
+        _credentials_cache[key] = creds
+        return creds
+
+
+def refresh_credentials(creds: Credentials, rejected_token: str, user_id: str = "me"):
+    """
+    Refreshes credentials the server rejected, unless a concurrent caller already did.
+
+    Args:
+        creds: The credentials whose token was rejected
+        rejected_token: The access token the server rejected
+        user_id: The user the credentials belong to
+    """
+    with _user_lock(user_id):
+        if creds.token != rejected_token and creds.valid:
+            return
+        creds.refresh(Request(session=get_requests_session()))
+        _save_credentials(creds)
+
+
+def refresh_expiring_credentials() -> int:
+    """
+    Refreshes every cached token that expires within REFRESH_MARGIN. Blocking, run in a thread.
+
+    Returns:
+        The number of tokens refreshed
+    """
+    refreshed = 0
+    for (user_id, _), creds in list(_credentials_cache.items()):
+        if not creds.refresh_token or not _needs_refresh(creds):
+            continue
+        with _user_lock(user_id):
+            # Another scope set of the user, or a request, may have refreshed it meanwhile
+            if not _needs_refresh(creds):
+                continue
+            creds.refresh(Request(session=get_requests_session()))
+            _save_credentials(creds)
+            refreshed += 1
+    return refreshed
+
+
+async def _refresh_loop():
+    # Loaded (and refreshed if need be) here, so the first request does not do it on the event loop
+    if os.path.exists(TOKEN_FILE):
+        for scopes in (SCOPES[:1], SCOPES):
+            try:
+                await asyncio.to_thread(_get_credentials, scopes)
+            except Exception:
+                logger.exception("Loading Gmail credentials failed")
+    while True:
+        try:
+            await asyncio.to_thread(refresh_expiring_credentials)
+        except Exception:
+            # Tried again on the next check; requests refresh a lapsed token themselves
+            logger.exception("Refreshing Gmail credentials failed")
+        await asyncio.sleep(REFRESH_CHECK_INTERVAL)
+
+
+async def start_credential_refresher():
+    """Starts refreshing tokens in the background ahead of expiry. Called from the app lifespan."""
+    global _refresher_task
+    if _refresher_task is None:
+        _refresher_task = asyncio.create_task(_refresh_loop())
+
+
+async def stop_credential_refresher():
+    """Stops the background refresher. Called from the app lifespan."""
+    global _refresher_task
+    if _refresher_task is not None:
+        _refresher_task.cancel()
+        await asyncio.gather(_refresher_task, return_exceptions=True)
+        _refresher_task = None
+
+
+def _get_gmail_service(scopes: List[str], user_id: str = "me"):
+    key = (user_id, tuple(scopes))
+    creds = _get_credentials(scopes, user_id)
+    service = _service_cache.get(key)
+    # Credentials are refreshed in place, so a cached service stays valid until they are replaced
+    if service is None or service._http.credentials is not creds:
+        # The discovery document bundled with google-api-python-client avoids fetching and caching it
+        service = build("gmail", "v1", credentials=creds, static_discovery=True, cache_discovery=False)
+        _service_cache[key] = service
+    return service
+
+
+def get_read_gmail_service(user_id: str = "me"):
     """Helper function to authenticate and build the Gmail service (Read Only)."""
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES[0])
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "credentials.json", SCOPES[0]
-            )
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-
-    return build("gmail", "v1", credentials=creds)
-
-
-def get_all_gmail_service():
+    return _get_gmail_service(SCOPES[:1], user_id)
+
+
+def get_all_gmail_service(user_id: str = "me"):
     """Helper function to authenticate and build the Gmail service (Read and Write)."""
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                "credentials.json", SCOPES
-            )
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-
-    return build("gmail", "v1", credentials=creds)
+    return _get_gmail_service(SCOPES, user_id)
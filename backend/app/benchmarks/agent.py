@@ -0,0 +1,261 @@
+"""
+Benchmarks EmailCategorizationAgent on the labelled fixture emails, offline.
+
+A deterministic fake LLM stands in for Gemini: it answers every prompt with the fixture label of
+the email's subject line, after an optional simulated delay. LLM answers are therefore always
+right, and the accuracy reported measures what the tiers in front of the LLM (keyword search, the
+local classifier) get wrong, while the LLM share measures how much traffic they leave to it.
+
+Reported:
+    - keyword search throughput, in emails per second
+    - the share of emails decided by each workflow node, the LLM's included
+    - end-to-end workflow ainvoke latency percentiles
+    - memory allocated per email, for keyword search and for the whole workflow
+    - accuracy, and precision and recall per category
+
+Results are written as JSON so runs can be compared across commits:
+    python -m benchmarks.agent --output before.json
+    python -m benchmarks.agent --output after.json --compare before.json
+
+Run from backend/app:
+    python -m benchmarks.agent [--runs 5] [--llm-latency-ms 0] [--local-classifier local_classifier.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+# The benchmark must not read or write the app's classification cache and training examples
+os.environ["CLASSIFICATION_STORE_PATH"] = ""
+
+from langchain_core.runnables import RunnableLambda
+
+import llm.email_agent
+from benchmarks.preprocessing import _percentile, load_fixtures
+from llm.dedup import DuplicateIndex
+from llm.local_classifier import LocalClassifier
+
+_SUBJECT_RE = re.compile(r"Subject Line: (.*)")
+
+
+class FakeChatModel:
+    """Stands in for ChatGoogleGenerativeAI, answering with the fixture label of each prompt's subject."""
+
+    def __init__(self, labels: Dict[str, str], latency: float = 0.0):
+        self.labels = labels
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs) -> "FakeChatModel":
+        # Replaces the ChatGoogleGenerativeAI class, so the agent "constructs" this instance
+        return self
+
+    def with_structured_output(self, schema):
+        def answer(prompt: str):
+            self.calls += 1
+            match = _SUBJECT_RE.search(prompt)
+            label = self.labels.get(match.group(1).strip() if match else "", "unknown")
+            return schema(category=label, reasoning="Fixture label")
+
+        def invoke(prompt: str):
+            if self.latency:
+                time.sleep(self.latency)
+            return answer(prompt)
+
+        async def ainvoke(prompt: str):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return answer(prompt)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+
+def _reset(agent: "llm.email_agent.EmailCategorizationAgent"):
+    # Every run sees the emails for the first time
+    agent.cache.clear()
+    agent.duplicate_index = DuplicateIndex()
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure_keyword_search(agent, emails: List[Dict[str, Any]], runs: int) -> Dict[str, float]:
+    states = [{"email": email["body"]} for email in emails]
+    start = time.perf_counter()
+    for _ in range(runs):
+        for state in states:
+            agent._keyword_search(state)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    for state in states:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        agent._keyword_search(state)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return {
+        "emails_per_sec": runs * len(states) / seconds,
+        "us_per_email": seconds / (runs * len(states)) * 1e6,
+        "alloc_bytes_per_email": statistics.mean(peaks),
+    }
+
+
+async def measure_workflow(agent, emails: List[Dict[str, Any]], runs: int) -> Dict[str, Any]:
+    latencies = []
+    results = []
+    for run in range(runs):
+        _reset(agent)
+        for email in emails:
+            start = time.perf_counter()
+            result = await agent.workflow.ainvoke(
+                {"subject_line": email["subject"], "email": email["body"], "final": '', "source": '',
+                 "email_id": email["id"], "sender": email.get("from", '')})
+            latencies.append(time.perf_counter() - start)
+            if run == 0:
+                results.append(result)
+
+    _reset(agent)
+    tracemalloc.start()
+    peaks = []
+    for email in emails:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await agent.workflow.ainvoke({"subject_line": email["subject"], "email": email["body"], "final": '',
+                                      "source": '', "email_id": email["id"], "sender": email.get("from", '')})
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    sources: Dict[str, int] = {}
+    for result in results:
+        sources[result["source"]] = sources.get(result["source"], 0) + 1
+    return {
+        "latency_ms": {
+            "mean": statistics.mean(latencies) * 1000,
+            "p50": _percentile(latencies, 50) * 1000,
+            "p95": _percentile(latencies, 95) * 1000,
+            "p99": _percentile(latencies, 99) * 1000,
+            "max": max(latencies) * 1000,
+        },
+        "alloc_bytes_per_email": statistics.mean(peaks),
+        "sources": {source: count / len(results) for source, count in sorted(sources.items())},
+        "llm_share": sources.get("llm", 0) / len(results),
+        "predictions": [(email, result["final"], result["source"]) for email, result in zip(emails, results)],
+    }
+
+
+def score(predictions: List[tuple]) -> Dict[str, Any]:
+    """Returns the accuracy and the precision, recall and support of every category."""
+    categories = sorted({email["label"] for email, _, _ in predictions} | {category for _, category, _ in predictions})
+    per_category = {}
+    for category in categories:
+        true_positives = sum(email["label"] == category and predicted == category
+                             for email, predicted, _ in predictions)
+        predicted_count = sum(predicted == category for _, predicted, _ in predictions)
+        support = sum(email["label"] == category for email, _, _ in predictions)
+        per_category[category] = {
+            "precision": true_positives / predicted_count if predicted_count else None,
+            "recall": true_positives / support if support else None,
+            "support": support,
+        }
+    by_source: Dict[str, List[bool]] = {}
+    for email, predicted, source in predictions:
+        by_source.setdefault(source, []).append(email["label"] == predicted)
+    return {
+        "accuracy": sum(email["label"] == predicted for email, predicted, _ in predictions) / len(predictions),
+        "accuracy_by_source": {source: sum(hits) / len(hits) for source, hits in sorted(by_source.items())},
+        "misclassified": [{"id": email["id"], "label": email["label"], "predicted": predicted, "source": source}
+                          for email, predicted, source in predictions if email["label"] != predicted],
+        "categories": per_category,
+    }
+
+
+def run(runs: int, llm_latency: float, local_classifier_path: Optional[str] = None) -> Dict[str, Any]:
+    emails = load_fixtures()
+    fake_llm = FakeChatModel({email["subject"]: email["label"] for email in emails}, llm_latency)
+    llm.email_agent.ChatGoogleGenerativeAI = fake_llm
+    agent = llm.email_agent.EmailCategorizationAgent()
+    agent.local_classifier = LocalClassifier.load(local_classifier_path) if local_classifier_path else None
+
+    keyword = measure_keyword_search(agent, emails, max(runs, 1) * 20)
+    workflow = asyncio.run(measure_workflow(agent, emails, runs))
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "emails": len(emails),
+        "runs": runs,
+        "llm_latency_ms": llm_latency * 1000,
+        "local_classifier": bool(agent.local_classifier),
+        "keyword_search": keyword,
+        "workflow": {key: value for key, value in workflow.items() if key != "predictions"},
+        "quality": score(workflow["predictions"]),
+    }
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any]):
+    """Prints every numeric result that changed since the baseline run."""
+    before, after = _flatten(baseline), _flatten(results)
+    print(f"\nchanges since {baseline.get('commit') or 'baseline'}:")
+    for key in sorted(before.keys() & after.keys()):
+        if key in ("runs", "emails") or before[key] == after[key]:
+            continue
+        change = f"{(after[key] - before[key]) / before[key]:+.1%}" if before[key] else "new"
+        print(f"  {key:<48} {before[key]:>12.4g} -> {after[key]:<12.4g} {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Passes over the fixture emails for latency")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="Simulated latency of each fake LLM call")
+    parser.add_argument("--local-classifier", help="Path of a trained local classifier to put in front of the LLM")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="A JSON file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args.runs, args.llm_latency_ms / 1000, args.local_classifier)
+    keyword, workflow, quality = results["keyword_search"], results["workflow"], results["quality"]
+    print(f"keyword search: {keyword['emails_per_sec']:,.0f} emails/s, "
+          f"{keyword['alloc_bytes_per_email']:,.0f} bytes allocated per email")
+    print(f"workflow: p50 {workflow['latency_ms']['p50']:.2f} ms, p95 {workflow['latency_ms']['p95']:.2f} ms, "
+          f"p99 {workflow['latency_ms']['p99']:.2f} ms, "
+          f"{workflow['alloc_bytes_per_email']:,.0f} bytes allocated per email")
+    print("decided by: " + ", ".join(f"{source} {share:.0%}" for source, share in workflow["sources"].items()))
+    print(f"accuracy: {quality['accuracy']:.0%}\n")
+    print(f"{'category':<16} {'precision':>9} {'recall':>7} {'support':>8}")
+    for category, metrics in quality["categories"].items():
+        precision = "-" if metrics["precision"] is None else f"{metrics['precision']:.0%}"
+        recall = "-" if metrics["recall"] is None else f"{metrics['recall']:.0%}"
+        print(f"{category:<16} {precision:>9} {recall:>7} {metrics['support']:>8}")
+    for miss in quality["misclassified"]:
+        print(f"  {miss['id']}: {miss['label']} predicted {miss['predicted']} by {miss['source']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
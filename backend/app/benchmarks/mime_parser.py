@@ -0,0 +1,132 @@
+"""
+Benchmarks get_mail's body extraction against the parser get_email used before
+on message shapes commonly seen in recruiter and ATS mail.
+
+Run from backend/app:
+    python -m benchmarks.mime_parser
+"""
+import base64
+import timeit
+import tracemalloc
+from typing import Any, Dict, List
+
+from api.routes.gmail.get_mail import _extract_body
+
+
+def _b64(text: str, charset: str = "utf-8") -> str:
+    return base64.urlsafe_b64encode(text.encode(charset)).decode()
+
+
+def _leaf(mime_type: str, text: str, charset: str = "utf-8", filename: str = "") -> Dict[str, Any]:
+    return {
+        "mimeType": mime_type,
+        "filename": filename,
+        "headers": [{"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'}],
+        "body": {"size": len(text), "data": _b64(text, charset)},
+    }
+
+
+def _attachment(mime_type: str, filename: str, size: int) -> Dict[str, Any]:
+    return {
+        "mimeType": mime_type,
+        "filename": filename,
+        "headers": [{"name": "Content-Disposition", "value": f'attachment; filename="{filename}"'}],
+        "body": {"size": size, "attachmentId": "ANGjdJ8"},
+    }
+
+
+def _multipart(mime_type: str, *parts: Dict[str, Any]) -> Dict[str, Any]:
+    return {"mimeType": mime_type, "filename": "", "headers": [], "body": {"size": 0}, "parts": list(parts)}
+
+
+def _message(payload: Dict[str, Any]) -> Dict[str, Any]:
+    payload["headers"] = payload["headers"] + [
+        {"name": "From", "value": "Acme Recruiting <no-reply@greenhouse.io>"},
+        {"name": "Subject", "value": "Your application to Acme"},
+    ]
+    return {"id": "18c0ffee", "threadId": "18c0ffee", "snippet": "Thank you for applying", "payload": payload}
+
+
+_TEXT = "Hi Jane,\n\nThank you for applying to the Software Engineer role at Acme. " \
+        "We have received your application and will review it shortly.\n\nBest,\nAcme Recruiting\n"
+_HTML = f"<html><head><style>p {{color: red}}</style></head><body><p>{_TEXT.replace(chr(10), '<br>')}</p></body></html>"
+_NEWSLETTER_ROW = "<table><tr><td><p>Top jobs for you this week</p></td></tr></table>"
+_NEWSLETTER = "<html><body>" + _NEWSLETTER_ROW * 40000 + "</body></html>"
+
+
+def build_corpus() -> Dict[str, Dict[str, Any]]:
+    return {
+        "text/plain": _message(_leaf("text/plain", _TEXT)),
+        "text/html only": _message(_leaf("text/html", _HTML)),
+        "alternative": _message(_multipart("multipart/alternative",
+                                           _leaf("text/plain", _TEXT), _leaf("text/html", _HTML))),
+        "mixed>alternative+pdf": _message(_multipart(
+            "multipart/mixed",
+            _multipart("multipart/alternative", _leaf("text/plain", _TEXT), _leaf("text/html", _HTML)),
+            _attachment("application/pdf", "offer.pdf", 250000))),
+        "related>alternative(html)+img": _message(_multipart(
+            "multipart/related",
+            _multipart("multipart/alternative", _leaf("text/html", _HTML)),
+            _attachment("image/png", "logo.png", 40000))),
+        "mixed html + .txt attachment": _message(_multipart(
+            "multipart/mixed",
+            _multipart("multipart/alternative", _leaf("text/html", _HTML)),
+            _leaf("text/plain", "resume as text", filename="resume.txt"))),
+        "latin-1 text/plain": _message(_leaf("text/plain", "Café René: " + _TEXT, charset="iso-8859-1")),
+        "2MB html newsletter": _message(_leaf("text/html", _NEWSLETTER)),
+    }
+
+
+def legacy_body(message: Dict[str, Any]) -> str:
+    """The body extraction get_email used before the recursive walker."""
+    if "parts" in message["payload"]:
+        for part in message["payload"]["parts"]:
+            if part["mimeType"] == "text/plain":
+                if "data" in part["body"]:
+                    return base64.urlsafe_b64decode(part["body"]["data"]).decode()
+        return ""
+    elif "body" in message["payload"] and "data" in message["payload"]["body"]:
+        return base64.urlsafe_b64decode(message["payload"]["body"]["data"]).decode()
+    return ""
+
+
+def current_body(message: Dict[str, Any]) -> str:
+    return _extract_body(message["payload"])
+
+
+def _measure(parse, message) -> Dict[str, Any]:
+    try:
+        body = parse(message)
+    except Exception as e:
+        return {"chars": f"error: {type(e).__name__}", "us": None, "peak_kib": None}
+
+    runs = 3 if len(str(message)) > 1_000_000 else 200
+    seconds = timeit.timeit(lambda: parse(message), number=runs) / runs
+
+    tracemalloc.start()
+    parse(message)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"chars": len(body), "us": seconds * 1e6, "peak_kib": peak / 1024}
+
+
+def run() -> List[Dict[str, Any]]:
+    results = []
+    for shape, message in build_corpus().items():
+        results.append({"shape": shape, "legacy": _measure(legacy_body, message),
+                        "current": _measure(current_body, message)})
+    return results
+
+
+def _format(measure: Dict[str, Any]) -> str:
+    if measure["us"] is None:
+        return f"{measure['chars']:>38}"
+    return f"{measure['chars']:>8} {measure['us']:>12.1f} {measure['peak_kib']:>14.1f}"
+
+
+if __name__ == "__main__":
+    header = f"{'chars':>8} {'us/parse':>12} {'peak KiB':>14}"
+    print(f"{'shape':<32} {'legacy':^38} | {'current':^38}")
+    print(f"{'':<32} {header:>38} | {header:>38}")
+    for result in run():
+        print(f"{result['shape']:<32} {_format(result['legacy']):>38} | {_format(result['current']):>38}")
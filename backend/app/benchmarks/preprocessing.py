@@ -0,0 +1,105 @@
+"""
+Measures what email preprocessing removes from the categorization prompt, and checks on the
+labelled fixture emails that it keeps what the classification depends on.
+
+Offline, every email is checked for the category keywords of its own label: a keyword that is in
+the raw email but missing after preprocessing is reported as lost signal.
+With --llm (needs GOOGLE_API_KEY), every email is categorized by Gemini from both the raw and the
+preprocessed body, and the accuracy and latency of both are compared.
+
+Run from backend/app:
+    python -m benchmarks.preprocessing [--budget 400] [--llm]
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from llm.email_preprocessor import PREPROCESS_TOKEN_BUDGET, preprocess_email
+from llm.keyword_matcher import KeywordMatcher
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "labelled_emails.json")
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _label_keywords(matcher: KeywordMatcher, text: str, label: str) -> set:
+    return {hit.keyword for hit in matcher.find(text) if hit.category == label}
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, round(percentile / 100 * (len(values) - 1)))]
+
+
+def run_offline(emails: List[Dict[str, Any]], token_budget: int) -> List[Dict[str, Any]]:
+    matcher = KeywordMatcher()
+    results = []
+    for email in emails:
+        start = time.perf_counter()
+        preprocessed = preprocess_email(email["body"], token_budget)
+        seconds = time.perf_counter() - start
+        lost = _label_keywords(matcher, email["body"], email["label"]) - \
+            _label_keywords(matcher, preprocessed.text, email["label"])
+        results.append({
+            "id": email["id"],
+            "label": email["label"],
+            "original_tokens": preprocessed.original_tokens,
+            "tokens": preprocessed.tokens,
+            "reduction": preprocessed.reduction,
+            "us": seconds * 1e6,
+            "lost_keywords": sorted(lost),
+        })
+    return results
+
+
+def run_llm(emails: List[Dict[str, Any]], token_budget: int) -> Dict[str, Dict[str, float]]:
+    from llm.email_agent import EmailCategorizationAgent
+    from llm.email_prompts import EMAIL_CATEGORIZATION_PROMPT
+
+    structured_llm = EmailCategorizationAgent().structured_llm
+    summary = {}
+    for variant in ("raw", "preprocessed"):
+        latencies = []
+        correct = 0
+        for email in emails:
+            body = email["body"] if variant == "raw" else preprocess_email(email["body"], token_budget).text
+            prompt = EMAIL_CATEGORIZATION_PROMPT.format(subject_line=email["subject"], email_content=body)
+            start = time.perf_counter()
+            category = structured_llm.invoke(prompt).category
+            latencies.append(time.perf_counter() - start)
+            correct += category == email["label"]
+        summary[variant] = {
+            "accuracy": correct / len(emails),
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=PREPROCESS_TOKEN_BUDGET, help="Token budget per email")
+    parser.add_argument("--llm", action="store_true", help="Compare Gemini accuracy and latency on raw vs preprocessed")
+    args = parser.parse_args()
+
+    emails = load_fixtures()
+    results = run_offline(emails, args.budget)
+    print(f"{'id':<14} {'label':<16} {'tokens':>7} {'kept':>6} {'reduction':>10} {'us':>8}  lost keywords")
+    for result in results:
+        print(f"{result['id']:<14} {result['label']:<16} {result['original_tokens']:>7} {result['tokens']:>6} "
+              f"{result['reduction']:>10.0%} {result['us']:>8.0f}  {', '.join(result['lost_keywords'])}")
+    original = sum(result["original_tokens"] for result in results)
+    kept = sum(result["tokens"] for result in results)
+    print(f"\ntotal: {original} -> {kept} estimated tokens ({1 - kept / original:.0%} removed), "
+          f"emails with lost keywords: {sum(bool(result['lost_keywords']) for result in results)}/{len(results)}")
+
+    if args.llm:
+        for variant, summary in run_llm(emails, args.budget).items():
+            print(f"{variant:<14} accuracy {summary['accuracy']:.0%}  "
+                  f"p50 {summary['p50_ms']:.0f} ms  p95 {summary['p95_ms']:.0f} ms")
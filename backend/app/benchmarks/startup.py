@@ -0,0 +1,102 @@
+"""
+Measures API cold start: how long `import main` takes, which imports dominate it
+(python -X importtime), and how long a fresh uvicorn process takes to answer its first request.
+
+Run from backend/app:
+    python -m benchmarks.startup [--runs 5] [--warm-up]
+
+--warm-up starts the server with WARM_UP_AGENT set, so the time to first 200 includes
+building the categorization agent in the lifespan.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_REQUEST_PATH = "/openapi.json"
+SERVER_START_TIMEOUT = 60
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_times() -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Imports main in a fresh interpreter with -X importtime.
+
+    Returns:
+        The total import time of main in ms, and the ms spent importing each top-level package's
+        own modules (self time summed per package), slowest first
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=APP_DIR, capture_output=True, text=True, check=True)
+    total = 0.0
+    packages: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if name == "main":
+            total = int(cumulative_us) / 1000
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+    return total, sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+
+def time_to_first_200(warm_up: bool = False) -> float:
+    """Starts uvicorn in a fresh process and returns the seconds until it first answers with 200."""
+    port = _free_port()
+    env = dict(os.environ)
+    if warm_up:
+        env["WARM_UP_AGENT"] = "1"
+    url = f"http://127.0.0.1:{port}{FIRST_REQUEST_PATH}"
+
+    start = time.perf_counter()
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while time.perf_counter() - start < SERVER_START_TIMEOUT:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited during startup:\n{server.stderr.read().decode()}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f"No 200 from {url} within {SERVER_START_TIMEOUT}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up", action="store_true")
+    parser.add_argument("--top", type=int, default=10, help="Number of top-level packages to list")
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        total, packages = import_times()
+        totals.append(total)
+    print(f"import main: median {statistics.median(totals):.0f} ms, min {min(totals):.0f} ms over {args.runs} runs")
+    print("slowest packages to import (last run, ms):")
+    for package, ms in packages[:args.top]:
+        print(f"  {package:<32} {ms:>8.0f}")
+
+    firsts = [time_to_first_200(args.warm_up) * 1000 for _ in range(args.runs)]
+    print(f"time to first 200 ({FIRST_REQUEST_PATH}{', warm-up' if args.warm_up else ''}): "
+          f"median {statistics.median(firsts):.0f} ms, min {min(firsts):.0f} ms over {args.runs} runs")
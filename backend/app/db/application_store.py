@@ -0,0 +1,391 @@
+"""
+Job applications tracked from classified emails.
+
+Run as a script to rebuild the aggregates from the recorded events and report where the
+incrementally maintained ones differed:
+
+    python -m db.application_store [--user-id me]
+"""
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from db.email_repository import JOB_CATEGORIES, company_from_sender
+from db.message_store import MESSAGE_STORE_PATH
+
+# Applications live next to the messages they are tracked from by default
+APPLICATION_STORE_PATH = os.environ.get("APPLICATION_STORE_PATH", MESSAGE_STORE_PATH)
+
+# Domains sending on behalf of many companies: their sender domain alone does not tell
+# applications apart, the company name (the sender's display name) has to as well.
+# Applicant tracking systems
+ATS_DOMAINS = {
+    "greenhouse.io", "greenhouse-mail.io", "lever.co", "myworkday.com", "workday.com",
+    "smartrecruiters.com", "ashbyhq.com", "icims.com", "jobvite.com", "bamboohr.com", "workablemail.com",
+}
+# Webmail, which recruiters write from as well
+WEBMAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "live.com", "yahoo.com", "icloud.com",
+    "me.com", "aol.com", "proton.me", "protonmail.com", "gmx.com", "zoho.com",
+}
+# Job boards relaying applications
+JOB_BOARD_DOMAINS = {
+    "linkedin.com", "indeed.com", "indeedemail.com", "glassdoor.com", "ziprecruiter.com", "wellfound.com",
+    "angel.co", "dice.com", "monster.com", "otta.com", "hired.com", "handshake.com", "joinhandshake.com",
+}
+_SHARED_DOMAINS = ATS_DOMAINS | WEBMAIL_DOMAINS | JOB_BOARD_DOMAINS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS application_events (
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    application_key TEXT NOT NULL,
+    thread_id TEXT NOT NULL DEFAULT '',
+    company TEXT NOT NULL DEFAULT '',
+    sender_domain TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    received_at INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS application_events_by_application
+    ON application_events (user_id, application_key, received_at DESC, message_id DESC);
+CREATE INDEX IF NOT EXISTS application_events_by_thread ON application_events (user_id, thread_id);
+CREATE TABLE IF NOT EXISTS applications (
+    user_id TEXT NOT NULL,
+    application_key TEXT NOT NULL,
+    company TEXT NOT NULL,
+    sender_domain TEXT NOT NULL,
+    status TEXT NOT NULL,
+    latest_message_id TEXT NOT NULL,
+    first_at INTEGER NOT NULL,
+    latest_at INTEGER NOT NULL,
+    emails INTEGER NOT NULL,
+    PRIMARY KEY (user_id, application_key)
+);
+CREATE INDEX IF NOT EXISTS applications_by_latest ON applications (user_id, latest_at DESC);
+CREATE TABLE IF NOT EXISTS application_counts (
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    applications INTEGER NOT NULL,
+    PRIMARY KEY (user_id, status)
+);
+"""
+
+_APPLICATION_COLUMNS = ("application_key", "company", "sender_domain", "status", "latest_message_id",
+                        "first_at", "latest_at", "emails")
+
+
+def application_key(company: str, sender_domain: str) -> str:
+    """Identifies the application an email belongs to when its thread does not already."""
+    # "hire.lever.co" -> "lever.co"
+    shared = any(sender_domain == domain or sender_domain.endswith(f".{domain}") for domain in _SHARED_DOMAINS)
+    if sender_domain and not shared:
+        return sender_domain
+    return f"{sender_domain}|{company.lower()}"
+
+
+class ApplicationStore:
+    """
+    Job applications derived from the classification of each email, kept up to date incrementally.
+
+    Every email categorized as one of JOB_CATEGORIES is an event. Events are grouped into
+    applications by thread, else by sender domain (and company, for domains sending on behalf of
+    many companies: applicant tracking systems, webmail and job boards).
+    Each application keeps its latest status and email count, and the number of applications per
+    status is kept per user, so reading them never scans the emails. A reclassified email moves
+    or drops its event and only the applications it touched are recomputed.
+    """
+
+    def __init__(self, path: str = APPLICATION_STORE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _rekey_thread(self, conn: sqlite3.Connection, user_id: str, thread_id: str) -> Set[str]:
+        """
+        Moves every event of a thread to the application of its earliest event: an email answering
+        in the thread of a tracked application belongs to it, whoever sent it. Keying by the
+        earliest event rather than the first one recorded keeps the grouping independent of the
+        order emails are classified in.
+
+        Returns:
+            The keys of the applications events moved from and to
+        """
+        earliest = conn.execute(
+            "SELECT company, sender_domain FROM application_events WHERE user_id = ? AND thread_id = ? "
+            "ORDER BY received_at, message_id LIMIT 1",
+            (user_id, thread_id)
+        ).fetchone()
+        if earliest is None:
+            return set()
+        key = application_key(*earliest)
+        moved = {old_key for (old_key,) in conn.execute(
+            "SELECT DISTINCT application_key FROM application_events WHERE user_id = ? AND thread_id = ? "
+            "AND application_key != ?",
+            (user_id, thread_id, key)
+        )}
+        if moved:
+            conn.execute("UPDATE application_events SET application_key = ? WHERE user_id = ? AND thread_id = ?",
+                         (key, user_id, thread_id))
+            moved.add(key)
+        return moved
+
+    def _adjust_count(self, conn: sqlite3.Connection, user_id: str, status: str, delta: int):
+        conn.execute(
+            "INSERT INTO application_counts (user_id, status, applications) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, status) DO UPDATE SET applications = applications + excluded.applications",
+            (user_id, status, delta)
+        )
+
+    def _refresh_application(self, conn: sqlite3.Connection, user_id: str, key: str):
+        """Recomputes one application from its events and moves it between the status counters."""
+        row = conn.execute("SELECT status FROM applications WHERE user_id = ? AND application_key = ?",
+                           (user_id, key)).fetchone()
+        old_status = row[0] if row is not None else None
+
+        emails, first_at = conn.execute(
+            "SELECT COUNT(*), MIN(received_at) FROM application_events WHERE user_id = ? AND application_key = ?",
+            (user_id, key)
+        ).fetchone()
+        if not emails:
+            conn.execute("DELETE FROM applications WHERE user_id = ? AND application_key = ?", (user_id, key))
+            new_status = None
+        else:
+            message_id, new_status, latest_at = conn.execute(
+                "SELECT message_id, status, received_at FROM application_events "
+                "WHERE user_id = ? AND application_key = ? ORDER BY received_at DESC, message_id DESC LIMIT 1",
+                (user_id, key)
+            ).fetchone()
+            # Named after the email that started it: later ones in its thread may come from a recruiter's own address
+            company, sender_domain = conn.execute(
+                "SELECT company, sender_domain FROM application_events "
+                "WHERE user_id = ? AND application_key = ? ORDER BY received_at, message_id LIMIT 1",
+                (user_id, key)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO applications (user_id, application_key, company, sender_domain, status, "
+                "latest_message_id, first_at, latest_at, emails) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, key, company, sender_domain, new_status, message_id, first_at, latest_at, emails)
+            )
+
+        if old_status != new_status:
+            if old_status is not None:
+                self._adjust_count(conn, user_id, old_status, -1)
+            if new_status is not None:
+                self._adjust_count(conn, user_id, new_status, 1)
+
+    def record_classifications(self, emails: Iterable[Dict[str, Any]], results: Dict[str, Dict[str, Any]],
+                               user_id: str = "me") -> int:
+        """
+        Records the classification of each email as an application event, replacing the event of
+        an email classified before. Emails no longer in a job category drop their event.
+
+        Args:
+            emails: Parsed emails, with at least "id" and optionally "threadId", "from" and "internalDate"
+            results: The agent's results keyed by message ID, with "category". Emails without a
+                result, or categorized unknown, are left as they are.
+            user_id: The user the emails belong to
+
+        Returns:
+            The number of applications that changed
+        """
+        touched: Set[str] = set()
+        threads: Set[str] = set()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for email_data in emails:
+                    result = results.get(email_data["id"])
+                    if not result or result.get("category") in (None, '', "unknown"):
+                        continue
+                    message_id = email_data["id"]
+                    previous = conn.execute(
+                        "SELECT application_key, status FROM application_events WHERE user_id = ? AND message_id = ?",
+                        (user_id, message_id)
+                    ).fetchone()
+                    if result["category"] not in JOB_CATEGORIES:
+                        if previous is not None:
+                            touched |= self._delete_events(conn, user_id, [message_id], threads)
+                        continue
+                    if previous is not None and previous[1] == result["category"]:
+                        continue
+
+                    company, sender_domain = company_from_sender(email_data.get("from", ""))
+                    thread_id = email_data.get("threadId", "")
+                    key = application_key(company, sender_domain)
+                    if previous is not None:
+                        touched.add(previous[0])
+                    if thread_id:
+                        threads.add(thread_id)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO application_events (user_id, message_id, application_key, thread_id, "
+                        "company, sender_domain, status, received_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (user_id, message_id, key, thread_id, company, sender_domain, result["category"],
+                         int(email_data.get("internalDate") or 0))
+                    )
+                    touched.add(key)
+                for thread_id in threads:
+                    touched |= self._rekey_thread(conn, user_id, thread_id)
+                for key in touched:
+                    self._refresh_application(conn, user_id, key)
+        return len(touched)
+
+    def _delete_events(self, conn: sqlite3.Connection, user_id: str, message_ids: List[str],
+                       threads: Set[str]) -> Set[str]:
+        """Deletes the events of messages, adding their threads to `threads`. Returns their applications' keys."""
+        touched = set()
+        for message_id in message_ids:
+            row = conn.execute(
+                "SELECT application_key, thread_id FROM application_events WHERE user_id = ? AND message_id = ?",
+                (user_id, message_id)
+            ).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM application_events WHERE user_id = ? AND message_id = ?", (user_id, message_id))
+            touched.add(row[0])
+            if row[1]:
+                # The thread may have lost its earliest email, and with it the application it is keyed by
+                threads.add(row[1])
+        return touched
+
+    def discard(self, message_ids: Iterable[str], user_id: str = "me") -> int:
+        """
+        Drops the events of deleted messages and updates the applications they belonged to.
+
+        Returns:
+            The number of applications that changed
+        """
+        threads: Set[str] = set()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                touched = self._delete_events(conn, user_id, list(message_ids), threads)
+                for thread_id in threads:
+                    touched |= self._rekey_thread(conn, user_id, thread_id)
+                for key in touched:
+                    self._refresh_application(conn, user_id, key)
+        return len(touched)
+
+    def get_dashboard(self, user_id: str = "me", status: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Returns a user's applications, most recently updated first, with the number per status.
+        Reads only the aggregates: one row per application and one per status.
+        """
+        with self._lock:
+            conn = self._connection()
+            counts = dict(conn.execute(
+                "SELECT status, applications FROM application_counts WHERE user_id = ? AND applications > 0",
+                (user_id,)
+            ).fetchall())
+            query = f"SELECT {', '.join(_APPLICATION_COLUMNS)} FROM applications WHERE user_id = ?"
+            params: List[Any] = [user_id]
+            if status:
+                query += " AND status = ?"
+                params.append(status)
+            rows = conn.execute(query + " ORDER BY latest_at DESC", params).fetchall()
+        return {
+            "counts": {category: counts.get(category, 0) for category in JOB_CATEGORIES},
+            "total": sum(counts.values()),
+            "applications": [dict(zip(_APPLICATION_COLUMNS, row)) for row in rows],
+        }
+
+    def _snapshot(self, conn: sqlite3.Connection, user_id: str) -> Tuple[Dict[str, tuple], Dict[str, int]]:
+        applications = {row[0]: row for row in conn.execute(
+            f"SELECT {', '.join(_APPLICATION_COLUMNS)} FROM applications WHERE user_id = ?", (user_id,))}
+        counts = dict(conn.execute(
+            "SELECT status, applications FROM application_counts WHERE user_id = ? AND applications != 0",
+            (user_id,)
+        ).fetchall())
+        return applications, counts
+
+    def _regroup_events(self, conn: sqlite3.Connection, user_id: str) -> int:
+        """Assigns every event of a user its application again, in received order. Returns how many moved."""
+        thread_keys: Dict[str, str] = {}
+        moved = []
+        for message_id, old_key, thread_id, company, sender_domain in conn.execute(
+                "SELECT message_id, application_key, thread_id, company, sender_domain FROM application_events "
+                "WHERE user_id = ? ORDER BY received_at, message_id", (user_id,)).fetchall():
+            key = thread_keys.get(thread_id) if thread_id else None
+            if key is None:
+                key = application_key(company, sender_domain)
+                if thread_id:
+                    thread_keys[thread_id] = key
+            if key != old_key:
+                moved.append((key, user_id, message_id))
+        conn.executemany("UPDATE application_events SET application_key = ? WHERE user_id = ? AND message_id = ?",
+                         moved)
+        return len(moved)
+
+    def rebuild(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Recomputes the applications and status counters from scratch out of the recorded events,
+        for one user or all of them, and reports where the incremental aggregates differed. The
+        events are grouped into applications again too, oldest first, so grouping errors show.
+
+        Returns:
+            Dict with the number of applications rebuilt, the number of events moved to another
+            application and, per user, the keys of applications that were missing, extra or
+            different, the events moved, and whether the status counters differed
+        """
+        report: Dict[str, Any] = {"applications": 0, "events_regrouped": 0, "mismatches": {}}
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                user_ids = [user_id] if user_id is not None else [row[0] for row in conn.execute(
+                    "SELECT user_id FROM application_events UNION SELECT user_id FROM applications")]
+                for uid in user_ids:
+                    before_applications, before_counts = self._snapshot(conn, uid)
+                    conn.execute("DELETE FROM applications WHERE user_id = ?", (uid,))
+                    conn.execute("DELETE FROM application_counts WHERE user_id = ?", (uid,))
+                    regrouped = self._regroup_events(conn, uid)
+                    for (key,) in conn.execute(
+                            "SELECT DISTINCT application_key FROM application_events WHERE user_id = ?",
+                            (uid,)).fetchall():
+                        self._refresh_application(conn, uid, key)
+                    after_applications, after_counts = self._snapshot(conn, uid)
+
+                    report["applications"] += len(after_applications)
+                    report["events_regrouped"] += regrouped
+                    mismatched = sorted(
+                        key for key in set(before_applications) | set(after_applications)
+                        if before_applications.get(key) != after_applications.get(key)
+                    )
+                    if mismatched or regrouped or before_counts != after_counts:
+                        report["mismatches"][uid] = {
+                            "applications": mismatched,
+                            "events_regrouped": regrouped,
+                            "counts_differed": before_counts != after_counts,
+                        }
+        return report
+
+
+application_store = ApplicationStore()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", help="Only rebuild this user's applications")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    report = application_store.rebuild(args.user_id)
+    print(f"rebuilt {report['applications']} applications in {time.perf_counter() - started:.2f}s, "
+          f"{report['events_regrouped']} emails moved to another application")
+    for user_id, mismatch in report["mismatches"].items():
+        print(f"  {user_id}: {len(mismatch['applications'])} applications differed, "
+              f"{mismatch['events_regrouped']} emails moved"
+              + (", status counts differed" if mismatch["counts_differed"] else ""))
+    if not report["mismatches"]:
+        print("the incremental aggregates matched")
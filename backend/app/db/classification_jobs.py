@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from db.message_store import MESSAGE_STORE_PATH
+
+# Jobs live next to the messages they classify by default
+CLASSIFICATION_JOBS_PATH = os.environ.get("CLASSIFICATION_JOBS_PATH", MESSAGE_STORE_PATH)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS classification_jobs (
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    unread INTEGER NOT NULL DEFAULT 0,
+    internal_date INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    category TEXT,
+    source TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS classification_jobs_by_priority
+    ON classification_jobs (status, unread DESC, internal_date DESC);
+"""
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class ClassificationJobStore:
+    """
+    Durable state of the background classification queue.
+
+    One job per (user_id, message ID), moving from pending to running to done or failed. Jobs that
+    were running when the app stopped are made pending again on the next start, and finished jobs
+    keep the category and the workflow node that produced it.
+    """
+
+    def __init__(self, path: str = CLASSIFICATION_JOBS_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def add_many(self, jobs: Iterable[Tuple[str, bool, int]], user_id: str = "me") -> List[str]:
+        """
+        Adds pending jobs for (message ID, unread, internalDate) tuples. Messages that already
+        have a job keep it.
+
+        Returns:
+            The IDs of the messages that got a new job
+        """
+        now = time.time()
+        rows = [(user_id, message_id, PENDING, int(unread), int(internal_date), now)
+                for message_id, unread, internal_date in jobs]
+        added = []
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for row in rows:
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO classification_jobs "
+                        "(user_id, message_id, status, unread, internal_date, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        row
+                    )
+                    if cursor.rowcount:
+                        added.append(row[1])
+        return added
+
+    def reset_running(self) -> int:
+        """Makes jobs left running by a stopped app pending again."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                return conn.execute("UPDATE classification_jobs SET status = ?, updated_at = ? WHERE status = ?",
+                                    (PENDING, time.time(), RUNNING)).rowcount
+
+    def list_pending(self) -> List[Tuple[str, str, bool, int]]:
+        """Returns (user_id, message ID, unread, internalDate) of every pending job, highest priority first."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT user_id, message_id, unread, internal_date FROM classification_jobs "
+                "WHERE status = ? ORDER BY unread DESC, internal_date DESC",
+                (PENDING,)
+            ).fetchall()
+        return [(user_id, message_id, bool(unread), internal_date)
+                for user_id, message_id, unread, internal_date in rows]
+
+    def _set_status(self, conn: sqlite3.Connection, message_ids: Iterable[str], status: str, user_id: str):
+        conn.executemany(
+            "UPDATE classification_jobs SET status = ?, updated_at = ? WHERE user_id = ? AND message_id = ?",
+            [(status, time.time(), user_id, message_id) for message_id in message_ids]
+        )
+
+    def mark_running(self, message_ids: Iterable[str], user_id: str = "me"):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                self._set_status(conn, message_ids, RUNNING, user_id)
+
+    def mark_pending(self, message_ids: Iterable[str], user_id: str = "me"):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                self._set_status(conn, message_ids, PENDING, user_id)
+
+    def mark_done(self, results: Iterable[Tuple[str, str, str]], user_id: str = "me"):
+        """Records (message ID, category, source) results of finished jobs."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "UPDATE classification_jobs SET status = ?, category = ?, source = ?, error = NULL, "
+                    "attempts = attempts + 1, updated_at = ? WHERE user_id = ? AND message_id = ?",
+                    [(DONE, category, source, now, user_id, message_id) for message_id, category, source in results]
+                )
+
+    def mark_failed(self, failures: Iterable[Tuple[str, str]], max_attempts: int, user_id: str = "me") -> List[str]:
+        """
+        Records (message ID, error) failures. Jobs with attempts left go back to pending.
+
+        Returns:
+            The IDs of the messages to retry
+        """
+        failures = list(failures)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "UPDATE classification_jobs SET attempts = attempts + 1, error = ?, updated_at = ?, "
+                    "status = CASE WHEN attempts + 1 < ? THEN ? ELSE ? END WHERE user_id = ? AND message_id = ?",
+                    [(error, now, max_attempts, PENDING, FAILED, user_id, message_id) for message_id, error in failures]
+                )
+                retry = []
+                for i in range(0, len(failures), 500):
+                    chunk = [message_id for message_id, _ in failures[i:i + 500]]
+                    retry += [message_id for (message_id,) in conn.execute(
+                        f"SELECT message_id FROM classification_jobs WHERE user_id = ? AND status = ? "
+                        f"AND message_id IN ({','.join('?' * len(chunk))})",
+                        [user_id, PENDING, *chunk]
+                    ).fetchall()]
+        return retry
+
+    def delete_many(self, message_ids: Iterable[str], user_id: str = "me"):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("DELETE FROM classification_jobs WHERE user_id = ? AND message_id = ?",
+                                 [(user_id, message_id) for message_id in message_ids])
+
+    def count_by_status(self, user_id: str = "me") -> Dict[str, int]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT status, COUNT(*) FROM classification_jobs WHERE user_id = ? GROUP BY status",
+                (user_id,)
+            ).fetchall()
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update(rows)
+        return counts
+
+
+classification_job_store = ClassificationJobStore()
@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# Empty to keep classifications in memory only
+CLASSIFICATION_STORE_PATH = os.environ.get("CLASSIFICATION_STORE_PATH", "classifications.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS classifications (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    category TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS classifications_by_version ON classifications (version);
+CREATE TABLE IF NOT EXISTS training_examples (
+    key TEXT PRIMARY KEY,
+    subject TEXT NOT NULL,
+    text TEXT NOT NULL,
+    category TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class ClassificationStore:
+    """
+    Durable tier of the classification cache.
+
+    Entries are keyed by the content hash computed by llm.classification_cache and tagged with
+    the model and prompt version that produced them, so stale versions can be dropped in one go.
+    The store also keeps the LLM-labelled emails llm.local_classifier is trained from.
+    """
+
+    def __init__(self, path: str = CLASSIFICATION_STORE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+        """Returns the stored (category, source) pairs among `keys`, keyed by cache key."""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, category, source FROM classifications WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found.update((key, (category, source)) for key, category, source in rows)
+        return found
+
+    def put_many(self, entries: Iterable[Tuple[str, str, str]], version: str):
+        """Stores (key, category, source) entries produced by the given model and prompt version."""
+        now = time.time()
+        rows = [(key, version, category, source, now) for key, category, source in entries]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO classifications (key, version, category, source, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def delete_other_versions(self, version: str) -> int:
+        """Drops every entry not produced by the given model and prompt version."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                return conn.execute("DELETE FROM classifications WHERE version != ?", (version,)).rowcount
+
+    def put_training_examples(self, examples: Iterable[Tuple[str, str, str, str]]):
+        """Stores (key, subject, text, category) examples labelled by the LLM, replacing older labels."""
+        now = time.time()
+        rows = [(key, subject, text, category, now) for key, subject, text, category in examples]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO training_examples (key, subject, text, category, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def iter_training_examples(self, batch_size: int = 1000) -> Iterator[Tuple[str, str, str]]:
+        """Yields every stored (subject, text, category) training example, oldest first."""
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT rowid, subject, text, category FROM training_examples WHERE rowid > ? "
+                    "ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, subject, text, category in rows:
+                yield subject, text, category
+            last_rowid = rows[-1][0]
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM classifications")
+
+
+classification_store = ClassificationStore() if CLASSIFICATION_STORE_PATH else None
@@ -1,11 +1,31 @@
 import os
-from supabase import create_client, Client
+import threading
 
 SUPABASE_URL: str = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY: str = os.environ.get("SUPABASE_KEY")
 SUPABASE_JWT_SECRET: str = os.environ.get("SUPABASE_JWT_SECRET")
 
-if not all([SUPABASE_URL, SUPABASE_KEY, SUPABASE_JWT_SECRET]):
-    raise ValueError("One or more Supabase environment variables are missing.")
+_supabase = None
+_supabase_lock = threading.Lock()
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+def supabase_configured() -> bool:
+    return all([SUPABASE_URL, SUPABASE_KEY, SUPABASE_JWT_SECRET])
+
+
+def get_supabase():
+    """
+    Returns the app-wide Supabase client, connecting on first use.
+
+    Importing this module neither imports supabase nor connects, so processes that never
+    touch Supabase start without it and without its environment variables.
+    """
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                if not supabase_configured():
+                    raise ValueError("One or more Supabase environment variables are missing.")
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
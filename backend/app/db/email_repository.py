@@ -0,0 +1,333 @@
+import asyncio
+import os
+import time
+from email.utils import parseaddr
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from db.client import get_supabase, supabase_configured
+
+# Rows buffered before a flush is triggered without waiting for the interval
+SUPABASE_BATCH_SIZE = int(os.environ.get("SUPABASE_BATCH_SIZE", "500"))
+
+# Seconds buffered rows wait to be written together
+SUPABASE_FLUSH_INTERVAL = float(os.environ.get("SUPABASE_FLUSH_INTERVAL", "5"))
+
+# Categories of emails that are about a job application
+JOB_CATEGORIES = ("confirmation", "rejected", "accepted", "action_required")
+
+EMAILS_TABLE = "emails"
+JOB_APPLICATIONS_TABLE = "job_applications"
+_CONFLICT_COLUMNS = "user_id,message_id"
+
+# Message IDs per `in` filter, to keep PostgREST URLs short
+_IN_CHUNK_SIZE = 200
+
+
+def company_from_sender(sender: str) -> Tuple[str, str]:
+    """Returns the company an email comes from (the sender's display name, else its domain) and the sender domain."""
+    name, address = parseaddr(sender)
+    domain = address.rpartition("@")[2].lower()
+    # "jobs.acme.com" -> "Acme"
+    labels = domain.split(".")
+    # "Acme via Greenhouse" -> "Acme"
+    company = name.split(" via ")[0].strip() or (labels[-2] if len(labels) > 1 else labels[0]).capitalize()
+    return company, domain
+
+
+def _encode_cursor(row: Dict[str, Any]) -> str:
+    return f"{row['received_at']}:{row['message_id']}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[int, str]:
+    received_at, _, message_id = cursor.partition(":")
+    return int(received_at), message_id
+
+
+class SupabaseBackend:
+    """Runs the repository's reads and writes through the app-wide Supabase client (PostgREST)."""
+
+    def __init__(self, client_factory: Callable[[], Any] = get_supabase):
+        self.client_factory = client_factory
+
+    def upsert(self, table: str, rows: List[Dict[str, Any]]):
+        self.client_factory().table(table).upsert(rows, on_conflict=_CONFLICT_COLUMNS).execute()
+
+    def delete(self, table: str, user_id: str, message_ids: List[str]):
+        for i in range(0, len(message_ids), _IN_CHUNK_SIZE):
+            self.client_factory().table(table).delete().eq("user_id", user_id) \
+                .in_("message_id", message_ids[i:i + _IN_CHUNK_SIZE]).execute()
+
+    def select_page(self, table: str, user_id: str, filters: Dict[str, Any], after: Optional[Tuple[int, str]],
+                    limit: int) -> List[Dict[str, Any]]:
+        query = self.client_factory().table(table).select("*").eq("user_id", user_id)
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        if after is not None:
+            # Keyset pagination: rows strictly after the cursor in (received_at, message_id) DESC order
+            received_at, message_id = after
+            query = query.or_(f"received_at.lt.{received_at},"
+                              f"and(received_at.eq.{received_at},message_id.lt.{message_id})")
+        return query.order("received_at", desc=True).order("message_id", desc=True).limit(limit).execute().data
+
+    def select_in(self, table: str, user_id: str, message_ids: List[str]) -> List[Dict[str, Any]]:
+        rows = []
+        for i in range(0, len(message_ids), _IN_CHUNK_SIZE):
+            rows += self.client_factory().table(table).select("*").eq("user_id", user_id) \
+                .in_("message_id", message_ids[i:i + _IN_CHUNK_SIZE]).execute().data
+        return rows
+
+
+class InMemoryBackend:
+    """Stand-in for SupabaseBackend keeping the tables in dicts, for tests and local runs without Supabase."""
+
+    def __init__(self):
+        self.tables: Dict[str, Dict[Tuple[str, str], Dict[str, Any]]] = {}
+        self.round_trips = 0
+
+    def upsert(self, table: str, rows: List[Dict[str, Any]]):
+        self.round_trips += 1
+        stored = self.tables.setdefault(table, {})
+        for row in rows:
+            key = (row["user_id"], row["message_id"])
+            stored[key] = {**stored.get(key, {}), **row}
+
+    def delete(self, table: str, user_id: str, message_ids: List[str]):
+        self.round_trips += 1
+        stored = self.tables.setdefault(table, {})
+        for message_id in message_ids:
+            stored.pop((user_id, message_id), None)
+
+    def select_page(self, table: str, user_id: str, filters: Dict[str, Any], after: Optional[Tuple[int, str]],
+                    limit: int) -> List[Dict[str, Any]]:
+        self.round_trips += 1
+        rows = [row for (row_user_id, _), row in self.tables.get(table, {}).items()
+                if row_user_id == user_id and all(row.get(column) == value for column, value in filters.items())
+                and (after is None or (row["received_at"], row["message_id"]) < after)]
+        rows.sort(key=lambda row: (row["received_at"], row["message_id"]), reverse=True)
+        return [dict(row) for row in rows[:limit]]
+
+    def select_in(self, table: str, user_id: str, message_ids: List[str]) -> List[Dict[str, Any]]:
+        self.round_trips += 1
+        stored = self.tables.get(table, {})
+        return [dict(stored[(user_id, message_id)]) for message_id in message_ids if (user_id, message_id) in stored]
+
+
+class EmailRepository:
+    """
+    Persists classified emails, their categories and reasoning, and the job-application records
+    derived from them.
+
+    Writes are buffered per (user_id, message ID), so a later classification of the same email
+    replaces the earlier one before anything is sent, and are flushed as one batched upsert per
+    table every `flush_interval` seconds or as soon as `batch_size` rows are buffered. Rows of a
+    failed flush stay buffered for the next one.
+    """
+
+    def __init__(self, backend=None, batch_size: int = SUPABASE_BATCH_SIZE,
+                 flush_interval: float = SUPABASE_FLUSH_INTERVAL):
+        self.backend = backend if backend is not None else SupabaseBackend()
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._emails: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._applications: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stats = {"buffered": 0, "flushes": 0, "round_trips": 0, "rows_written": 0, "failed_flushes": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def _get_flush_lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+
+    async def start(self):
+        """Starts flushing buffered rows in the background. Called from the app lifespan."""
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the flush loop after writing what is buffered."""
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            # Nothing retries after shutdown; the rows are classified again on the next sync
+            pass
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # Rows stay buffered and are retried on the next flush
+                pass
+
+    async def save_classifications(self, emails: Iterable[Dict[str, Any]], results: Dict[str, Dict[str, Any]],
+                                   user_id: str = "me"):
+        """
+        Buffers the classification of each email for the next flush.
+
+        Args:
+            emails: Parsed emails, with at least "id" and optionally "threadId", "from", "subject"
+                and "internalDate"
+            results: The agent's results keyed by message ID, with "category" and "source" and
+                optionally "reasoning". Emails without a result, or categorized unknown, are skipped.
+            user_id: The user the emails belong to
+        """
+        classified_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        for email_data in emails:
+            result = results.get(email_data["id"])
+            if not result or result.get("category") in (None, '', "unknown"):
+                continue
+            key = (user_id, email_data["id"])
+            received_at = int(email_data.get("internalDate") or 0)
+            row = {
+                "user_id": user_id,
+                "message_id": email_data["id"],
+                "thread_id": email_data.get("threadId", ""),
+                "sender": email_data.get("from", ""),
+                "subject": email_data.get("subject", ""),
+                "received_at": received_at,
+                "category": result["category"],
+                "source": result.get("source", ""),
+                "classified_at": classified_at,
+            }
+            # Cached answers carry no reasoning: the column is left out so the stored one is kept
+            if result.get("reasoning"):
+                row["reasoning"] = result["reasoning"]
+            self._emails[key] = {**self._emails.get(key, {}), **row}
+            if result["category"] in JOB_CATEGORIES:
+                company, sender_domain = company_from_sender(email_data.get("from", ""))
+                self._applications[key] = {
+                    "user_id": user_id,
+                    "message_id": email_data["id"],
+                    "thread_id": email_data.get("threadId", ""),
+                    "company": company,
+                    "sender_domain": sender_domain,
+                    "status": result["category"],
+                    "received_at": received_at,
+                    "updated_at": classified_at,
+                }
+            else:
+                # Reclassified out of the job categories: its record, if any, is deleted
+                self._applications[key] = None
+            self._stats["buffered"] += 1
+
+        if len(self._emails) < self.batch_size:
+            return
+        if self.running:
+            self._wake.set()
+            return
+        try:
+            await self.flush()
+        except Exception:
+            # Rows stay buffered and are retried on the next flush
+            pass
+
+    async def flush(self):
+        """
+        Writes every buffered row: one upsert per table and set of columns (rows without reasoning
+        are upserted apart, so theirs is not nulled), plus one delete per user for dropped records.
+        """
+        async with self._get_flush_lock():
+            emails, self._emails = self._emails, {}
+            applications, self._applications = self._applications, {}
+            if not emails and not applications:
+                return
+            self._stats["flushes"] += 1
+            upserts = [row for row in applications.values() if row is not None]
+            deletes: Dict[str, List[str]] = {}
+            for (user_id, message_id), row in applications.items():
+                if row is None:
+                    deletes.setdefault(user_id, []).append(message_id)
+
+            try:
+                by_columns: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+                for row in emails.values():
+                    by_columns.setdefault(tuple(sorted(row)), []).append(row)
+                for rows in by_columns.values():
+                    await asyncio.to_thread(self.backend.upsert, EMAILS_TABLE, rows)
+                    self._stats["round_trips"] += 1
+                if upserts:
+                    await asyncio.to_thread(self.backend.upsert, JOB_APPLICATIONS_TABLE, upserts)
+                    self._stats["round_trips"] += 1
+                for user_id, message_ids in deletes.items():
+                    await asyncio.to_thread(self.backend.delete, JOB_APPLICATIONS_TABLE, user_id, message_ids)
+                    self._stats["round_trips"] += 1
+            except Exception:
+                # Kept for the next flush, unless a newer row was buffered meanwhile
+                self._stats["failed_flushes"] += 1
+                for key, row in emails.items():
+                    self._emails[key] = {**row, **self._emails.get(key, {})}
+                for key, row in applications.items():
+                    self._applications.setdefault(key, row)
+                raise
+            self._stats["rows_written"] += len(emails) + len(upserts)
+
+    async def list_emails(self, user_id: str = "me", category: Optional[str] = None, limit: int = 100,
+                          cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Returns one page of a user's classified emails, newest first.
+
+        Args:
+            user_id: The user whose emails to list
+            category: Only list emails of this category
+            limit: The most emails on the page
+            cursor: The "next_cursor" of the previous page
+
+        Returns:
+            Dict with the "emails" of the page and the "next_cursor" of the following page (None on the last one)
+        """
+        filters = {"category": category} if category else {}
+        after = _decode_cursor(cursor) if cursor else None
+        rows = await asyncio.to_thread(self.backend.select_page, EMAILS_TABLE, user_id, filters, after, limit + 1)
+        return {"emails": rows[:limit], "next_cursor": _encode_cursor(rows[limit - 1]) if len(rows) > limit else None}
+
+    async def list_job_applications(self, user_id: str = "me", status: Optional[str] = None, limit: int = 100,
+                                    cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Returns one page of a user's job-application records, newest first. See list_emails."""
+        filters = {"status": status} if status else {}
+        after = _decode_cursor(cursor) if cursor else None
+        rows = await asyncio.to_thread(self.backend.select_page, JOB_APPLICATIONS_TABLE, user_id, filters, after,
+                                       limit + 1)
+        return {"applications": rows[:limit],
+                "next_cursor": _encode_cursor(rows[limit - 1]) if len(rows) > limit else None}
+
+    async def get_classifications(self, message_ids: Iterable[str], user_id: str = "me") -> Dict[str, Dict[str, Any]]:
+        """Returns the stored classification of each of `message_ids` that has one, buffered rows included."""
+        message_ids = list(dict.fromkeys(message_ids))
+        found = {row["message_id"]: row for row in await asyncio.to_thread(
+            self.backend.select_in, EMAILS_TABLE, user_id, message_ids)}
+        # Buffered rows are newer than anything stored
+        for message_id in message_ids:
+            row = self._emails.get((user_id, message_id))
+            if row is not None:
+                found[message_id] = row
+        return found
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "pending_rows": len(self._emails) + len(self._applications),
+            "running": self.running,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+        }
+
+
+# None when Supabase is not configured; classifications are then only kept locally
+email_repository = EmailRepository() if supabase_configured() else None
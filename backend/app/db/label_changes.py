@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from db.message_store import MESSAGE_STORE_PATH
+
+# Pending changes live next to the messages they change by default
+LABEL_CHANGES_PATH = os.environ.get("LABEL_CHANGES_PATH", MESSAGE_STORE_PATH)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS label_changes (
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    base_labels TEXT,
+    add_labels TEXT NOT NULL,
+    remove_labels TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+);
+"""
+
+
+class LabelChange(NamedTuple):
+    user_id: str
+    message_id: str
+    # Labels the message had at Gmail before the change, None if it was not stored
+    base_labels: Optional[List[str]]
+    add_labels: List[str]
+    remove_labels: List[str]
+    attempts: int = 0
+    error: Optional[str] = None
+    next_attempt_at: float = 0.0
+
+
+class LabelChangeStore:
+    """
+    Durable state of the label mutation queue: the net label change of every message that is
+    not yet written to Gmail, so changes accepted before a restart or a failed flush are not lost.
+    """
+
+    def __init__(self, path: str = LABEL_CHANGES_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def put_many(self, changes: Iterable[LabelChange]):
+        """Stores pending changes, replacing the previous change of each message."""
+        now = time.time()
+        rows = [
+            (change.user_id, change.message_id,
+             None if change.base_labels is None else json.dumps(change.base_labels),
+             json.dumps(change.add_labels), json.dumps(change.remove_labels),
+             change.attempts, change.error, change.next_attempt_at, now)
+            for change in changes
+        ]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO label_changes (user_id, message_id, base_labels, add_labels, "
+                    "remove_labels, attempts, error, next_attempt_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def delete_many(self, keys: Iterable[Tuple[str, str]]):
+        """Drops the pending changes of (user_id, message ID) pairs."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("DELETE FROM label_changes WHERE user_id = ? AND message_id = ?", list(keys))
+
+    def list_all(self) -> List[LabelChange]:
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT user_id, message_id, base_labels, add_labels, remove_labels, attempts, error, next_attempt_at "
+                "FROM label_changes"
+            ).fetchall()
+        return [
+            LabelChange(user_id, message_id, None if base_labels is None else json.loads(base_labels),
+                        json.loads(add_labels), json.loads(remove_labels), attempts, error, next_attempt_at)
+            for user_id, message_id, base_labels, add_labels, remove_labels, attempts, error, next_attempt_at in rows
+        ]
+
+
+label_change_store = LabelChangeStore()
@@ -0,0 +1,184 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+MESSAGE_STORE_PATH = os.environ.get("MESSAGE_STORE_PATH", "messages.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    thread_id TEXT NOT NULL DEFAULT '',
+    history_id TEXT NOT NULL DEFAULT '',
+    internal_date INTEGER NOT NULL DEFAULT 0,
+    labels TEXT NOT NULL DEFAULT '[]',
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS messages_by_date ON messages (user_id, internal_date DESC);
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT PRIMARY KEY,
+    history_id TEXT NOT NULL
+);
+"""
+
+
+class MessageStore:
+    """
+    Durable local copy of the emails parsed by get_mail.get_email.
+
+    Emails are keyed by (user_id, message ID) and versioned by the Gmail historyId they were
+    last seen at. The store also keeps the mailbox historyId each user is synced up to.
+    """
+
+    def __init__(self, path: str = MESSAGE_STORE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get(self, message_id: str, user_id: str = "me") -> Optional[Dict[str, Any]]:
+        return self.get_many([message_id], user_id).get(message_id)
+
+    def get_many(self, message_ids: Iterable[str], user_id: str = "me") -> Dict[str, Dict[str, Any]]:
+        """Returns the stored emails among `message_ids`, keyed by message ID."""
+        message_ids = list(message_ids)
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT id, data FROM messages WHERE user_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                    [user_id, *chunk]
+                ).fetchall()
+                found.update((message_id, json.loads(data)) for message_id, data in rows)
+        return found
+
+    def put_many(self, emails: Iterable[Dict[str, Any]], user_id: str = "me"):
+        """Stores parsed emails, replacing any previous version."""
+        now = time.time()
+        rows = [
+            (user_id, email_data["id"], email_data.get("threadId", ""), str(email_data.get("historyId", "")),
+             int(email_data.get("internalDate") or 0), json.dumps(email_data.get("labels", [])),
+             json.dumps(email_data), now)
+            for email_data in emails
+        ]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO messages "
+                    "(user_id, id, thread_id, history_id, internal_date, labels, data, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def delete_many(self, message_ids: Iterable[str], user_id: str = "me"):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("DELETE FROM messages WHERE user_id = ? AND id = ?",
+                                 [(user_id, message_id) for message_id in message_ids])
+
+    def update_labels(self, message_id: str, add: Iterable[str] = (), remove: Iterable[str] = (),
+                      history_id: Optional[str] = None, user_id: str = "me") -> Optional[Dict[str, Any]]:
+        """
+        Applies a label change to a stored email.
+
+        Returns:
+            The updated email, or None if the email is not stored
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                return self._update_labels(conn, message_id, list(add), set(remove), history_id, user_id)
+
+    def update_labels_many(self, message_ids: Iterable[str], add: Iterable[str] = (), remove: Iterable[str] = (),
+                           user_id: str = "me") -> List[str]:
+        """
+        Applies the same label change to many stored emails in one transaction.
+
+        Returns:
+            The IDs of the emails that are stored and were updated
+        """
+        add, remove = list(add), set(remove)
+        updated = []
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for message_id in message_ids:
+                    if self._update_labels(conn, message_id, add, remove, None, user_id) is not None:
+                        updated.append(message_id)
+        return updated
+
+    def _update_labels(self, conn: sqlite3.Connection, message_id: str, add: List[str], remove: set,
+                       history_id: Optional[str], user_id: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute("SELECT data, history_id FROM messages WHERE user_id = ? AND id = ?",
+                           (user_id, message_id)).fetchone()
+        if row is None:
+            return None
+        email_data = json.loads(row[0])
+        labels = [label for label in email_data.get("labels", []) if label not in remove]
+        labels += [label for label in add if label not in labels]
+        email_data["labels"] = labels
+        if history_id is not None:
+            email_data["historyId"] = str(history_id)
+        conn.execute(
+            "UPDATE messages SET labels = ?, data = ?, history_id = ?, updated_at = ? "
+            "WHERE user_id = ? AND id = ?",
+            (json.dumps(labels), json.dumps(email_data), str(email_data.get("historyId", row[1])),
+             time.time(), user_id, message_id)
+        )
+        return email_data
+
+    def list_by_label(self, label_id: str, limit: Optional[int] = None, user_id: str = "me") -> List[Dict[str, Any]]:
+        """Returns the stored emails carrying `label_id`, newest first."""
+        query = ("SELECT data FROM messages WHERE user_id = ? AND EXISTS "
+                 "(SELECT 1 FROM json_each(messages.labels) WHERE value = ?) "
+                 "ORDER BY internal_date DESC")
+        params: List[Any] = [user_id, label_id]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._connection().execute(query, params).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def clear(self, user_id: str = "me"):
+        """Drops every stored email and the sync position of the user."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+                conn.execute("DELETE FROM sync_state WHERE user_id = ?", (user_id,))
+
+    def get_history_id(self, user_id: str = "me") -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute("SELECT history_id FROM sync_state WHERE user_id = ?",
+                                             (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_history_id(self, history_id: str, user_id: str = "me"):
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO sync_state (user_id, history_id) VALUES (?, ?)",
+                             (user_id, str(history_id)))
+
+
+message_store = MessageStore()
@@ -0,0 +1,37 @@
+-- Tables written by db/email_repository.py. Apply once with the Supabase SQL editor or psql.
+
+CREATE TABLE IF NOT EXISTS emails (
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    thread_id TEXT NOT NULL DEFAULT '',
+    sender TEXT NOT NULL DEFAULT '',
+    subject TEXT NOT NULL DEFAULT '',
+    received_at BIGINT NOT NULL DEFAULT 0,
+    category TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    reasoning TEXT,
+    classified_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, message_id)
+);
+
+-- Newest-first pages of a user's emails, overall and per category (keyset on received_at, message_id)
+CREATE INDEX IF NOT EXISTS emails_by_received ON emails (user_id, received_at DESC, message_id DESC);
+CREATE INDEX IF NOT EXISTS emails_by_category ON emails (user_id, category, received_at DESC, message_id DESC);
+
+-- One row per email about a job application (every category but "others" and "unknown")
+CREATE TABLE IF NOT EXISTS job_applications (
+    user_id TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    thread_id TEXT NOT NULL DEFAULT '',
+    company TEXT NOT NULL DEFAULT '',
+    sender_domain TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,
+    received_at BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS job_applications_by_received
+    ON job_applications (user_id, received_at DESC, message_id DESC);
+CREATE INDEX IF NOT EXISTS job_applications_by_status
+    ON job_applications (user_id, status, received_at DESC, message_id DESC);
@@ -0,0 +1,116 @@
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+import xxhash
+from cachetools import LRUCache
+from db.classification_store import ClassificationStore, classification_store
+from llm.email_prompts import EMAIL_CATEGORIZATION_PROMPT
+
+# Classifications kept in process memory, least recently used evicted first
+CLASSIFICATION_CACHE_SIZE = int(os.environ.get("CLASSIFICATION_CACHE_SIZE", "10000"))
+
+# Derived from the prompt text, so editing the prompt invalidates every cached answer. Keyword and
+# local classifier answers are not covered by it, so the agent only caches LLM answers
+PROMPT_VERSION = xxhash.xxh3_64_hexdigest(EMAIL_CATEGORIZATION_PROMPT.template)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text).strip().lower()
+
+
+class ClassificationCache:
+    """
+    Content-addressed cache of email classifications.
+
+    Entries are keyed by a hash of the normalized subject and body together with the model
+    name and prompt version, so the same email (or the same form letter sent to many users)
+    is only categorized once per model and prompt. Lookups go to an in-process LRU first and
+    to the durable ClassificationStore, when configured, second.
+    Each entry records the workflow node that produced it ("keyword" or "llm").
+    """
+
+    def __init__(self, model_name: str, prompt_version: str = PROMPT_VERSION,
+                 maxsize: int = CLASSIFICATION_CACHE_SIZE, store: Optional[ClassificationStore] = classification_store):
+        self.version = f"{model_name}:{prompt_version}"
+        self._memory: LRUCache = LRUCache(maxsize=maxsize)
+        self._store = store
+        self._store_pruned = False
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+
+    def key(self, subject_line: str, email_content: str) -> str:
+        """Returns the cache key of an email for this model and prompt version."""
+        digest = xxhash.xxh3_128()
+        for part in (self.version, _normalize(subject_line), _normalize(email_content)):
+            digest.update(part.encode("utf-8", errors="replace"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _durable_store(self) -> Optional[ClassificationStore]:
+        # Answers from an earlier model or prompt can never be hit again, so they are dropped once
+        if self._store is not None and not self._store_pruned:
+            self._store.delete_other_versions(self.version)
+            self._store_pruned = True
+        return self._store
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict[str, str]]:
+        """Returns the cached {"category", "source"} among `keys`, keyed by cache key."""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is not None:
+                    found[key] = entry
+            self._stats["memory_hits"] += len(found)
+
+        missing = [key for key in keys if key not in found]
+        store = self._durable_store() if missing else None
+        if store is not None:
+            stored = store.get_many(missing)
+            with self._lock:
+                for key, (category, source) in stored.items():
+                    entry = (category, source)
+                    self._memory[key] = entry
+                    found[key] = entry
+                self._stats["store_hits"] += len(stored)
+
+        with self._lock:
+            self._stats["misses"] += len(keys) - len(found)
+        return {key: {"category": category, "source": source} for key, (category, source) in found.items()}
+
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, entries: Iterable[Tuple[str, str, str]]):
+        """Caches (key, category, source) entries in both tiers."""
+        entries = list(entries)
+        with self._lock:
+            for key, category, source in entries:
+                self._memory[key] = (category, source)
+        store = self._durable_store() if entries else None
+        if store is not None:
+            store.put_many(entries, self.version)
+
+    def put(self, key: str, category: str, source: str):
+        self.put_many([(key, category, source)])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Returns the hit and miss counters since startup, with the overall hit rate."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["store_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["store_hits"]) / lookups if lookups else 0.0
+        stats["version"] = self.version
+        stats["durable"] = self._store is not None
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._store is not None:
+            self._store.clear()
@@ -0,0 +1,133 @@
+import os
+import re
+from email.utils import parseaddr
+from typing import Dict, List, NamedTuple, Optional
+import xxhash
+from cachetools import LRUCache
+
+# Emails whose fingerprints differ in at most this many of 64 bits are treated as the same email
+DEDUP_MAX_DISTANCE = int(os.environ.get("DEDUP_MAX_DISTANCE", "3"))
+
+# Threads and senders remembered, and classified emails remembered per thread or sender
+DEDUP_MAX_GROUPS = 10_000
+DEDUP_EMAILS_PER_GROUP = 50
+
+_WORD_RE = re.compile(r"[A-Za-z0-9']+")
+_SENTENCE_START_RE = re.compile(r"(^|[.!?:\n]\s*)$")
+_SHINGLE_SIZE = 3
+
+
+def _template_words(text: str) -> List[str]:
+    """
+    Returns the words of an email with what varies between copies of a template masked:
+    numbers, and capitalized words inside a sentence (names, companies, job titles).
+    """
+    words = []
+    for match in _WORD_RE.finditer(text):
+        word = match.group(0)
+        if word[0].isdigit():
+            words.append("#")
+        elif word[0].isupper() and not _SENTENCE_START_RE.search(text, max(0, match.start() - 3), match.start()):
+            words.append("@")
+        else:
+            words.append(word.lower())
+    return words
+
+
+def fingerprint(subject_line: str, text: str) -> int:
+    """
+    Returns the 64-bit SimHash of an email's subject and body: copies of the same template get
+    fingerprints at most a few bits apart.
+    """
+    words = _template_words(f"{subject_line}\n{text}")
+    if len(words) < _SHINGLE_SIZE:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + _SHINGLE_SIZE]) for i in range(len(words) - _SHINGLE_SIZE + 1)]
+
+    # Each bit is set when most shingle hashes have it set; counted column-wise over bit strings
+    bits = [format(xxhash.xxh64_intdigest(shingle), "064b") for shingle in shingles]
+    half = len(bits) / 2
+    return int("".join("1" if column.count("1") > half else "0" for column in zip(*bits)), 2)
+
+
+def _distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+def _group_keys(thread_id: str, sender: str) -> List[str]:
+    keys = []
+    if thread_id:
+        keys.append(f"thread:{thread_id}")
+    address = parseaddr(sender)[1].lower()
+    if address:
+        keys.append(f"sender:{address}")
+    return keys
+
+
+class DedupItem(NamedTuple):
+    id: str
+    thread_id: str
+    sender: str
+    fingerprint: int
+
+
+class Duplicate(NamedTuple):
+    id: str
+    category: str
+    source: str
+
+
+class DuplicateIndex:
+    """
+    Finds near-duplicate emails within a thread or from the same sender, so only one email of
+    each group is classified and its category is reused for the rest.
+
+    Emails are only compared with emails of the same thread or sender: the same words from
+    another sender are not enough to share a category.
+    """
+
+    def __init__(self, max_distance: int = DEDUP_MAX_DISTANCE, max_groups: int = DEDUP_MAX_GROUPS,
+                 emails_per_group: int = DEDUP_EMAILS_PER_GROUP):
+        self.max_distance = max_distance
+        self.emails_per_group = emails_per_group
+        self._classified: LRUCache = LRUCache(maxsize=max_groups)
+
+    def find(self, item: DedupItem) -> Optional[Duplicate]:
+        """Returns an already classified near-duplicate of the email, if there is one."""
+        for key in _group_keys(item.thread_id, item.sender):
+            for email_fingerprint, duplicate in self._classified.get(key, ()):
+                if duplicate.id != item.id and _distance(email_fingerprint, item.fingerprint) <= self.max_distance:
+                    return duplicate
+        return None
+
+    def add(self, item: DedupItem, category: str, source: str):
+        """Remembers a classified email for later near-duplicates."""
+        for key in _group_keys(item.thread_id, item.sender):
+            emails = self._classified.get(key) or []
+            emails.append((item.fingerprint, Duplicate(item.id, category, source)))
+            self._classified[key] = emails[-self.emails_per_group:]
+
+    def group(self, items: List[DedupItem]) -> Dict[str, str]:
+        """
+        Groups near-duplicate emails of the same thread or sender.
+
+        Returns:
+            Dict mapping the ID of each email that is a near-duplicate of an earlier one in
+            `items` to the ID of that earlier email, its group's representative
+        """
+        representatives: Dict[str, List[DedupItem]] = {}
+        duplicate_of = {}
+        for item in items:
+            keys = _group_keys(item.thread_id, item.sender)
+            representative = next(
+                (candidate for key in keys for candidate in representatives.get(key, ())
+                 if _distance(candidate.fingerprint, item.fingerprint) <= self.max_distance),
+                None
+            )
+            if representative is not None:
+                duplicate_of[item.id] = representative.id
+                continue
+            for key in keys:
+                representatives.setdefault(key, []).append(item)
+        return duplicate_of
@@ -1,14 +1,24 @@
 from dotenv import load_dotenv
+import asyncio
 import os
-from typing import Literal
+from typing import Any, Dict, List, Literal, Optional
 from typing_extensions import TypedDict
+from llm.classification_cache import ClassificationCache, PROMPT_VERSION
+from llm.dedup import DedupItem, DuplicateIndex, fingerprint
 from llm.email_prompts import EMAIL_CATEGORIZATION_PROMPT
+from llm.email_preprocessor import PREPROCESS_TOKEN_BUDGET, preprocess_email
+from llm.keyword_matcher import KeywordMatcher
+from llm.llm_scheduler import LLMUnavailableError, llm_scheduler
+from llm.local_classifier import LOCAL_CLASSIFIER_THRESHOLD, LocalClassifier, record_llm_labels
 from langgraph.graph import StateGraph, START, END
 from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import BaseModel, Field
 
 load_dotenv()
 
+# Upper bound on LLM requests in flight for one batch of emails
+LLM_BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "8"))
+
 
 class EmailCategory(BaseModel):
     category: str = Field(
@@ -18,10 +28,32 @@ class EmailCategory(BaseModel):
     )
 
 
+# Answers the cache version does not cover are not cached, or they would outlive a change of what
+# decided them: keyword answers a change of KEYWORDS_BY_CATEGORY (and keyword search costs less
+# than a cache lookup anyway), local classifier answers, directly or through a near-duplicate,
+# a retrain of the model
+_UNCACHED_SOURCES = ("keyword", "local", "dedup")
+
+
 class EmailCategorizationAgent:
-    def __init__(self, model_name: str = "gemini-2.0-flash"):
+    def __init__(self, model_name: str = "gemini-2.0-flash", token_budget: int = PREPROCESS_TOKEN_BUDGET):
+        # One attempt per request: retries and timeouts are left to llm_scheduler
         self.llm = ChatGoogleGenerativeAI(
-            model=model_name, api_key=os.getenv("GOOGLE_API_KEY"))
+            model=model_name, api_key=os.getenv("GOOGLE_API_KEY"), max_retries=1)
+        self.model_name = model_name
+        # Built once: with_structured_output wraps the model in a new runnable on every call
+        self.structured_llm = self.llm.with_structured_output(EmailCategory)
+        self.keyword_matcher = KeywordMatcher()
+        self.token_budget = token_budget
+        # What the LLM sees depends on the token budget too, so it is part of the cache version
+        self.cache = ClassificationCache(model_name, prompt_version=f"{PROMPT_VERSION}:{token_budget}")
+        self._preprocessing_totals = {"emails": 0, "original_tokens": 0, "tokens": 0}
+        try:
+            self.local_classifier = LocalClassifier.load()
+        except ValueError:
+            self.local_classifier = None
+        self.local_classifier_threshold = LOCAL_CLASSIFIER_THRESHOLD
+        self.duplicate_index = DuplicateIndex()
         self.workflow = self._create_workflow()
 
     class State(TypedDict):
@@ -29,91 +61,30 @@ class EmailCategorizationAgent:
         email: str
         final: Literal["rejected", "accepted", "action_required",
                        "confirmation", "others", "unknown", '']
+        keyword_hits: List[Dict[str, Any]]
+        source: Literal["keyword", "dedup", "local", "llm", '']
+        prompt_email: str
+        preprocessing: Dict[str, float]
+        local_confidence: float
+        email_id: str
+        thread_id: str
+        sender: str
+        fingerprint: int
+        duplicate_of: str
+        reasoning: str
 
     def _keyword_search(self, state: State):
         """Use keyword search to determine if the email is a rejection, acceptance, action required, or confirmation email."""
-        rejection_keywords = [
-            "unfortunately",
-            "not move forward",
-            "not to move forward",
-            "not to move you forward",
-            "will not be moving forward",
-            "won't be moving forward",
-            "not selected",
-            "regret to inform you",
-            "move forward with another candidate",
-            "move forward with other candidates"
-        ]
-
-        acceptance_keywords = [
-            "congratulations",
-            "excited to offer",
-            "delighted to offer"
-        ]
-
-        action_required_keywords = [
-            "invite you to",
-            "to chat",
-            "technical assessment",
-            "coding assessment",
-            "coding challenge",
-            "online assessment",
-            "online test",
-            "assessment",
-            "hackerrank",
-            "video interview",
-            "next step",
-            "next steps",
-            "please provide",
-            "calendly",
-            "one-time pass code",
-            "otp",
-            "verify your email",
-            "verify your account",
-            "confirm your email"
-        ]
-
-        confirmation_keywords = [
-            "received your application",
-            "reviewing your application",
-            "we'll review",
-            "will review",
-            "will reach out",
-            "to receive your application",
-            "application has been received",
-            "application was sent"
-        ]
-
-        # First, count how many categories have matching keywords
-        matches = 0
-        has_rejection = any(keyword in state["email"].lower()
-                            for keyword in rejection_keywords)
-        has_acceptance = any(
-            keyword in state["email"].lower() for keyword in acceptance_keywords)
-        has_action = any(keyword in state["email"].lower()
-                         for keyword in action_required_keywords)
-        has_confirmation = any(
-            keyword in state["email"].lower() for keyword in confirmation_keywords)
-
-        # Count total matches
-        matches = sum([has_rejection, has_acceptance,
-                      has_action, has_confirmation])
-
-        # If more than one category matches, return empty
-        if matches > 1:
-            return {"final": ''}
+        hits = self.keyword_matcher.find(state["email"])
+        categories = {hit.category for hit in hits}
+        keyword_hits = [hit._asdict() for hit in hits]
+
+        # If more than one category matches (or none does), leave it to the LLM
+        if len(categories) != 1:
+            return {"final": '', "keyword_hits": keyword_hits}
 
         # If exactly one category matches, return that category
-        if has_rejection:
-            return {"final": 'rejected'}
-        elif has_acceptance:
-            return {"final": 'accepted'}
-        elif has_action:
-            return {"final": 'action_required'}
-        elif has_confirmation:
-            return {"final": 'confirmation'}
-        else:
-            return {"final": ''}
+        return {"final": categories.pop(), "keyword_hits": keyword_hits, "source": "keyword"}
 
     def _check_keyword_search_result(self, state: State):
         """Gate function to check if keyword search is enough to determine the email category."""
@@ -121,14 +92,69 @@ class EmailCategorizationAgent:
             return "Fail"
         return "Pass"
 
-    def _llm_call(self, state: State):
+    def _preprocess(self, state: State):
+        """Strip quoted history, signatures and footers from the email and cut it to the token budget for the LLM."""
+        preprocessed = preprocess_email(state["email"], self.token_budget)
+        self._preprocessing_totals["emails"] += 1
+        self._preprocessing_totals["original_tokens"] += preprocessed.original_tokens
+        self._preprocessing_totals["tokens"] += preprocessed.tokens
+        return {
+            "prompt_email": preprocessed.text,
+            "preprocessing": {
+                "original_tokens": preprocessed.original_tokens,
+                "tokens": preprocessed.tokens,
+                "reduction": preprocessed.reduction,
+            },
+        }
+
+    def _dedup_item(self, state: State) -> DedupItem:
+        return DedupItem(state.get("email_id", ''), state.get("thread_id", ''), state.get("sender", ''),
+                         state["fingerprint"])
+
+    def _find_duplicate(self, state: State):
+        """Reuse the category of an already classified near-duplicate from the same thread or sender."""
+        state = {**state, "fingerprint": fingerprint(state["subject_line"], state["prompt_email"])}
+        duplicate = self.duplicate_index.find(self._dedup_item(state))
+        if duplicate is None:
+            return {"final": '', "fingerprint": state["fingerprint"]}
+        return {"final": duplicate.category, "source": "dedup", "duplicate_of": duplicate.id,
+                "fingerprint": state["fingerprint"]}
+
+    def _check_duplicate_result(self, state: State):
+        """Gate function to check if a near-duplicate already decided the email category."""
+        if state["final"] == '':
+            return "Fail"
+        return "Pass"
+
+    def _local_classify(self, state: State):
+        """Use the local classifier trained on past LLM answers, keeping only the answers it is confident in."""
+        if self.local_classifier is None:
+            return {"final": ''}
+        category, confidence = self.local_classifier.predict(state["subject_line"], state["prompt_email"])
+        if confidence < self.local_classifier_threshold:
+            return {"final": '', "local_confidence": confidence}
+        return {"final": category, "source": "local", "local_confidence": confidence}
+
+    def _check_local_classifier_result(self, state: State):
+        """Gate function to check if the local classifier is confident enough to skip the LLM."""
+        if state["final"] == '':
+            return "Fail"
+        return "Pass"
+
+    async def _llm_call(self, state: State):
         """LLM call to categorize the email"""
         prompt_formatted_str: str = EMAIL_CATEGORIZATION_PROMPT.format(
             subject_line=state["subject_line"],
-            email_content=state["email"])
-        structured_llm = self.llm.with_structured_output(EmailCategory)
-        msg = structured_llm.invoke(prompt_formatted_str)
-        return {"final": msg.category}
+            email_content=state["prompt_email"])
+        try:
+            msg = await llm_scheduler.run(lambda: self.structured_llm.ainvoke(prompt_formatted_str))
+        except LLMUnavailableError:
+            # A slow or failing LLM degrades to unknown, which is not cached and so is retried next time
+            return {"final": "unknown", "source": "llm"}
+        if msg is None or not msg.category:
+            return {"final": "unknown", "source": "llm"}
+        record_llm_labels([(state["subject_line"], state["prompt_email"], msg.category)])
+        return {"final": msg.category, "source": "llm", "reasoning": msg.reasoning or ''}
 
     def _create_workflow(self):
         """Create the workflow graph"""
@@ -136,6 +162,9 @@ class EmailCategorizationAgent:
 
         # Add nodes
         workflow.add_node("keyword_search", self._keyword_search)
+        workflow.add_node("preprocess", self._preprocess)
+        workflow.add_node("dedup", self._find_duplicate)
+        workflow.add_node("local_classifier", self._local_classify)
         workflow.add_node("llm_call", self._llm_call)
 
         # Add edges to connect nodes
@@ -143,30 +172,189 @@ class EmailCategorizationAgent:
         workflow.add_conditional_edges(
             "keyword_search",
             self._check_keyword_search_result,
+            {"Fail": "preprocess", "Pass": END}
+        )
+        workflow.add_edge("preprocess", "dedup")
+        workflow.add_conditional_edges(
+            "dedup",
+            self._check_duplicate_result,
+            {"Fail": "local_classifier", "Pass": END}
+        )
+        workflow.add_conditional_edges(
+            "local_classifier",
+            self._check_local_classifier_result,
             {"Fail": "llm_call", "Pass": END}
         )
         workflow.add_edge("llm_call", END)
 
         return workflow.compile()
 
-    async def categorize_email(self, subject_line: str, email_content: str) -> str:
+    async def categorize_email(self, subject_line: str, email_content: str, email_id: str = '',
+                               thread_id: str = '', sender: str = '') -> str:
+        """
+        Categorize an email using the workflow. See categorize_email_with_details for the arguments.
+
+        Returns:
+            str: The category of the email (rejected, accepted, action_required, confirmation, others, or unknown)
+        """
+        result = await self.categorize_email_with_details(subject_line, email_content, email_id, thread_id, sender)
+        return result["category"]
+
+    async def categorize_email_with_details(self, subject_line: str, email_content: str, email_id: str = '',
+                                            thread_id: str = '', sender: str = '') -> Dict[str, Any]:
         """
         Categorize an email using the workflow.
 
         Args:
             email_content: The content of the email to categorize
+            email_id, thread_id, sender: The email's Gmail ID, threadId and From header, when known.
+                A near-duplicate already classified in the same thread or from the same sender
+                then decides the category without another classification.
 
         Returns:
-            str: The category of the email (rejected, accepted, action_required, confirmation, others, or unknown)
+            Dict with the "category" of the email (rejected, accepted, action_required, confirmation,
+            others, or unknown), the "source" that decided it, whether it was "cached", the LLM's
+            "reasoning" when the LLM decided it, and "duplicate_of" when a near-duplicate did
+        """
+        key = self.cache.key(subject_line, email_content)
+        cached = self.cache.get(key)
+        if cached is not None and cached["source"] not in _UNCACHED_SOURCES:
+            return {**cached, "cached": True}
+
+        result = await self.workflow.ainvoke(
+            {"subject_line": subject_line, "email": email_content, "final": '', "source": '',
+             "email_id": email_id, "thread_id": thread_id, "sender": sender})
+        self._record_result(key, result)
+        details = {"category": result["final"], "source": result["source"], "cached": False}
+        for optional in ("reasoning", "duplicate_of"):
+            if result.get(optional):
+                details[optional] = result[optional]
+        return details
+
+    def _record_result(self, key: str, result: State):
+        # Failed and undecided answers are retried next time rather than cached
+        if not result["final"] or result["final"] == "unknown":
+            return
+        if result["source"] not in _UNCACHED_SOURCES:
+            self.cache.put(key, result["final"], result["source"])
+        if result["source"] in ("local", "llm"):
+            self.duplicate_index.add(self._dedup_item(result), result["final"], result["source"])
+
+    async def categorize_emails(self, emails: List[Dict[str, str]],
+                                max_concurrency: int = LLM_BATCH_CONCURRENCY) -> Dict[str, Dict[str, str]]:
+        """
+        Categorize many emails at once: cached answers are reused and keyword search runs over
+        every other email. The rest are grouped with their near-duplicates from the same thread
+        or sender, and only one email per group goes on to the local classifier and, if it is
+        not confident, to the LLM, together with the others as one bulk request.
+
+        Args:
+            emails: The emails to categorize, each with "id", "subject" and "body", and optionally
+                "threadId" and "from"
+            max_concurrency: The most LLM requests of this batch in flight at once, on top of the
+                process-wide limit of llm_scheduler
+
+        Returns:
+            Dict mapping each email ID to its "category", the "source" that decided it
+            ("keyword", "dedup", "local" or "llm") and whether it was "cached", with the LLM's
+            "reasoning" for emails the LLM decided. Emails decided by a near-duplicate name it in
+            "duplicate_of". Emails the LLM failed on or did not
+            answer before the deadline are categorized as unknown.
+        """
+        keys = {email["id"]: self.cache.key(email["subject"], email["body"]) for email in emails}
+        cached = {key: result for key, result in self.cache.get_many(keys.values()).items()
+                  if result["source"] not in _UNCACHED_SOURCES}
+
+        results = {}
+        undecided = []
+        for email in emails:
+            key = keys[email["id"]]
+            if key in cached:
+                results[email["id"]] = {**cached[key], "cached": True}
+                continue
+            state = self._keyword_search({"email": email["body"]})
+            if state["final"]:
+                results[email["id"]] = {"category": state["final"], "source": "keyword", "cached": False}
+            else:
+                undecided.append(email)
+
+        states = []
+        for email in undecided:
+            state = {"subject_line": email["subject"], "email_id": email["id"],
+                     "thread_id": email.get("threadId", ''), "sender": email.get("from", ''),
+                     **self._preprocess({"email": email["body"]})}
+            state.update(self._find_duplicate(state))
+            if state["final"]:
+                results[email["id"]] = {"category": state["final"], "source": "dedup",
+                                        "duplicate_of": state["duplicate_of"], "cached": False}
+            else:
+                states.append(state)
+        duplicate_of = self.duplicate_index.group([self._dedup_item(state) for state in states])
+        representatives = [state for state in states if state["email_id"] not in duplicate_of]
+
+        llm_emails = []
+        for state in representatives:
+            state.update(self._local_classify(state))
+            if state["final"]:
+                results[state["email_id"]] = {"category": state["final"], "source": "local", "cached": False}
+            else:
+                llm_emails.append(state)
+
+        if llm_emails:
+            prompts = [EMAIL_CATEGORIZATION_PROMPT.format(subject_line=state["subject_line"],
+                                                          email_content=state["prompt_email"])
+                       for state in llm_emails]
+            batch_semaphore = asyncio.Semaphore(max_concurrency)
+
+            async def classify(prompt: str):
+                async with batch_semaphore:
+                    return await llm_scheduler.run(lambda: self.structured_llm.ainvoke(prompt))
+
+            msgs = await asyncio.gather(*(classify(prompt) for prompt in prompts), return_exceptions=True)
+            labelled = []
+            for state, msg in zip(llm_emails, msgs):
+                if isinstance(msg, Exception) or msg is None or not msg.category:
+                    results[state["email_id"]] = {"category": "unknown", "source": "llm", "cached": False}
+                    continue
+                labelled.append((state["subject_line"], state["prompt_email"], msg.category))
+                results[state["email_id"]] = {"category": msg.category, "source": "llm", "cached": False,
+                                              "reasoning": msg.reasoning or ''}
+            record_llm_labels(labelled)
+
+        for state in representatives:
+            result = results[state["email_id"]]
+            if result["category"] != "unknown":
+                self.duplicate_index.add(self._dedup_item(state), result["category"], result["source"])
+        # Each near-duplicate takes its representative's category, with the representative recorded
+        for email_id, representative_id in duplicate_of.items():
+            results[email_id] = {"category": results[representative_id]["category"], "source": "dedup",
+                                 "duplicate_of": representative_id, "cached": False}
+
+        self.cache.put_many(
+            (keys[email_id], result["category"], result["source"])
+            for email_id, result in results.items()
+            if not result["cached"] and result["category"] not in ('', "unknown")
+            and result["source"] not in _UNCACHED_SOURCES
+        )
+        return results
+
+    def get_preprocessing_stats(self) -> Dict[str, float]:
+        """Returns how many estimated prompt tokens preprocessing removed from the emails sent to the LLM."""
+        totals = dict(self._preprocessing_totals)
+        totals["reduction"] = 1 - totals["tokens"] / totals["original_tokens"] if totals["original_tokens"] else 0.0
+        return totals
+
+    def reload_local_classifier(self, model: Optional[LocalClassifier]):
+        """
+        Swaps in a retrained local classifier, or disables the tier with None. Near-duplicates
+        remembered so far are forgotten, as some were decided by the previous model.
         """
-        result = await self.workflow.ainvoke({"subject_line": subject_line, "email": email_content, "final": ''})
-        return result["final"]
+        self.local_classifier = model
+        self.duplicate_index = DuplicateIndex()
 
     # TODO: POSSIBLY REMOVE THIS IF NOT NEEDED
     def categorize_email_sync(self, subject_line: str, email_content: str) -> str:
         """
-        Synchronous version of categorize_email
+        Synchronous version of categorize_email, for callers outside an event loop
         """
-        result = self.workflow.invoke(
-            {"subject_line": subject_line, "email": email_content, "final": ''})
-        return result["final"]
+        return asyncio.run(self.categorize_email(subject_line, email_content))
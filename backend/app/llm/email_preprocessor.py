@@ -0,0 +1,178 @@
+import math
+import os
+import re
+from typing import List, NamedTuple, Optional
+from llm.keyword_matcher import KeywordMatcher
+
+# Largest email body, in estimated tokens, put into the categorization prompt
+PREPROCESS_TOKEN_BUDGET = int(os.environ.get("PREPROCESS_TOKEN_BUDGET", "400"))
+
+# Gemini averages about 4 characters of English per token, which is close enough to budget
+# with and avoids a tokenizer round trip
+CHARS_PER_TOKEN = 4
+
+# A sign-off only starts the signature when at most this many lines follow it
+_MAX_SIGNATURE_LINES = 8
+
+# Longer paragraphs are kept even when they mention boilerplate words
+_MAX_FOOTER_PARAGRAPH_CHARS = 600
+
+_QUOTE_HEADER_RE = re.compile(r"^\s*on\b.{0,300}\bwrote:\s*$", re.IGNORECASE)
+_ORIGINAL_MESSAGE_RE = re.compile(r"^\s*-{2,}\s*original message\s*-{2,}\s*$", re.IGNORECASE)
+_OUTLOOK_SEPARATOR_RE = re.compile(r"^\s*_{10,}\s*$")
+_OUTLOOK_FROM_RE = re.compile(r"^\s*\*?from:\*?\s", re.IGNORECASE)
+_OUTLOOK_SENT_RE = re.compile(r"^\s*\*?(sent|date):\*?\s", re.IGNORECASE)
+_SIGNATURE_DELIMITER_RE = re.compile(r"^--\s?$")
+_SENT_FROM_RE = re.compile(r"^\s*sent from my \w+", re.IGNORECASE)
+_SIGN_OFF_RE = re.compile(
+    r"^\s*(best|best regards|kind regards|warm regards|regards|sincerely|thanks|thank you|many thanks|cheers|"
+    r"all the best|respectfully)\s*[,!.]?\s*$",
+    re.IGNORECASE
+)
+_FOOTER_RE = re.compile(
+    r"unsubscribe|opt[ -]out|manage (your )?(email |notification )?(preferences|settings)|privacy policy|"
+    r"terms of (use|service)|all rights reserved|©|\(c\) \d{4}|view (this email |it )?in (your )?browser|"
+    r"this (e-?mail|message) (was sent|is intended|may contain|and any attachments)|"
+    r"(do not|don't|please don't) reply|no-?reply|intended (solely )?for the (use of the )?(individual|addressee)|"
+    r"if you (are not|received this) (the intended recipient|in error)",
+    re.IGNORECASE
+)
+_INVISIBLE_RE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u034f\u00ad]")
+_SPACES_RE = re.compile(r"[ \t\r\f\v\u00a0]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+# Sentences end at punctuation followed by whitespace, so URLs and decimals stay whole
+_SENTENCE_RE = re.compile(r"[^\n]+?(?:[.!?]+(?=\s|$)|(?=\n)|$)")
+_URL_RE = re.compile(r"https?://\S+")
+_SIGNAL_RE = re.compile(
+    r"\b(appl(y|ied|ication)|interview|position|role|candida(te|cy)|offer|assessment|schedul|recruit|hiring|"
+    r"opportunit|decision|decided|status|deadline|availab|complet|submit|qualifi|consider|assignment|take-home|"
+    r"please)\w*",
+    re.IGNORECASE
+)
+
+_keyword_matcher: Optional[KeywordMatcher] = None
+
+
+class PreprocessedEmail(NamedTuple):
+    text: str
+    original_tokens: int
+    tokens: int
+
+    @property
+    def reduction(self) -> float:
+        """Share of the estimated tokens removed, from 0 (unchanged) to 1."""
+        return 1 - self.tokens / self.original_tokens if self.original_tokens else 0.0
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def strip_quoted_history(text: str) -> str:
+    """Drops the quoted reply chain: everything from the first reply header on, and any ">" quoted lines."""
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        # Gmail wraps long "On <date>, <sender> wrote:" headers over two lines
+        joined = line + " " + lines[i + 1] if i + 1 < len(lines) else line
+        if (_QUOTE_HEADER_RE.match(line) or _QUOTE_HEADER_RE.match(joined)
+                or _ORIGINAL_MESSAGE_RE.match(line) or _OUTLOOK_SEPARATOR_RE.match(line)
+                or (_OUTLOOK_FROM_RE.match(line) and any(_OUTLOOK_SENT_RE.match(next_line)
+                                                         for next_line in lines[i + 1:i + 4]))):
+            lines = lines[:i]
+            break
+    return "\n".join(line for line in lines if not line.lstrip().startswith(">"))
+
+
+def strip_signature(text: str) -> str:
+    """Drops the signature: after a "-- " delimiter, a "Sent from my ..." line, or a sign-off near the end."""
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if _SIGNATURE_DELIMITER_RE.match(line) or _SENT_FROM_RE.match(line):
+            lines = lines[:i]
+            break
+    for i in range(max(0, len(lines) - _MAX_SIGNATURE_LINES - 1), len(lines)):
+        if _SIGN_OFF_RE.match(lines[i]):
+            lines = lines[:i]
+            break
+    return "\n".join(lines)
+
+
+def strip_footers(text: str) -> str:
+    """Drops short paragraphs of boilerplate: unsubscribe links, legal notices, do-not-reply notes."""
+    paragraphs = text.split("\n\n")
+    return "\n\n".join(paragraph for paragraph in paragraphs
+                       if len(paragraph) > _MAX_FOOTER_PARAGRAPH_CHARS or not _FOOTER_RE.search(paragraph))
+
+
+def collapse_whitespace(text: str) -> str:
+    text = _INVISIBLE_RE.sub("", text)
+    text = "\n".join(_SPACES_RE.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def _sentence_score(sentence: str, index: int, keyword_hits: int) -> float:
+    score = 10.0 * keyword_hits + 3.0 * len(_SIGNAL_RE.findall(sentence))
+    # Recruiting emails state their point early
+    if index < 3:
+        score += 2.0
+    if len(sentence.split()) < 3 or _URL_RE.fullmatch(sentence.strip()):
+        score -= 1.0
+    return score
+
+
+def fit_to_budget(text: str, token_budget: int = PREPROCESS_TOKEN_BUDGET) -> str:
+    """
+    Cuts `text` down to `token_budget` estimated tokens, keeping the sentences with the most signal
+    (category keywords, recruiting vocabulary, the opening lines) in their original order.
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text
+
+    global _keyword_matcher
+    if _keyword_matcher is None:
+        _keyword_matcher = KeywordMatcher()
+    hit_starts = [hit.start for hit in _keyword_matcher.find(text)]
+
+    sentences = []
+    seen = set()
+    for index, match in enumerate(_SENTENCE_RE.finditer(text)):
+        sentence = match.group(0).strip()
+        # Templated emails repeat boilerplate sentences; each is kept at most once
+        if not sentence or sentence in seen:
+            continue
+        seen.add(sentence)
+        keyword_hits = sum(match.start() <= start < match.end() for start in hit_starts)
+        sentences.append((index, sentence, _sentence_score(sentence, index, keyword_hits)))
+
+    budget_chars = token_budget * CHARS_PER_TOKEN
+    kept: List[tuple] = []
+    used = 0
+    for index, sentence, score in sorted(sentences, key=lambda item: (-item[2], item[0])):
+        if used + len(sentence) + 1 > budget_chars:
+            continue
+        kept.append((index, sentence))
+        used += len(sentence) + 1
+    if not kept:
+        return text[:budget_chars]
+    return "\n".join(sentence for _, sentence in sorted(kept))
+
+
+def preprocess_email(text: str, token_budget: int = PREPROCESS_TOKEN_BUDGET) -> PreprocessedEmail:
+    """
+    Reduces an email body to the part worth sending to the LLM: quoted history, signatures and
+    footers are stripped, whitespace is collapsed, and the rest is cut to the token budget.
+
+    Args:
+        text: The email body
+        token_budget: The most estimated tokens to keep
+
+    Returns:
+        The preprocessed text with its estimated token counts before and after
+    """
+    original_tokens = estimate_tokens(text)
+    stripped = collapse_whitespace(strip_signature(strip_footers(strip_quoted_history(collapse_whitespace(text)))))
+    # Emails that are nothing but a signature or a reply header keep their original text
+    if not stripped:
+        stripped = collapse_whitespace(text)
+    processed = fit_to_budget(stripped, token_budget)
+    return PreprocessedEmail(processed, original_tokens, estimate_tokens(processed))
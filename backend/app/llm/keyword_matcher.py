@@ -0,0 +1,121 @@
+import re
+from typing import Dict, List, NamedTuple
+
+REJECTION_KEYWORDS = [
+    "unfortunately",
+    "not move forward",
+    "not to move forward",
+    "not to move you forward",
+    "will not be moving forward",
+    "won't be moving forward",
+    "not selected",
+    "regret to inform you",
+    "move forward with another candidate",
+    "move forward with other candidates"
+]
+
+ACCEPTANCE_KEYWORDS = [
+    "congratulations",
+    "excited to offer",
+    "delighted to offer"
+]
+
+ACTION_REQUIRED_KEYWORDS = [
+    "invite you to",
+    "to chat",
+    "technical assessment",
+    "coding assessment",
+    "coding challenge",
+    "online assessment",
+    "online test",
+    "assessment",
+    "hackerrank",
+    "video interview",
+    "next step",
+    "next steps",
+    "please provide",
+    "calendly",
+    "one-time pass code",
+    "otp",
+    "verify your email",
+    "verify your account",
+    "confirm your email"
+]
+
+CONFIRMATION_KEYWORDS = [
+    "received your application",
+    "reviewing your application",
+    "we'll review",
+    "will review",
+    "will reach out",
+    "to receive your application",
+    "application has been received",
+    "application was sent"
+]
+
+KEYWORDS_BY_CATEGORY = {
+    "rejected": REJECTION_KEYWORDS,
+    "accepted": ACCEPTANCE_KEYWORDS,
+    "action_required": ACTION_REQUIRED_KEYWORDS,
+    "confirmation": CONFIRMATION_KEYWORDS,
+}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class KeywordHit(NamedTuple):
+    keyword: str
+    category: str
+    start: int
+    end: int
+
+
+class KeywordMatcher:
+    """
+    Finds category keywords in an email, lowercasing it only once.
+
+    Keywords match on word boundaries only (so "otp" does not fire inside "footprint"),
+    and the words of a keyword may be separated by any whitespace, including line breaks.
+    Each keyword is guarded by its longest word: a C-level substring scan for that word
+    rules out most keywords before any regex runs.
+    """
+
+    def __init__(self, keywords_by_category: Dict[str, List[str]] = KEYWORDS_BY_CATEGORY):
+        self._categories = {}
+        keywords_by_anchor: Dict[str, List[str]] = {}
+        for category, keywords in keywords_by_category.items():
+            for keyword in keywords:
+                keyword = " ".join(keyword.lower().split())
+                self._categories[keyword] = category
+                anchor = max(keyword.split(), key=len)
+                keywords_by_anchor.setdefault(anchor, []).append(keyword)
+
+        # Anchor word -> one compiled pattern for the keywords it guards, longest first,
+        # so "next steps" wins over "next step" at the same position
+        self._anchored_patterns = [
+            (anchor, re.compile(r"\b(?:" + "|".join(
+                r"\s+".join(re.escape(word) for word in keyword.split())
+                for keyword in sorted(keywords, key=len, reverse=True)
+            ) + r")\b"))
+            for anchor, keywords in keywords_by_anchor.items()
+        ]
+
+    def find(self, text: str) -> List[KeywordHit]:
+        """Returns every keyword occurrence in `text`, in order, with its category and position."""
+        # Lowercased once; curly apostrophes are normalized so "won’t" matches "won't"
+        text = text.lower().replace("’", "'")
+        hits = []
+        for anchor, pattern in self._anchored_patterns:
+            if anchor not in text:
+                continue
+            for match in pattern.finditer(text):
+                keyword = _WHITESPACE_RE.sub(" ", match.group(0))
+                hits.append(KeywordHit(keyword, self._categories[keyword], match.start(), match.end()))
+
+        # Keep the longest keyword where matches overlap, e.g. "assessment" inside "online assessment"
+        hits.sort(key=lambda hit: (hit.start, -hit.end))
+        kept: List[KeywordHit] = []
+        for hit in hits:
+            if not kept or hit.start >= kept[-1].end:
+                kept.append(hit)
+        return kept
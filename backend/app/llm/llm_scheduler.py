@@ -0,0 +1,146 @@
+import asyncio
+import os
+import random
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from google.api_core import exceptions as google_exceptions
+
+# Gemini requests in flight across the whole process
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+
+# Seconds one request may take, and seconds one classification may take including queueing and retries
+LLM_ATTEMPT_TIMEOUT = float(os.environ.get("LLM_ATTEMPT_TIMEOUT", "15"))
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", "30"))
+
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+
+# Seconds after which a slow request is raced by a second, identical one; 0 disables hedging
+LLM_HEDGE_AFTER = float(os.environ.get("LLM_HEDGE_AFTER", "0"))
+
+_TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the LLM gave no answer before the deadline or kept failing with transient errors."""
+
+
+class LLMScheduler:
+    """
+    Shared scheduler for LLM calls.
+
+    The number of requests in flight is capped process-wide, every request gets a timeout and
+    every call an overall deadline, transient errors (429/5xx, timeouts, dropped connections)
+    are retried with jittered exponential backoff, and requests slower than `hedge_after` can
+    be raced by a second, identical request when a slot is free.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, attempt_timeout: float = LLM_ATTEMPT_TIMEOUT,
+                 deadline: float = LLM_DEADLINE, max_retries: int = LLM_MAX_RETRIES,
+                 hedge_after: float = LLM_HEDGE_AFTER, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_concurrency = max_concurrency
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # One per event loop: asyncio primitives are bound to the loop they are first used on, and
+        # categorize_email_sync runs each call in a new loop. Entries go away with their loop.
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+        self._stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0, "failures": 0}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retries from many requests from landing together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, call: Callable[[], Awaitable[Any]], deadline: Optional[float] = None) -> Any:
+        """
+        Runs an LLM call under the process-wide concurrency limit, timeouts and retry policy.
+
+        Args:
+            call: Coroutine function performing the request, called once per attempt (and hedge)
+            deadline: Seconds the call may take in all, instead of the scheduler's deadline
+
+        Returns:
+            Whatever `call` returns
+
+        Raises:
+            LLMUnavailableError: If the deadline passed or transient errors outlasted the retries
+        """
+        deadline = self.deadline if deadline is None else deadline
+        self._stats["calls"] += 1
+        try:
+            return await asyncio.wait_for(self._run(call), deadline)
+        except asyncio.TimeoutError:
+            self._stats["deadline_exceeded"] += 1
+            raise LLMUnavailableError(f"The LLM did not answer within {deadline:g}s")
+
+    async def _run(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        attempt = 0
+        while True:
+            try:
+                async with self._get_semaphore():
+                    return await asyncio.wait_for(self._race(call), self.attempt_timeout)
+            except _TRANSIENT_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self._stats["failures"] += 1
+                    raise LLMUnavailableError(f"The LLM failed {attempt + 1} times: {e!r}") from e
+            self._stats["retries"] += 1
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def _race(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs `call`, hedged by a second request if it is still running after `hedge_after` seconds."""
+        tasks: List[asyncio.Future] = [asyncio.ensure_future(call())]
+        hedge = None
+        try:
+            if self.hedge_after > 0:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                # The hedge only takes a free slot, it never queues behind other calls
+                if not done and not self._get_semaphore().locked():
+                    await self._get_semaphore().acquire()
+                    self._stats["hedges"] += 1
+                    hedge = asyncio.ensure_future(call())
+                    tasks.append(hedge)
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                # A request that failed while its twin is still running is not the answer yet
+                for task in sorted(done, key=lambda task: task.exception() is not None):
+                    tasks.remove(task)
+                    if task.exception() is None or not tasks:
+                        if task is hedge and task.exception() is None:
+                            self._stats["hedge_wins"] += 1
+                        return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if hedge is not None:
+                self._get_semaphore().release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "max_concurrency": self.max_concurrency,
+            "attempt_timeout": self.attempt_timeout,
+            "deadline": self.deadline,
+            "hedge_after": self.hedge_after,
+        }
+
+
+llm_scheduler = LLMScheduler()
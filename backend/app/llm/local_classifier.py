@@ -0,0 +1,235 @@
+"""
+Local email classifier trained from the LLM's own answers.
+
+A multinomial naive Bayes model over hashed word unigrams and bigrams: small enough to keep in
+memory, fast enough to run on every email before the LLM, and retrained from the emails the LLM
+has labelled so far.
+
+Retrain from backend/app:
+    python -m llm.local_classifier [--from-file benchmarks/fixtures/labelled_emails.json]
+"""
+import argparse
+import json
+import math
+import os
+import re
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+import xxhash
+from db.classification_store import ClassificationStore, classification_store
+
+LOCAL_CLASSIFIER_PATH = os.environ.get("LOCAL_CLASSIFIER_PATH", "local_classifier.json")
+
+# Emails the model is less sure about than this go on to the LLM
+LOCAL_CLASSIFIER_THRESHOLD = float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", "0.95"))
+
+# Fewer labelled emails than this give a model too noisy to skip the LLM with
+LOCAL_CLASSIFIER_MIN_EXAMPLES = int(os.environ.get("LOCAL_CLASSIFIER_MIN_EXAMPLES", "200"))
+
+# Features are hashed into this many buckets, so the model size is bounded whatever the vocabulary
+NUM_FEATURES = 1 << 18
+
+# Additive smoothing of the per-category feature counts
+ALPHA = 0.1
+
+# Naive Bayes treats every word as independent evidence and is overconfident for it, so its
+# scores are divided by a temperature fitted on held-out examples (one in HOLDOUT_EVERY)
+HOLDOUT_EVERY = 5
+_TEMPERATURES = [1, 1.5, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128]
+
+_MODEL_FORMAT = 1
+_TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def _features(subject_line: str, text: str) -> List[int]:
+    """Returns the distinct hashed unigrams and bigrams of an email, with subject words kept apart from body words."""
+    features = set()
+    for prefix, part in (("s:", subject_line), ("", text)):
+        tokens = _TOKEN_RE.findall(part.lower())
+        for token in tokens:
+            features.add(xxhash.xxh32_intdigest(prefix + token) % NUM_FEATURES)
+        for first, second in zip(tokens, tokens[1:]):
+            features.add(xxhash.xxh32_intdigest(f"{prefix}{first} {second}") % NUM_FEATURES)
+    return list(features)
+
+
+def training_key(subject_line: str, text: str) -> str:
+    return xxhash.xxh3_64_hexdigest(f"{subject_line}\0{text}")
+
+
+class LocalClassifier:
+    """A trained naive Bayes model: per category, a log prior and log likelihoods of the features seen in training."""
+
+    def __init__(self, log_priors: Dict[str, float], log_likelihoods: Dict[str, Dict[int, float]],
+                 unseen_log_likelihoods: Dict[str, float], num_examples: int, temperature: float = 1.0):
+        self.categories = list(log_priors)
+        self.temperature = temperature
+        self.log_priors = log_priors
+        self.log_likelihoods = log_likelihoods
+        self.unseen_log_likelihoods = unseen_log_likelihoods
+        self.num_examples = num_examples
+        # Features no training email had say nothing about the category and are skipped
+        self.vocabulary = set().union(*(likelihoods.keys() for likelihoods in log_likelihoods.values()))
+
+    @classmethod
+    def train(cls, examples: Iterable[Tuple[str, str, str]]) -> "LocalClassifier":
+        """
+        Trains a model from (subject, text, category) examples, with its confidence calibrated
+        on a held-out share of them.
+
+        Raises:
+            ValueError: If there are fewer than two categories to tell apart
+        """
+        featurized = [(_features(subject_line, text), category) for subject_line, text, category in examples]
+        if len({category for _, category in featurized}) < 2:
+            raise ValueError("Training needs labelled emails of at least two categories.")
+
+        held_out = featurized[::HOLDOUT_EVERY]
+        calibration_model = cls._fit([example for i, example in enumerate(featurized) if i % HOLDOUT_EVERY])
+        model = cls._fit(featurized)
+        model.temperature = calibration_model._fit_temperature(held_out)
+        return model
+
+    def _fit_temperature(self, held_out: List[Tuple[List[int], str]]) -> float:
+        """Returns the temperature with the lowest log loss on the held-out examples."""
+        held_out = [(features, category) for features, category in held_out if category in self.log_priors]
+        if not held_out:
+            return 1.0
+        scores = [(self._scores(features), category) for features, category in held_out]
+
+        def log_loss(temperature: float) -> float:
+            loss = 0.0
+            for example_scores, category in scores:
+                top = max(example_scores.values())
+                normalizer = sum(math.exp((score - top) / temperature) for score in example_scores.values())
+                loss += math.log(normalizer) - (example_scores[category] - top) / temperature
+            return loss
+
+        return min(_TEMPERATURES, key=log_loss)
+
+    @classmethod
+    def _fit(cls, featurized: List[Tuple[List[int], str]]) -> "LocalClassifier":
+        documents: Dict[str, int] = {}
+        counts: Dict[str, Dict[int, int]] = {}
+        for features, category in featurized:
+            documents[category] = documents.get(category, 0) + 1
+            category_counts = counts.setdefault(category, {})
+            for feature in features:
+                category_counts[feature] = category_counts.get(feature, 0) + 1
+
+        num_examples = sum(documents.values())
+        vocabulary_size = len(set().union(*(category_counts.keys() for category_counts in counts.values())))
+        log_priors = {category: math.log(count / num_examples) for category, count in documents.items()}
+        log_likelihoods = {}
+        unseen_log_likelihoods = {}
+        for category, category_counts in counts.items():
+            denominator = math.log(sum(category_counts.values()) + ALPHA * vocabulary_size)
+            log_likelihoods[category] = {feature: math.log(count + ALPHA) - denominator
+                                         for feature, count in category_counts.items()}
+            unseen_log_likelihoods[category] = math.log(ALPHA) - denominator
+        return cls(log_priors, log_likelihoods, unseen_log_likelihoods, num_examples)
+
+    def _scores(self, features: List[int]) -> Dict[str, float]:
+        features = [feature for feature in features if feature in self.vocabulary]
+        scores = {}
+        for category in self.categories:
+            likelihoods = self.log_likelihoods[category]
+            unseen = self.unseen_log_likelihoods[category]
+            scores[category] = self.log_priors[category] + sum(likelihoods.get(feature, unseen) for feature in features)
+        return scores
+
+    def predict(self, subject_line: str, text: str) -> Tuple[str, float]:
+        """Returns the most likely category of an email and its calibrated probability."""
+        scores = self._scores(_features(subject_line, text))
+        best = max(scores, key=scores.get)
+        # Probability of the best category, normalized in log space to avoid underflow
+        confidence = 1 / sum(math.exp((score - scores[best]) / self.temperature) for score in scores.values())
+        return best, confidence
+
+    def to_dict(self) -> Dict:
+        return {
+            "format": _MODEL_FORMAT,
+            "num_features": NUM_FEATURES,
+            "num_examples": self.num_examples,
+            "temperature": self.temperature,
+            "log_priors": self.log_priors,
+            "unseen_log_likelihoods": self.unseen_log_likelihoods,
+            "log_likelihoods": {category: {str(feature): value for feature, value in likelihoods.items()}
+                                for category, likelihoods in self.log_likelihoods.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, model: Dict) -> "LocalClassifier":
+        if model.get("format") != _MODEL_FORMAT or model.get("num_features") != NUM_FEATURES:
+            raise ValueError("The saved model was trained with different features; retrain it.")
+        return cls(
+            model["log_priors"],
+            {category: {int(feature): value for feature, value in likelihoods.items()}
+             for category, likelihoods in model["log_likelihoods"].items()},
+            model["unseen_log_likelihoods"],
+            model["num_examples"],
+            model["temperature"],
+        )
+
+    def save(self, path: str = LOCAL_CLASSIFIER_PATH):
+        # Written to a temporary file first so a running app never loads a half-written model
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(f.name, path)
+
+    @classmethod
+    def load(cls, path: str = LOCAL_CLASSIFIER_PATH) -> Optional["LocalClassifier"]:
+        """Returns the saved model, or None if none has been trained yet."""
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def record_llm_labels(examples: Iterable[Tuple[str, str, str]],
+                      store: Optional[ClassificationStore] = classification_store):
+    """Keeps (subject, text, category) emails the LLM categorized as training examples for the next retrain."""
+    if store is not None:
+        store.put_training_examples((training_key(subject_line, text), subject_line, text, category)
+                                    for subject_line, text, category in examples if category)
+
+
+def retrain(path: str = LOCAL_CLASSIFIER_PATH, examples: Optional[Iterable[Tuple[str, str, str]]] = None,
+            min_examples: int = LOCAL_CLASSIFIER_MIN_EXAMPLES) -> LocalClassifier:
+    """
+    Trains a model from the LLM-labelled emails in the classification store (or from `examples`) and saves it.
+
+    Raises:
+        ValueError: If there are too few labelled emails, or no store to read them from
+    """
+    if examples is None:
+        if classification_store is None:
+            raise ValueError("No classification store is configured to read LLM-labelled emails from.")
+        examples = classification_store.iter_training_examples()
+    examples = list(examples)
+    if len(examples) < min_examples:
+        raise ValueError(f"Only {len(examples)} labelled emails; at least {min_examples} are needed to train.")
+    model = LocalClassifier.train(examples)
+    model.save(path)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-file", help="Train from a JSON list of emails with subject, body and label instead")
+    parser.add_argument("--min-examples", type=int, default=LOCAL_CLASSIFIER_MIN_EXAMPLES)
+    parser.add_argument("--output", default=LOCAL_CLASSIFIER_PATH)
+    args = parser.parse_args()
+
+    examples = None
+    if args.from_file:
+        from llm.email_preprocessor import preprocess_email
+        with open(args.from_file) as f:
+            examples = [(email["subject"], preprocess_email(email["body"]).text, email["label"])
+                        for email in json.load(f)]
+    try:
+        model = retrain(args.output, examples, args.min_examples)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"Trained on {model.num_examples} emails across {len(model.categories)} categories; saved to {args.output}")
@@ -1,8 +1,19 @@
+from contextlib import asynccontextmanager
 from api.main import api_router
+from api.routes.classification_queue import classification_queue
+from api.routes.email_analysis import get_email_categorization_agent
+from api.routes.gmail.http_client import start_http_client, close_http_client
+from api.routes.gmail.mutation_queue import label_mutation_queue
+from api.routes.gmail.utils import start_credential_refresher, stop_credential_refresher
+from db.email_repository import email_repository
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import os
 import uvicorn
 
+# Build the categorization agent while starting up rather than on the first analysis request
+WARM_UP_AGENT = os.environ.get("WARM_UP_AGENT", "").lower() in ("1", "true", "yes")
 
 # Configure CORS
 origins = [
@@ -11,10 +22,36 @@ origins = [
     "http://localhost:8000",
 ]
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP client for every Gmail and Google call made while the app runs
+    await start_http_client()
+    # Refreshes Gmail tokens ahead of expiry off the event loop, so requests never wait on a refresh
+    await start_credential_refresher()
+    if WARM_UP_AGENT:
+        await asyncio.to_thread(get_email_categorization_agent)
+    # Classifies synced emails in the background, resuming the jobs left pending by the last run
+    await classification_queue.start()
+    # Writes label changes to Gmail in the background, those left pending by the last run first
+    await label_mutation_queue.start()
+    # Writes classifications to Supabase in batches, when it is configured
+    if email_repository is not None:
+        await email_repository.start()
+    yield
+    if email_repository is not None:
+        await email_repository.stop()
+    await label_mutation_queue.stop()
+    await classification_queue.stop()
+    await stop_credential_refresher()
+    await close_http_client()
+
+
 app = FastAPI(
     title="Avon Mail API",
     description="APIs for Avon Mail",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -0,0 +1,45 @@
+import itertools
+from db.application_store import ApplicationStore
+
+
+def _email(message_id, thread_id, sender, received_at):
+    return {"id": message_id, "threadId": thread_id, "from": sender, "internalDate": received_at}
+
+
+EMAILS = [
+    _email("a", "t1", "Acme <hr@acme.com>", 1),
+    _email("b", "t1", "Bob <bob@gmail.com>", 5),
+    _email("c", "t1", "Carl <carl@agency.com>", 7),
+    _email("d", "t2", "Initech <jobs@initech.com>", 3),
+]
+RESULTS = {"a": {"category": "confirmation"}, "b": {"category": "action_required"},
+           "c": {"category": "rejected"}, "d": {"category": "confirmation"}}
+
+
+def _summary(store):
+    return sorted((application["application_key"], application["status"], application["emails"])
+                  for application in store.get_dashboard()["applications"])
+
+
+def test_grouping_does_not_depend_on_classification_order(tmp_path):
+    for i, order in enumerate(itertools.permutations(EMAILS)):
+        store = ApplicationStore(str(tmp_path / f"applications-{i}.sqlite3"))
+        for email_data in order:
+            store.record_classifications([email_data], RESULTS)
+
+        assert _summary(store) == [("acme.com", "rejected", 3), ("initech.com", "confirmation", 1)]
+        assert store.rebuild()["mismatches"] == {}
+
+
+def test_reclassified_and_deleted_emails_leave_their_application(tmp_path):
+    store = ApplicationStore(str(tmp_path / "applications.sqlite3"))
+    store.record_classifications(EMAILS, RESULTS)
+
+    store.record_classifications([EMAILS[2]], {"c": {"category": "others"}})
+    assert _summary(store) == [("acme.com", "action_required", 2), ("initech.com", "confirmation", 1)]
+
+    # The thread loses its earliest email, so it is keyed by the next one
+    store.discard(["a"])
+    assert _summary(store) == [("gmail.com|bob", "action_required", 1), ("initech.com", "confirmation", 1)]
+    assert store.get_dashboard()["counts"]["action_required"] == 1
+    assert store.rebuild()["mismatches"] == {}
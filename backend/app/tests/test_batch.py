@@ -0,0 +1,100 @@
+import asyncio
+import json
+from aiohttp import StreamReader
+from aiohttp.base_protocol import BaseProtocol
+from api.routes.gmail import get_mails
+from api.routes.gmail.batch import _build_batch_body, iter_batch_responses
+from api.routes.gmail.scheduler import GmailScheduler
+
+
+class FakeResponse:
+    """Just enough of aiohttp.ClientResponse for MultipartReader.from_response. Built inside the event loop."""
+
+    def __init__(self, boundary: str, body: bytes):
+        loop = asyncio.get_running_loop()
+        self.headers = {"Content-Type": f"multipart/mixed; boundary={boundary}"}
+        self.content = StreamReader(BaseProtocol(loop), 2 ** 16, loop=loop)
+        self.content.feed_data(body)
+        self.content.feed_eof()
+
+    async def release(self):
+        pass
+
+
+def _sub_response(boundary: str, content_id: str, status: str, payload) -> str:
+    body = json.dumps(payload) if payload is not None else ""
+    return "\r\n".join([
+        f"--{boundary}",
+        "Content-Type: application/http",
+        f"Content-ID: <{content_id}>",
+        "",
+        f"HTTP/1.1 {status}",
+        "Content-Type: application/json; charset=UTF-8",
+        "",
+        body,
+        "",
+    ])
+
+
+def _message(message_id):
+    return {"id": message_id, "threadId": "t-" + message_id, "labelIds": ["INBOX"], "snippet": "",
+            "payload": {"headers": [{"name": "Subject", "value": "About " + message_id}]}}
+
+
+def test_batch_body_holds_one_sub_request_per_id():
+    body = _build_batch_body(["m1", "m2"], "b", {"format": "metadata", "metadataHeaders": ["From", "Subject"]})
+    parts = body.decode().split("\r\n")
+
+    assert parts[-1] == "--b--"
+    assert parts.count("--b") == 2
+    assert "Content-ID: <msg-m1>" in parts
+    assert "GET /gmail/v1/users/me/messages/m2?format=metadata&metadataHeaders=From&metadataHeaders=Subject" in parts
+
+
+def test_batch_responses_are_matched_to_their_message_id():
+    boundary = "batch_response"
+    body = "".join([
+        _sub_response(boundary, "response-msg-m2", "200 OK", _message("m2")),
+        _sub_response(boundary, "response-msg-m1", "404 Not Found", {"error": {"code": 404}}),
+        # Gmail sometimes leaves the Content-ID out; the message's own ID is used instead
+        _sub_response(boundary, "", "200 OK", _message("m3")),
+        f"--{boundary}--\r\n",
+    ]).encode()
+
+    async def collect():
+        return [(message_id, status) async for message_id, status, _ in
+                iter_batch_responses(FakeResponse(boundary, body))]
+
+    assert asyncio.run(collect()) == [("m2", 200), ("m1", 404), ("m3", 200)]
+
+
+def test_failed_sub_requests_are_fetched_one_by_one(monkeypatch):
+    fetched_alone = []
+
+    async def fetch_messages_batch(session, token, message_ids, params):
+        for message_id in message_ids:
+            if message_id == "m2":
+                yield message_id, 500, None
+            elif message_id != "m3":
+                yield message_id, 200, _message(message_id)
+        # m3 is never answered
+
+    async def get_message_data(session, service, message_metadata, format="metadata"):
+        fetched_alone.append(message_metadata["id"])
+        return {"id": message_metadata["id"], "subject": "fetched alone"}
+
+    class Service:
+        class _http:
+            class credentials:
+                token = "token"
+
+    monkeypatch.setattr(get_mails, "fetch_messages_batch", fetch_messages_batch)
+    monkeypatch.setattr(get_mails, "_get_message_data_from_metadata", get_message_data)
+    monkeypatch.setattr(get_mails, "gmail_scheduler", GmailScheduler(quota_rate=10_000))
+
+    emails = asyncio.run(get_mails._get_batch_message_data_from_metadata(
+        None, Service(), [{"id": message_id} for message_id in ("m1", "m2", "m3", "m4")]))
+
+    assert sorted(fetched_alone) == ["m2", "m3"]
+    assert [(email["id"], email["subject"]) for email in emails] == [
+        ("m1", "About m1"), ("m2", "fetched alone"), ("m3", "fetched alone"), ("m4", "About m4")]
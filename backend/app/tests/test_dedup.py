@@ -0,0 +1,44 @@
+from llm.dedup import DedupItem, DuplicateIndex, fingerprint
+
+_TEMPLATE = ("Dear {name},\n\nThank you for your interest in the {role} position at {company}. After careful "
+             "review we have decided to move forward with other candidates whose experience more closely matches "
+             "our needs at this time. We will keep your resume on file for {months} months.\n\nBest regards,\n"
+             "The {company} Talent Team")
+
+
+def _item(message_id, name, role, company="Acme", months=6, thread_id="", sender="jobs@acme.com"):
+    text = _TEMPLATE.format(name=name, role=role, company=company, months=months)
+    return DedupItem(message_id, thread_id, sender, fingerprint(f"Your application to {company}", text))
+
+
+def test_copies_of_a_template_get_nearby_fingerprints():
+    first = _item("m1", "Jane", "Software Engineer", months=6)
+    second = _item("m2", "Omar", "Data Scientist", months=12)
+    other = DedupItem("m3", "", "jobs@acme.com", fingerprint(
+        "Interview invitation", "We would love to invite you to a video interview next week. Please pick a slot."))
+
+    assert (first.fingerprint ^ second.fingerprint).bit_count() <= 3
+    assert (first.fingerprint ^ other.fingerprint).bit_count() > 3
+
+
+def test_group_maps_near_duplicates_of_the_same_sender_to_the_first_one():
+    items = [
+        _item("m1", "Jane", "Software Engineer"),
+        _item("m2", "Omar", "Data Scientist"),
+        # Same template from another sender and thread: not grouped
+        _item("m3", "Jane", "Software Engineer", sender="jobs@globex.com"),
+        _item("m4", "Lee", "Product Designer", months=3),
+    ]
+
+    assert DuplicateIndex().group(items) == {"m2": "m1", "m4": "m1"}
+
+
+def test_find_returns_a_classified_duplicate_of_the_same_thread():
+    index = DuplicateIndex()
+    index.add(_item("m1", "Jane", "Software Engineer", thread_id="t1", sender=""), "rejected", "llm")
+
+    duplicate = index.find(_item("m2", "Omar", "Data Scientist", thread_id="t1", sender=""))
+
+    assert (duplicate.id, duplicate.category, duplicate.source) == ("m1", "rejected", "llm")
+    assert index.find(_item("m1", "Jane", "Software Engineer", thread_id="t1", sender="")) is None
+    assert index.find(_item("m3", "Omar", "Data Scientist", thread_id="t2", sender="")) is None
@@ -0,0 +1,110 @@
+import asyncio
+import pytest
+from db.email_repository import EMAILS_TABLE, JOB_APPLICATIONS_TABLE, EmailRepository, InMemoryBackend
+
+
+def _email(message_id, internal_date, sender="Acme Recruiting <jobs@acme.com>"):
+    return {"id": message_id, "threadId": "t-" + message_id, "from": sender, "subject": "Your application",
+            "internalDate": internal_date}
+
+
+class FailingBackend(InMemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+
+    def upsert(self, table, rows):
+        if self.fail:
+            raise ConnectionError("Supabase is unreachable")
+        super().upsert(table, rows)
+
+
+def test_writes_are_buffered_until_the_batch_is_full():
+    backend = InMemoryBackend()
+    repository = EmailRepository(backend, batch_size=3, flush_interval=60)
+
+    async def scenario():
+        await repository.save_classifications(
+            [_email("m1", 1), _email("m2", 2)],
+            {"m1": {"category": "rejected", "source": "llm"}, "m2": {"category": "confirmation", "source": "llm"}})
+        buffered_round_trips = backend.round_trips
+        # A later classification of a buffered email replaces it before anything is sent
+        await repository.save_classifications([_email("m1", 1)], {"m1": {"category": "accepted", "source": "llm"}})
+        await repository.save_classifications([_email("m3", 3)], {"m3": {"category": "other", "source": "llm"}})
+        return buffered_round_trips
+
+    assert asyncio.run(scenario()) == 0
+    emails = backend.tables[EMAILS_TABLE]
+    assert {key[1]: row["category"] for key, row in emails.items()} == {
+        "m1": "accepted", "m2": "confirmation", "m3": "other"}
+    assert set(key[1] for key in backend.tables[JOB_APPLICATIONS_TABLE]) == {"m1", "m2"}
+    # One upsert per table, plus the delete of the record m3 never had
+    assert backend.round_trips == 3
+    assert repository.get_stats()["pending_rows"] == 0
+
+
+def test_reclassification_without_reasoning_keeps_the_stored_one():
+    backend = InMemoryBackend()
+    repository = EmailRepository(backend, batch_size=100, flush_interval=60)
+
+    async def scenario():
+        await repository.save_classifications(
+            [_email("m1", 1)], {"m1": {"category": "rejected", "source": "llm", "reasoning": "Declines politely"}})
+        await repository.flush()
+        # A cached answer carries no reasoning
+        await repository.save_classifications([_email("m1", 1)], {"m1": {"category": "rejected", "source": "cache"}})
+        await repository.save_classifications(
+            [_email("m2", 2)], {"m2": {"category": "accepted", "source": "llm", "reasoning": "Offer attached"}})
+        await repository.flush()
+        return await repository.get_classifications(["m1", "m2"])
+
+    stored = asyncio.run(scenario())
+    assert stored["m1"]["reasoning"] == "Declines politely"
+    assert stored["m1"]["source"] == "cache"
+    assert stored["m2"]["reasoning"] == "Offer attached"
+
+
+def test_rows_of_a_failed_flush_stay_buffered():
+    backend = FailingBackend()
+    repository = EmailRepository(backend, batch_size=100, flush_interval=60)
+
+    async def scenario():
+        await repository.save_classifications([_email("m1", 1)], {"m1": {"category": "rejected", "source": "llm"}})
+        with pytest.raises(ConnectionError):
+            await repository.flush()
+        # Buffered after the failed flush, so it wins over the kept row
+        await repository.save_classifications([_email("m1", 1)], {"m1": {"category": "accepted", "source": "llm"}})
+        backend.fail = False
+        await repository.flush()
+
+    asyncio.run(scenario())
+    assert backend.tables[EMAILS_TABLE][("me", "m1")]["category"] == "accepted"
+    assert backend.tables[JOB_APPLICATIONS_TABLE][("me", "m1")]["status"] == "accepted"
+    stats = repository.get_stats()
+    assert stats["failed_flushes"] == 1
+    assert stats["pending_rows"] == 0
+
+
+def test_pages_follow_the_cursor_without_gaps_or_repeats():
+    backend = InMemoryBackend()
+    repository = EmailRepository(backend, batch_size=100, flush_interval=60)
+    # Emails received at the same time are ordered by message ID
+    emails = [_email(f"m{i:02d}", 1000 + i // 3) for i in range(10)]
+
+    async def scenario():
+        await repository.save_classifications(emails, {email["id"]: {"category": "rejected", "source": "llm"}
+                                                       for email in emails})
+        await repository.flush()
+        pages, cursor = [], None
+        while True:
+            page = await repository.list_emails(limit=4, cursor=cursor)
+            pages.append([row["message_id"] for row in page["emails"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    pages = asyncio.run(scenario())
+    assert [len(page) for page in pages] == [4, 4, 2]
+    expected = [email["id"] for email in sorted(emails, key=lambda email: (email["internalDate"], email["id"]),
+                                                reverse=True)]
+    assert [message_id for page in pages for message_id in page] == expected
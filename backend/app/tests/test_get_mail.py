@@ -0,0 +1,59 @@
+import base64
+from api.routes.gmail.get_mail import _extract_body, _find_text_parts, _html_to_text
+
+
+def _leaf(mime_type, text, charset="utf-8", filename=""):
+    return {
+        "mimeType": mime_type,
+        "filename": filename,
+        "headers": [{"name": "Content-Type", "value": f'{mime_type}; charset="{charset}"'}],
+        "body": {"size": len(text), "data": base64.urlsafe_b64encode(text.encode(charset)).decode()},
+    }
+
+
+def _attachment(mime_type, filename):
+    return {"mimeType": mime_type, "filename": filename, "headers": [], "body": {"size": 1000, "attachmentId": "a1"}}
+
+
+def _multipart(mime_type, *parts):
+    return {"mimeType": mime_type, "filename": "", "headers": [], "body": {"size": 0}, "parts": list(parts)}
+
+
+_HTML = "<html><head><title>Ignored</title><style>p {color: red}</style></head>" \
+        "<body><p>Thank you for applying&nbsp;to Acme.</p><!-- tracking --><p>Best,<br>Acme</p></body></html>"
+
+
+def test_alternative_prefers_the_plain_text_part():
+    plain = _leaf("text/plain", "Thank you for applying.")
+    html = _leaf("text/html", _HTML)
+
+    assert _find_text_parts(_multipart("multipart/alternative", html, plain)) == (plain, html)
+    assert _extract_body(_multipart("multipart/alternative", plain, html)) == "Thank you for applying."
+
+
+def test_html_only_message_is_converted_to_visible_text():
+    assert _extract_body(_leaf("text/html", _HTML)) == "Thank you for applying\xa0to Acme.\n\nBest,\nAcme"
+
+
+def test_nested_parts_are_walked_in_document_order_skipping_attachments():
+    payload = _multipart(
+        "multipart/mixed",
+        _multipart("multipart/related",
+                   _multipart("multipart/alternative", _leaf("text/html", "<p>Interview invite</p>")),
+                   _attachment("image/png", "logo.png")),
+        _leaf("text/plain", "resume as text", filename="resume.txt"),
+        _attachment("application/pdf", "offer.pdf"))
+
+    plain_part, html_part = _find_text_parts(payload)
+    assert plain_part is None
+    assert _extract_body(payload) == "Interview invite"
+
+
+def test_body_is_decoded_with_the_part_charset_and_capped():
+    payload = _leaf("text/plain", "Café René " * 10, charset="iso-8859-1")
+
+    assert _extract_body(payload, max_chars=10) == "Café René "
+
+
+def test_unclosed_script_drops_the_rest_of_the_document():
+    assert _html_to_text("<p>Hello</p><script>track(") == "Hello"
@@ -0,0 +1,26 @@
+from llm.keyword_matcher import KeywordMatcher
+
+
+def _keywords(text):
+    return [(hit.keyword, hit.category) for hit in KeywordMatcher().find(text)]
+
+
+def test_keywords_only_match_whole_words():
+    assert _keywords("Reduce your carbon footprint; our assessments start soon") == []
+    assert _keywords("Your OTP is 123456") == [("otp", "action_required")]
+
+
+def test_keyword_words_may_be_split_across_lines():
+    assert _keywords("We regret to\ninform you that\tthe role is filled") == [
+        ("regret to inform you", "rejected")]
+
+
+def test_longest_keyword_wins_where_matches_overlap():
+    assert _keywords("Complete the online assessment. Next steps: wait.") == [
+        ("online assessment", "action_required"), ("next steps", "action_required")]
+
+
+def test_curly_apostrophes_match_straight_ones():
+    hits = KeywordMatcher().find("We won’t be moving forward")
+
+    assert [(hit.keyword, hit.start, hit.end) for hit in hits] == [("won't be moving forward", 3, 26)]
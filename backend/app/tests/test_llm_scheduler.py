@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from llm.llm_scheduler import LLMScheduler, LLMUnavailableError
+
+
+def _calls(*behaviours):
+    """Returns a call performing the given behaviours in turn, and the list of calls it cancelled."""
+    cancelled = []
+    remaining = list(behaviours)
+
+    async def call():
+        delay, outcome = remaining.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(outcome)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, cancelled
+
+
+def test_slow_request_is_raced_by_a_hedge():
+    scheduler = LLMScheduler(max_concurrency=2, hedge_after=0.02)
+    call, cancelled = _calls((10, "slow"), (0, "hedge"))
+
+    assert asyncio.run(scheduler.run(call)) == "hedge"
+    assert cancelled == ["slow"]
+    stats = scheduler.get_stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_hedge_waits_for_its_twin_when_the_first_request_fails():
+    scheduler = LLMScheduler(max_concurrency=2, hedge_after=0.02)
+    call, _ = _calls((0.05, ConnectionError("reset")), (0.1, "hedge"))
+
+    assert asyncio.run(scheduler.run(call)) == "hedge"
+    assert scheduler.get_stats()["retries"] == 0
+
+
+def test_no_hedge_without_a_free_slot():
+    scheduler = LLMScheduler(max_concurrency=1, hedge_after=0.02)
+    call, _ = _calls((0.1, "first"))
+
+    assert asyncio.run(scheduler.run(call)) == "first"
+    assert scheduler.get_stats()["hedges"] == 0
+
+
+def test_deadline_covers_queueing_and_retries():
+    scheduler = LLMScheduler(attempt_timeout=0.05, deadline=0.12, max_retries=10, base_delay=0)
+    call, _ = _calls(*[(10, "never")] * 11)
+
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(scheduler.run(call))
+    stats = scheduler.get_stats()
+    assert stats["deadline_exceeded"] == 1
+    assert stats["retries"] >= 1
+
+
+def test_transient_errors_are_retried_until_the_last_attempt():
+    scheduler = LLMScheduler(max_retries=2, base_delay=0)
+    call, _ = _calls(*[(0, ConnectionError("reset"))] * 3)
+
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(scheduler.run(call))
+    stats = scheduler.get_stats()
+    assert (stats["retries"], stats["failures"]) == (2, 1)
+
+
+def test_other_errors_are_not_retried():
+    scheduler = LLMScheduler(max_retries=2, base_delay=0)
+    call, _ = _calls((0, ValueError("bad prompt")))
+
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.run(call))
+    assert scheduler.get_stats()["retries"] == 0
@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+import pytest
+from llm.email_agent import EmailCategorizationAgent
+from llm.local_classifier import LocalClassifier, retrain
+
+_COMPANIES = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Wonka", "Tyrell", "Cyberdyne"]
+
+
+def _examples():
+    examples = []
+    for i, company in enumerate(_COMPANIES * 3):
+        examples.append((f"Your application to {company}",
+                         f"Unfortunately we will not be moving forward with your candidacy at {company}. "
+                         f"We wish you luck in your search. Reference {i}.", "rejected"))
+        examples.append((f"Thank you for applying to {company}",
+                         f"We have received your application to {company} and will review it shortly. "
+                         f"Reference {i}.", "confirmation"))
+    return examples
+
+
+def _agent(model, threshold=0.95):
+    return SimpleNamespace(local_classifier=model, local_classifier_threshold=threshold)
+
+
+def _state(subject_line, text):
+    return {"subject_line": subject_line, "prompt_email": text}
+
+
+def test_confident_answers_skip_the_llm():
+    model = LocalClassifier.train(_examples())
+    state = _state("Your application to Soylent",
+                   "Unfortunately we will not be moving forward with your candidacy. We wish you luck.")
+
+    result = EmailCategorizationAgent._local_classify(_agent(model), state)
+
+    assert result["final"] == "rejected"
+    assert result["source"] == "local"
+    assert result["local_confidence"] >= 0.95
+
+
+def test_unsure_answers_go_on_to_the_llm():
+    model = LocalClassifier.train(_examples())
+    # No word the model was trained on, so only the equal priors are left
+    state = _state("Soylent", "Hello there")
+
+    category, confidence = model.predict(state["subject_line"], state["prompt_email"])
+    result = EmailCategorizationAgent._local_classify(_agent(model), state)
+
+    assert confidence < 0.95
+    assert result == {"final": '', "local_confidence": confidence}
+    # The same answer passes a lower threshold
+    assert EmailCategorizationAgent._local_classify(_agent(model, threshold=confidence), state)["final"] == category
+
+
+def test_no_model_leaves_every_email_to_the_llm():
+    assert EmailCategorizationAgent._local_classify(_agent(None), _state("Hi", "Hello")) == {"final": ''}
+
+
+def test_saved_model_predicts_as_the_trained_one(tmp_path):
+    path = str(tmp_path / "local_classifier.json")
+    model = retrain(path, _examples(), min_examples=10)
+
+    loaded = LocalClassifier.load(path)
+
+    assert loaded.temperature == model.temperature
+    assert loaded.predict("Hello", "received your application") == model.predict("Hello", "received your application")
+    with pytest.raises(ValueError):
+        retrain(path, _examples()[:4], min_examples=10)
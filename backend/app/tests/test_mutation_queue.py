@@ -0,0 +1,46 @@
+import asyncio
+from api.routes.gmail import mutation_queue
+from api.routes.gmail.mutation_queue import LabelMutationQueue
+from db.label_changes import LabelChangeStore
+from db.message_store import MessageStore
+
+
+def test_change_undone_while_written_is_written_back(tmp_path, monkeypatch):
+    store = MessageStore(str(tmp_path / "messages.sqlite3"))
+    store.put_many([{"id": "m1", "threadId": "t1", "labels": ["INBOX"]}])
+    monkeypatch.setattr(mutation_queue, "message_store", store)
+
+    gmail = {"m1": {"INBOX"}}
+    writing = asyncio.Event()
+    release = asyncio.Event()
+
+    async def write(user_id, message_ids, add, remove):
+        writing.set()
+        await release.wait()
+        for message_id in message_ids:
+            gmail[message_id] = (gmail[message_id] - remove) | add
+        return {message_id: {"status": "success"} for message_id in message_ids}
+
+    queue = LabelMutationQueue(LabelChangeStore(str(tmp_path / "changes.sqlite3")), flush_interval=60)
+    monkeypatch.setattr(queue, "_write", write)
+
+    async def scenario():
+        # Recorded while the flush loop runs, so nothing is written inline
+        queue._task = asyncio.create_task(asyncio.sleep(3600))
+        queue._wake = asyncio.Event()
+        await queue.record(["m1"], add=["STARRED"])
+        flush = asyncio.create_task(queue.flush())
+        await writing.wait()
+        undone = await queue.record(["m1"], remove=["STARRED"])
+        release.set()
+        await flush
+        await queue.flush()
+        queue._task.cancel()
+        return undone
+
+    undone = asyncio.run(scenario())
+
+    assert undone["m1"] == {"labels": ["INBOX"], "pending": True}
+    assert gmail["m1"] == {"INBOX"}
+    assert store.get("m1")["labels"] == ["INBOX"]
+    assert queue.get_status()["pending"] == 0
@@ -0,0 +1,36 @@
+import asyncio
+import time
+import pytest
+from googleapiclient.errors import HttpError
+from api.routes.gmail.scheduler import GmailScheduler, RetryableStatusError, TokenBucket
+
+
+def test_oversized_call_leaves_the_bucket_in_debt():
+    bucket = TokenBucket(rate=1000, capacity=100)
+
+    async def scenario():
+        start = time.monotonic()
+        # More than the bucket holds: waits for a full bucket and is charged in full
+        await bucket.acquire(200)
+        charged_at = time.monotonic()
+        # 100 units of debt plus 50 units of cost, refilled at 1000 per second
+        await bucket.acquire(50)
+        return charged_at - start, time.monotonic() - charged_at
+
+    first, second = asyncio.run(scenario())
+    assert first < 0.05
+    assert 0.14 <= second < 0.5
+
+
+def test_retryable_status_surfaces_as_http_error_after_the_last_retry():
+    scheduler = GmailScheduler(quota_rate=10_000, max_retries=2, base_delay=0)
+    attempts = []
+
+    async def call():
+        attempts.append(len(attempts))
+        raise RetryableStatusError(503, "Backend Error")
+
+    with pytest.raises(HttpError) as raised:
+        asyncio.run(scheduler.run("get", call))
+    assert raised.value.resp.status == 503
+    assert len(attempts) == 3